@@ -13,12 +13,18 @@ setup(
     description='Python clients and utilities for Zyn',
     packages=find_packages(),
     install_requires=open(path_requirements).readlines(),
+    extras_require={
+        'fsspec': ['fsspec'],
+    },
     entry_points={
         'console_scripts': [
             'zyn-shell=zyn.main:shell',
             'zyn-cli=zyn.main:cli',
             'zyn-webserver=zyn.main:webserver',
-        ]
+        ],
+        'fsspec.specs': [
+            'zyn=zyn.client.filesystem.ZynFileSystem',
+        ],
     },
     data_files=[
         ('zyn-web-static', [
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Measures memory usage and load time of client state with large number of tracked elements
+#
+# Example: ./benchmark-client-state.py --elements 1000000
+
+import argparse
+import logging
+import os.path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PATH_FILE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(PATH_FILE, '..'))
+
+import zyn.connection  # noqa: E402
+from zyn.client.client import State  # noqa: E402
+from zyn.client.data import (  # noqa: E402
+    LocalDirectory,
+    LocalFile,
+    LocalFilesystemManager,
+)
+
+
+def _rss_mb():
+    with open('/proc/self/statm', 'r') as fp:
+        pages = int(fp.read().split()[1])
+    return pages * resource.getpagesize() / 1024 / 1024
+
+
+def _print(phase, started, rss_started):
+    print('{:<24} time: {:8.2f} s, rss: {:8.1f} MB (+{:.1f} MB)'.format(
+        phase,
+        time.time() - started,
+        _rss_mb(),
+        _rss_mb() - rss_started,
+    ))
+
+
+def _create(path_state, number_of_elements, files_per_directory, log):
+    rss = _rss_mb()
+    started = time.time()
+    fs = LocalFilesystemManager(os.path.dirname(path_state), log)
+    node_id = 1
+    directory = None
+    while node_id < number_of_elements:
+        if node_id % (files_per_directory + 1) == 1:
+            directory = LocalDirectory('/dir-{}'.format(node_id), fs, node_id)
+            fs._add_element_to_filesystem(directory, fs.local_element_from_node_id(0))
+        else:
+            element = LocalFile(
+                '{}/file-{}'.format(directory.path_remote(), node_id),
+                zyn.connection.FILE_TYPE_BLOB,
+                fs,
+                node_id,
+                1,
+            )
+            fs._add_element_to_filesystem(element, directory)
+        node_id += 1
+    _print('Create elements', started, rss)
+
+    started = time.time()
+    state = State('user', '127.0.0.1', 4433, fs)
+    state.to_file(path_state)
+    state.close()
+    _print('Save state', started, rss)
+
+
+def _load(path_state, log):
+    rss = _rss_mb()
+    started = time.time()
+    state = State.from_file(path_state, log)
+    _print('Open state', started, rss)
+
+    started = time.time()
+    state.fs.local_element_from_remote_path('/dir-1/file-2')
+    _print('Resolve single path', started, rss)
+
+    started = time.time()
+    elements = state.fs._all_elements()
+    _print('Load all elements', started, rss)
+
+    started = time.time()
+    for e in elements.values():
+        e.path_remote()
+    _print('Derive all paths', started, rss)
+    state.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--elements', type=int, default=1000000)
+    parser.add_argument('--files-per-directory', type=int, default=1000)
+    parser.add_argument('--phase', choices=['create', 'load'], default=None)
+    parser.add_argument('--path-state', default=None)
+    args = parser.parse_args()
+    log = logging.getLogger('benchmark')
+
+    if args.phase == 'create':
+        _create(args.path_state, args.elements, args.files_per_directory, log)
+        return
+    if args.phase == 'load':
+        _load(args.path_state, log)
+        return
+
+    # Phases are run in separate processes so that memory used by
+    # creating the elements is not included in load numbers
+    with tempfile.TemporaryDirectory() as path_dir:
+        path_state = os.path.join(path_dir, 'state')
+        print('Elements: {}, files per directory: {}'.format(
+            args.elements,
+            args.files_per_directory,
+        ))
+        for phase in ['create', 'load']:
+            subprocess.check_call([
+                sys.executable,
+                os.path.abspath(__file__),
+                '--phase', phase,
+                '--path-state', path_state,
+                '--elements', str(args.elements),
+                '--files-per-directory', str(args.files_per_directory),
+            ])
+
+
+if __name__ == '__main__':
+    main()
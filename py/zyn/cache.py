@@ -0,0 +1,292 @@
+import collections
+import logging
+import os
+import os.path
+import tempfile
+import threading
+
+
+BLOCK_CACHE_SIZE = 64 * 1024 * 1024
+BLOCK_CACHE_SIZE_ON_DISK = 1024 * 1024 * 1024
+BLOCK_CACHE_MEMORY_FILE_SIZE = 16 * 1024 * 1024
+BLOCK_CACHE_FILL_WAIT_TIMEOUT_SECONDS = 10
+
+
+def _block_filename(key):
+    (server_id, node_id, created), revision, index = key
+    return '{}-{}-{}-{}-{}'.format(server_id, node_id, created, revision, index)
+
+
+def _parse_block_filename(filename):
+    try:
+        values = [int(v) for v in filename.split('-')]
+    except ValueError:
+        return None
+    if len(values) != 5:
+        return None
+    return tuple(values[:3]), values[3], values[4]
+
+
+def _is_unidentified_block_filename(filename):
+    # Blocks were earlier keyed only by node id, revision and block index,
+    # those can not be told apart from blocks of recreated files
+    try:
+        return len([int(v) for v in filename.split('-')]) == 3
+    except ValueError:
+        return False
+
+
+# Content of file blocks keyed by (file_id, revision, block index), file_id is
+# (server id, node id, creation time of file). Server reuses node ids of
+# deleted files and revision of new file starts from zero, creation time
+# tells a recreated file apart. Server id changes when server is restarted,
+# so blocks cached from one server are not read for files of another server
+# sharing the directory. Revision changes on every modification, so stored
+# content is never out of date for its key, blocks of old revisions are
+# dropped when server notifies of modifications or evicted as least recently
+# used. Blocks are kept in memory and optionally in a directory, directory can
+# be shared by processes. When directory is used, blocks of files larger than
+# max_file_size_in_memory are kept only on disk so that memory is left for
+# small files. Can be shared by connections, connections reading same missing
+# block wait for the first one to read it instead of all reading it from server.
+# Files are read and written without holding the lock of the cache, so that
+# reads of blocks in memory are not delayed by disk
+class BlockCache:
+    def __init__(
+            self,
+            max_size=BLOCK_CACHE_SIZE,
+            path=None,
+            max_size_on_disk=None,
+            max_file_size_in_memory=BLOCK_CACHE_MEMORY_FILE_SIZE,
+            fill_wait_timeout=BLOCK_CACHE_FILL_WAIT_TIMEOUT_SECONDS,
+    ):
+        self._max_size = max_size
+        self._path = path
+        self._max_size_on_disk = max_size_on_disk or BLOCK_CACHE_SIZE_ON_DISK
+        self._max_file_size_in_memory = max_file_size_in_memory
+        self._fill_wait_timeout = fill_wait_timeout
+        self._lock = threading.Lock()
+        self._fills = {}
+        self._disk_writes = set()
+        self._log = logging.getLogger(__name__)
+        self._blocks = collections.OrderedDict()
+        self._size = 0
+        self._blocks_on_disk = collections.OrderedDict()
+        self._size_on_disk = 0
+        self._number_of_hits = 0
+        self._number_of_disk_hits = 0
+        self._number_of_misses = 0
+        self._number_of_evictions = 0
+        self._number_of_invalidations = 0
+        self._number_of_fill_waits = 0
+        self._number_of_fill_wait_timeouts = 0
+        if self._path is not None:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        os.makedirs(self._path, exist_ok=True)
+        entries = []
+        for e in os.scandir(self._path):
+            if _is_unidentified_block_filename(e.name):
+                self._remove_from_disk(e.name)
+                continue
+            key = _parse_block_filename(e.name)
+            if key is None or not e.is_file():
+                continue
+            stat = e.stat()
+            entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._blocks_on_disk[key] = size
+            self._size_on_disk += size
+        for filename in self._evict_from_disk():
+            self._remove_from_disk(filename)
+
+    def max_size(self):
+        return self._max_size
+
+    def size(self):
+        return self._size
+
+    def size_on_disk(self):
+        return self._size_on_disk
+
+    def get(self, file_id, revision, index, file_size=None):
+        key = (file_id, revision, index)
+        with self._lock:
+            data = self._get_from_memory(key)
+        if data is None:
+            data = self._get_from_disk(key, file_size)
+        return data
+
+    def get_or_lock(self, file_id, revision, index, file_size=None):
+        # Returns (data, is_locked). If block is not cached, caller is expected
+        # to read the block and put() it if read succeeded, and release() it
+        # when is_locked is set. Callers for the same block wait until block
+        # is released, or until wait times out in case the first reader is
+        # stuck, and then read the block themselves without locking it
+        key = (file_id, revision, index)
+        while True:
+            with self._lock:
+                data = self._get_from_memory(key)
+                if data is not None:
+                    return data, False
+                event = self._fills.get(key, None)
+                if event is None:
+                    self._fills[key] = threading.Event()
+                else:
+                    self._number_of_fill_waits += 1
+
+            if event is None:
+                data = self._get_from_disk(key, file_size)
+                if data is not None:
+                    self.release(file_id, revision, index)
+                    return data, False
+                return None, True
+
+            if not event.wait(self._fill_wait_timeout):
+                with self._lock:
+                    self._number_of_fill_wait_timeouts += 1
+                return None, False
+
+    def release(self, file_id, revision, index):
+        with self._lock:
+            event = self._fills.pop((file_id, revision, index), None)
+        if event is not None:
+            event.set()
+
+    def put(self, file_id, revision, index, data, file_size=None):
+        key = (file_id, revision, index)
+        data = bytes(data)
+        with self._lock:
+            if self._keep_in_memory(file_size):
+                self._add_to_memory(key, data)
+            is_written = self._path is not None \
+                and key not in self._blocks_on_disk \
+                and key not in self._disk_writes
+            if is_written:
+                self._disk_writes.add(key)
+        if is_written:
+            self._write_to_disk(key, data)
+
+    def invalidate(self, file_id):
+        # Blocks on disk are left to be evicted, they are of older
+        # revisions than the file and are not read again
+        with self._lock:
+            for key in [k for k in self._blocks.keys() if k[0] == file_id]:
+                self._size -= len(self._blocks.pop(key))
+                self._number_of_invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'size-on-disk': self._size_on_disk,
+                'number-of-blocks': len(self._blocks),
+                'number-of-blocks-on-disk': len(self._blocks_on_disk),
+                'hits': self._number_of_hits,
+                'disk-hits': self._number_of_disk_hits,
+                'misses': self._number_of_misses,
+                'evictions': self._number_of_evictions,
+                'invalidations': self._number_of_invalidations,
+                'fill-waits': self._number_of_fill_waits,
+                'fill-wait-timeouts': self._number_of_fill_wait_timeouts,
+            }
+
+    def _keep_in_memory(self, file_size):
+        return self._path is None \
+            or file_size is None \
+            or file_size <= self._max_file_size_in_memory
+
+    def _get_from_memory(self, key):
+        data = self._blocks.get(key, None)
+        if data is not None:
+            self._blocks.move_to_end(key)
+            self._number_of_hits += 1
+        return data
+
+    def _get_from_disk(self, key, file_size):
+        with self._lock:
+            is_on_disk = key in self._blocks_on_disk
+        data = None
+        if is_on_disk:
+            data = self._read_from_disk(key)
+
+        with self._lock:
+            if data is None:
+                self._number_of_misses += 1
+                return None
+            self._number_of_hits += 1
+            self._number_of_disk_hits += 1
+            if key in self._blocks_on_disk:
+                self._blocks_on_disk.move_to_end(key)
+            if self._keep_in_memory(file_size):
+                self._add_to_memory(key, data)
+        return data
+
+    def _add_to_memory(self, key, data):
+        if len(data) > self._max_size:
+            return
+        if key in self._blocks:
+            self._size -= len(self._blocks.pop(key))
+        self._blocks[key] = data
+        self._size += len(data)
+        while self._size > self._max_size:
+            _, evicted = self._blocks.popitem(last=False)
+            self._size -= len(evicted)
+            self._number_of_evictions += 1
+
+    def _read_from_disk(self, key):
+        try:
+            with open(os.path.join(self._path, _block_filename(key)), 'rb') as fp:
+                return fp.read()
+        except FileNotFoundError:
+            # Evicted by other process
+            with self._lock:
+                self._size_on_disk -= self._blocks_on_disk.pop(key, 0)
+            return None
+
+    def _write_to_disk(self, key, data):
+        evicted = []
+        try:
+            if len(data) > self._max_size_on_disk:
+                return
+            fd, path_tmp = tempfile.mkstemp(dir=self._path, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(path_tmp, os.path.join(self._path, _block_filename(key)))
+        except OSError as e:
+            self._log.warning('Failed to write block to disk cache, error="{}"'.format(e))
+            return
+        else:
+            with self._lock:
+                self._blocks_on_disk[key] = len(data)
+                self._size_on_disk += len(data)
+                evicted = self._evict_from_disk()
+        finally:
+            with self._lock:
+                self._disk_writes.discard(key)
+
+        for filename in evicted:
+            self._remove_from_disk(filename)
+
+    def _evict_from_disk(self):
+        # Returns names of files to remove
+        evicted = []
+        while self._size_on_disk > self._max_size_on_disk:
+            key, size = self._blocks_on_disk.popitem(last=False)
+            self._size_on_disk -= size
+            self._number_of_evictions += 1
+            evicted.append(_block_filename(key))
+        return evicted
+
+    def _remove_from_disk(self, filename):
+        try:
+            os.remove(os.path.join(self._path, filename))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,418 @@
+import concurrent.futures
+import os
+import os.path
+import threading
+import time
+
+import zyn.connection
+import zyn.exception
+import zyn.util
+from zyn.client.data import (
+    LocalDirectory,
+    LocalFile,
+    ZynClientException,
+    push_file_content,
+)
+
+
+RANGE_SIZE = 8 * 1024 * 1024
+_PROGRESS_INTERVAL_SECONDS = 2
+
+
+def _concurrency_description(pool):
+    if pool is None or pool.limiter() is None:
+        return ''
+    return ', concurrency {}'.format(pool.limiter().limit())
+
+
+# Executed in worker threads, each read uses its own connection from
+# the pool and releases its file handle after the read
+def _read_range(pool, priority, pending, offset, size, revision):
+    node_id = pending.node_id
+    pending.create_tmp()
+    with pool.connection(priority) as connection:
+        rsp = connection.open_read_handle(node_id=node_id)
+        zyn.util.check_server_response(rsp)
+        open_rsp = rsp.as_open_rsp()
+        try:
+            if revision is not None and open_rsp.revision != revision:
+                raise ZynClientException(
+                    'File was modified during fetch, node_id={}'.format(node_id)
+                )
+            if size is None:
+                size = open_rsp.size
+
+            with open(pending.path_tmp, 'r+b') as fp:
+                stream = zyn.connection.InputFileRangeStream(fp)
+                connection.read_file_stream(node_id, offset, size, open_rsp.block_size, stream)
+                if stream.is_error():
+                    zyn.util.check_server_response(stream.error_rsp())
+        finally:
+            rsp = connection.release_read_handle(node_id)
+            if rsp is not None:
+                zyn.util.check_server_response(rsp)
+    return open_rsp.revision, size
+
+
+class _PendingFile:
+    def __init__(
+            self,
+            element,
+            parent,
+            node_id,
+            path_tmp,
+            number_of_ranges,
+            revision=None,
+            size=None,
+    ):
+        self.element = element
+        self.parent = parent
+        self.node_id = node_id
+        self.path_tmp = path_tmp
+        self.ranges_remaining = number_of_ranges
+        self.revision = revision
+        self.size = size
+        self.error = None
+        self._lock = threading.Lock()
+        self._is_tmp_created = False
+
+    # Temporary file is created by the first transfer that starts, so that
+    # queued files do not leave temporary files behind if fetch is interrupted
+    def create_tmp(self):
+        with self._lock:
+            if self._is_tmp_created:
+                return
+            with open(self.path_tmp, 'wb') as fp:
+                if self.size is not None:
+                    fp.truncate(self.size)
+            self._is_tmp_created = True
+
+
+# Fetches directory tree using a pool of connections:
+# directories are listed with the main connection ahead of the transfers,
+# files are read in worker threads into temporary files and large files are
+# read in ranges in parallel. Elements are moved into place and added to
+# the tracked state in the calling thread as each file completes
+class BulkFetch:
+    def __init__(
+            self,
+            fs,
+            connection,
+            pool,
+            log,
+            range_size=None,
+            priority=zyn.connection.PRIORITY_BULK,
+    ):
+        self._fs = fs
+        self._connection = connection
+        self._pool = pool
+        self._log = log
+        self._priority = priority
+        self._range_size = range_size or RANGE_SIZE
+        self._executor = None
+        self._futures = {}
+        self._fetched = []
+        self._number_of_files = 0
+        self._number_of_files_done = 0
+        self._bytes_fetched = 0
+        self._started = None
+        self._progress_printed = None
+
+    def fetch_children(self, parent, overwrite=False):
+        self._started = time.time()
+        self._progress_printed = self._started
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._pool.max_number_of_connections()
+        )
+        try:
+            directories = [parent]
+            while directories:
+                directory = directories.pop(0)
+                self._fs.print_progress('Fetching files in "{}"'.format(directory.path_remote()))
+                directories += self._list_directory(directory, overwrite)
+                self._process_completed(block=False)
+
+            while self._futures:
+                self._process_completed(block=True)
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            for p in set(self._futures.values()):
+                self._remove_tmp(p)
+            self._futures = {}
+
+        self._print_progress(force=True)
+        return self._fetched
+
+    def _list_directory(self, parent, overwrite):
+        directories = []
+        rsp = self._fs.query_fs_children(parent, self._connection)
+        for e in rsp.elements:
+            if self._fs.is_tracked(node_id=e.node_id):
+                element = self._fs.local_element_from_node_id(e.node_id)
+                if element.is_directory():
+                    directories.append(element)
+                continue
+
+            path_remote = zyn.util.join_remote_paths([parent.path_remote(), e.name])
+            try:
+                if e.is_file():
+                    element = LocalFile.create_empty(path_remote, e.file_type, self._fs)
+                    self._submit_file(element, parent, e, overwrite)
+                elif e.is_directory():
+                    element = LocalDirectory.create_empty(path_remote, self._fs)
+                    element = self._fs.fetch_element_and_add_to_tracked(
+                        self._connection,
+                        parent,
+                        element,
+                        overwrite,
+                    )
+                    self._fetched.append(element)
+                    directories.append(element)
+                else:
+                    zyn.util.unhandled()
+            except zyn.exception.ZynException:
+                self._log.exception('Failed to fetch element "{}"'.format(path_remote))
+        return directories
+
+    def _submit_file(self, element, parent, e, overwrite):
+        path_local = element.path_local()
+        if not overwrite and self._fs.local_entry(path_local) is not None:
+            raise ZynClientException('Local file already exists, path: "{}"'.format(
+                element.path_remote(),
+            ))
+
+        path_tmp = os.path.join(
+            os.path.dirname(path_local),
+            '.zyn-fetch-{}-{}'.format(e.node_id, os.getpid()),
+        )
+        self._number_of_files += 1
+
+        if e.size <= self._range_size:
+            pending = _PendingFile(element, parent, e.node_id, path_tmp, 1)
+            self._submit(pending, 0, None, None)
+            return
+
+        # Large files are read in ranges, all ranges must be read from same revision
+        open_rsp = self._fs.open_read(element.path_remote(), self._connection)
+        self._fs.release_read(open_rsp.node_id, self._connection)
+
+        block_size = open_rsp.block_size
+        range_size = max(block_size, self._range_size // block_size * block_size)
+        offsets = list(range(0, open_rsp.size, range_size))
+        pending = _PendingFile(
+            element,
+            parent,
+            open_rsp.node_id,
+            path_tmp,
+            len(offsets),
+            open_rsp.revision,
+            open_rsp.size,
+        )
+        for offset in offsets:
+            self._submit(
+                pending,
+                offset,
+                min(range_size, open_rsp.size - offset),
+                open_rsp.revision,
+            )
+
+    def _submit(self, pending, offset, size, revision):
+        future = self._executor.submit(
+            _read_range,
+            self._pool,
+            self._priority,
+            pending,
+            offset,
+            size,
+            revision,
+        )
+        self._futures[future] = pending
+
+    def _process_completed(self, block):
+        if not self._futures:
+            return
+
+        done, _ = concurrent.futures.wait(
+            self._futures.keys(),
+            timeout=None if block else 0,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for f in done:
+            pending = self._futures.pop(f)
+            pending.ranges_remaining -= 1
+            try:
+                revision, size = f.result()
+                pending.revision = revision
+                self._bytes_fetched += size
+            except Exception as e:
+                pending.error = e
+
+            if pending.ranges_remaining == 0:
+                self._complete(pending)
+        self._print_progress()
+
+    def _complete(self, pending):
+        self._number_of_files_done += 1
+        element = pending.element
+        if pending.error is not None:
+            self._log.error('Failed to fetch element "{}", error="{}"'.format(
+                element.path_remote(),
+                pending.error,
+            ))
+            self._remove_tmp(pending)
+            return
+
+        os.replace(pending.path_tmp, element.path_local())
+        element.set_synchronized(pending.node_id, pending.revision)
+        self._fs.add_synchronized_element(element, pending.parent)
+        self._fetched.append(element)
+
+    def _remove_tmp(self, pending):
+        if os.path.exists(pending.path_tmp):
+            os.remove(pending.path_tmp)
+
+    def _print_progress(self, force=False):
+        now = time.time()
+        if not force and now - self._progress_printed < _PROGRESS_INTERVAL_SECONDS:
+            return
+        self._progress_printed = now
+        duration = max(now - self._started, 0.001)
+        self._fs.print_progress(
+            'Fetched {}/{} files, {:.1f} MB, {:.1f} MB/s{}'.format(
+                self._number_of_files_done,
+                self._number_of_files,
+                self._bytes_fetched / 1024 / 1024,
+                self._bytes_fetched / 1024 / 1024 / duration,
+                _concurrency_description(self._pool),
+            ))
+
+
+# Executed in worker threads
+def _push_file(pool, priority, parent_node_id, name, file_type, path_local):
+    with pool.connection(priority) as connection:
+        rsp = connection.create_file(name, file_type, parent_node_id=parent_node_id)
+        zyn.util.check_server_response(rsp)
+        node_id = rsp.as_create_rsp().node_id
+        try:
+            rsp = connection.open_file_write(node_id=node_id)
+            zyn.util.check_server_response(rsp)
+            rsp_open = rsp.as_open_rsp()
+            revision = rsp_open.revision
+            try:
+                if os.stat(path_local).st_size > 0:
+                    revision = push_file_content(connection, rsp_open, file_type, path_local)
+            finally:
+                rsp = connection.close_file(node_id)
+                zyn.util.check_server_response(rsp)
+        except zyn.exception.ZynServerException:
+            # Do not leave partially written file to remote
+            connection.delete(node_id=node_id)
+            raise
+    return node_id, revision
+
+
+# Adds local directory tree to remote: local tree is discovered and missing
+# directories are created breadth-first with the main connection, after which
+# files are uploaded over a pool of connections, smallest first so that
+# large files do not delay the rest. Without pool files are added one by one
+class BulkAdd:
+    def __init__(self, fs, connection, pool, log, priority=zyn.connection.PRIORITY_BULK):
+        self._fs = fs
+        self._connection = connection
+        self._pool = pool
+        self._log = log
+        self._priority = priority
+        self._added = []
+
+    def add_children(self, directory, file_type):
+        files = []
+        started = time.time()
+        with self._fs.stat_cache():
+            directories = [directory]
+            while directories:
+                d = directories.pop(0)
+                directories += self._add_directory_children(d, files)
+
+            files.sort(key=lambda f: f[0])
+            number_of_bytes = sum(size for size, _, _ in files)
+            self._fs.print_progress('Uploading {} files, {:.1f} MB'.format(
+                len(files),
+                number_of_bytes / 1024 / 1024,
+            ))
+            if self._pool is None:
+                self._add_files(files, file_type)
+            else:
+                self._push_files(files, file_type)
+
+        duration = max(time.time() - started, 0.001)
+        self._fs.print_progress('Added {} elements, {:.1f} MB/s{}'.format(
+            len(self._added),
+            number_of_bytes / 1024 / 1024 / duration,
+            _concurrency_description(self._pool),
+        ))
+        return self._added
+
+    def _add_directory_children(self, directory, files):
+        directories = []
+        for entry in self._fs.local_children(directory.path_local()).values():
+            node_id = directory.child_node_id(entry.name)
+            if node_id is not None:
+                element = self._fs.local_element_from_node_id(node_id)
+                if element.is_directory():
+                    directories.append(element)
+                continue
+
+            path_remote = zyn.util.join_remote_paths([directory.path_remote(), entry.name])
+            if entry.is_directory:
+                try:
+                    element = self._fs.add(
+                        LocalDirectory.create_empty(path_remote, self._fs),
+                        self._connection,
+                    )
+                    self._added.append(element)
+                    directories.append(element)
+                except zyn.exception.ZynException:
+                    self._log.exception('Failed to add directory "{}"'.format(path_remote))
+            elif entry.is_file:
+                files.append((entry.size, path_remote, directory))
+            else:
+                self._log.warning('Skipping "{}", not a file or directory'.format(path_remote))
+        return directories
+
+    def _add_files(self, files, file_type):
+        for _, path_remote, _ in files:
+            try:
+                element = LocalFile.create_empty(path_remote, file_type, self._fs)
+                self._added.append(self._fs.add(element, self._connection))
+            except zyn.exception.ZynException:
+                self._log.exception('Failed to add file "{}"'.format(path_remote))
+
+    def _push_files(self, files, file_type):
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._pool.max_number_of_connections()
+        ) as executor:
+            futures = {}
+            for _, path_remote, parent in files:
+                element = LocalFile.create_empty(path_remote, file_type, self._fs)
+                future = executor.submit(
+                    _push_file,
+                    self._pool,
+                    self._priority,
+                    parent.node_id(),
+                    element.name(),
+                    file_type,
+                    element.path_local(),
+                )
+                futures[future] = (element, parent)
+
+            for f in concurrent.futures.as_completed(futures):
+                element, parent = futures[f]
+                try:
+                    node_id, revision = f.result()
+                except Exception:
+                    self._log.exception('Failed to add file "{}"'.format(element.path_remote()))
+                    continue
+
+                element.set_synchronized(node_id, revision)
+                self._fs.add_synchronized_element(element, parent)
+                self._added.append(element)
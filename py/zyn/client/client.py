@@ -1,12 +1,19 @@
+import contextlib
 import json
 import logging
+import os
 import os.path
+import shutil
 import time
 
+import zyn.connection
 import zyn.errors
 import zyn.exception
 import zyn.util
 import zyn.messages
+import zyn.client.bulk
+import zyn.client.store
+from zyn.client.store import StateStore
 from zyn.client.data import (
     Element,
     OpenLocalFile,
@@ -24,6 +31,8 @@ class State:
             filesystem,
             server_id=None,
             server_started_at=None,
+            store=None,
+            block_size_tuning=None,
     ):
         self.username = username
         self.address = address
@@ -31,6 +40,19 @@ class State:
         self.fs = filesystem
         self.server_id = server_id
         self.server_started_at = server_started_at
+        self._store = store
+        self._block_size_tuners = {
+            server: zyn.connection.BlockSizeTuner.from_dict(values)
+            for server, values in (block_size_tuning or {}).items()
+        }
+
+    def block_size_tuner(self, address, port):
+        # Measurements are kept per server address, as same server
+        # can be reached over links with different latency
+        server = '{}:{}'.format(address, port)
+        if server not in self._block_size_tuners:
+            self._block_size_tuners[server] = zyn.connection.BlockSizeTuner()
+        return self._block_size_tuners[server]
 
     def to_dict(self):
         return {
@@ -44,8 +66,26 @@ class State:
         }
 
     def to_file(self, path_state):
-        with open(path_state, 'w') as fp:
-            json.dump(self.to_dict(), fp)
+        if self._store is None or self._store.path() != path_state:
+            self._store = StateStore.create(path_state)
+
+        self._store.set_info({
+            'username': self.username,
+            'address': self.address,
+            'port': self.port,
+            'server_id': self.server_id,
+            'server_started_at': self.server_started_at,
+            'local-data-root': self.fs.path_root(),
+            'block-size-tuning': {
+                server: tuner.to_dict() for server, tuner in self._block_size_tuners.items()
+            },
+        })
+        self.fs.save(self._store)
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
 
     def from_dict(data, log):
         if data['data-format'] != 1:
@@ -63,10 +103,45 @@ class State:
             server_started_at=data['server_started_at'],
         )
 
+    def from_store(store, log):
+        info = store.info()
+        if info['data-format'] != zyn.client.store.DATA_FORMAT:
+            raise ZynClientException(
+                "Trying to import State from unsupported version, version={}".format(
+                    info['data-format'],
+                ))
+
+        return State(
+            username=info['username'],
+            address=info['address'],
+            port=info['port'],
+            filesystem=LocalFilesystemManager.from_store(store, info['local-data-root'], log),
+            server_id=info['server_id'],
+            server_started_at=info['server_started_at'],
+            store=store,
+            block_size_tuning=info.get('block-size-tuning', None),
+        )
+
     def from_file(path_state, log):
+        if zyn.client.store.is_state_store(path_state):
+            return State.from_store(StateStore.open(path_state), log)
+
+        # Data format 1 stored the whole state as single JSON document,
+        # convert it to store and keep the original file as backup
         with open(path_state, 'r') as fp:
-            content = json.load(fp)
-            return State.from_dict(content, log)
+            state = State.from_dict(json.load(fp), log)
+
+        path_backup = path_state + '.data-format-1'
+        path_converted = path_state + '.converting'
+        shutil.copyfile(path_state, path_backup)
+        state.to_file(path_converted)
+        state.close()
+        os.replace(path_converted, path_state)
+        log.info('Converted client state to data format {}, original saved to "{}"'.format(
+            zyn.client.store.DATA_FORMAT,
+            path_backup,
+        ))
+        return State.from_store(StateStore.open(path_state), log)
 
 
 
@@ -76,15 +151,40 @@ class ZynFilesystemClient:
             connection,
             state,
             logger,
+            connection_pool=None,
     ):
 
         self._connection = connection
         self._state = state
         self._log = logger
+        self._connection_pool = connection_pool
+        self._priority = zyn.connection.PRIORITY_INTERACTIVE
 
     def connection(self):
         return self._connection
 
+    @contextlib.contextmanager
+    def priority(self, priority):
+        # Traffic of commands executed within the block, including
+        # transfers over pooled connections, uses given priority
+        previous = self._priority
+        self._priority = priority
+        try:
+            with self._connection.priority(priority):
+                yield
+        finally:
+            self._priority = previous
+
+    def concurrency_metrics(self):
+        if self._connection_pool is None or self._connection_pool.limiter() is None:
+            return None
+        return self._connection_pool.limiter().metrics()
+
+    def block_cache_metrics(self):
+        if self._connection.block_cache() is None:
+            return None
+        return self._connection.block_cache().metrics()
+
     def has_remote_info(self):
         return not (
             self._state.server_id is None
@@ -148,19 +248,22 @@ class ZynFilesystemClient:
         zyn.util.check_server_response(rsp)
         return rsp.as_create_rsp()
 
-    def add(self, path_remote, file_type):
+    def add(self, path_remote, file_type, recursive=False):
         path_remote = zyn.util.normalized_remote_path(path_remote)
         path_local = self._state.fs.local_path(path_remote)
+        entry = self._state.fs.local_entry(path_local)
         element = None
 
-        if os.path.isfile(path_local):
+        if entry is not None and entry.is_file:
             if file_type is None:
                 raise ZynClientException(
                     'Please specify file type: either random access or blob'.format(
                     ))
             element = self._state.fs.create_local_file_element(path_remote, file_type)
 
-        elif os.path.isdir(path_local):
+        elif entry is not None and entry.is_directory:
+            if recursive:
+                return self._add_recursive(path_remote, file_type)
             if file_type is not None:
                 raise ZynClientException(
                     'Must not specify either random access or blob for direcotry'
@@ -173,6 +276,29 @@ class ZynFilesystemClient:
             )
         return [self._state.fs.add(element, self._connection)]
 
+    def _add_recursive(self, path_remote, file_type):
+        if file_type is None:
+            raise ZynClientException(
+                'Please specify file type used for added files: either random access or blob'
+            )
+
+        added = []
+        fs = self._state.fs
+        if fs.is_tracked(path_remote=path_remote):
+            directory = fs.local_element_from_remote_path(path_remote)
+        else:
+            directory = fs.add(fs.create_local_directory_element(path_remote), self._connection)
+            added.append(directory)
+
+        add = zyn.client.bulk.BulkAdd(
+            fs,
+            self._connection,
+            self._connection_pool,
+            self._log,
+            priority=self._priority,
+        )
+        return added + add.add_children(directory, file_type)
+
     def query_element(self, path_remote):
         path_remote = zyn.util.normalized_remote_path(path_remote)
         rsp = self._state.fs.query_element(path_remote, self._connection)
@@ -199,7 +325,10 @@ class ZynFilesystemClient:
         return element, children
 
     def fetch(self, path_remote, overwrite):
+        with self._state.fs.stat_cache():
+            return self._fetch(path_remote, overwrite)
 
+    def _fetch(self, path_remote, overwrite):
         fetched_elements = []
         path_remote = zyn.util.normalized_remote_path(path_remote)
         element = self._state.fs.create_local_element_based_on_remote(
@@ -232,11 +361,21 @@ class ZynFilesystemClient:
             fetched_elements.append(element)
 
         if element.is_directory():
-            fetched_elements += self._state.fs.fetch_children_and_add_to_tracked(
-                self._connection,
-                element,
-                overwrite,
-            )
+            if self._connection_pool is not None:
+                fetch = zyn.client.bulk.BulkFetch(
+                    self._state.fs,
+                    self._connection,
+                    self._connection_pool,
+                    self._log,
+                    priority=self._priority,
+                )
+                fetched_elements += fetch.fetch_children(element, overwrite)
+            else:
+                fetched_elements += self._state.fs.fetch_children_and_add_to_tracked(
+                    self._connection,
+                    element,
+                    overwrite,
+                )
         return fetched_elements
 
     def sync(self, path_remote, discard_local_changes):
@@ -249,20 +388,22 @@ class ZynFilesystemClient:
                 ))
         synchronized_elements = []
         element = self._state.fs.local_element_from_remote_path(path_remote)
-        if element.is_file():
-            parent = element.parent()
-            synchronized_elements += parent.sync(
-                self._connection,
-                child_filter=element.name(),
-                discard_local_changes=discard_local_changes,
-            )
-        elif element.is_directory():
-            synchronized_elements += element.sync(
-                self._connection,
-                discard_local_changes=discard_local_changes,
-            )
-        else:
-            zyn.util.unhandled()
+        with self._state.fs.stat_cache():
+            if element.is_file():
+                parent = element.parent()
+                synchronized_elements += parent.sync(
+                    self._connection,
+                    child_filter=element.name(),
+                    discard_local_changes=discard_local_changes,
+                )
+            elif element.is_directory():
+                self._state.fs.scan_local_tree(element)
+                synchronized_elements += element.sync(
+                    self._connection,
+                    discard_local_changes=discard_local_changes,
+                )
+            else:
+                zyn.util.unhandled()
         return synchronized_elements
 
     def remove(self, path_remote, delete_local, delete_remote):
@@ -295,8 +436,8 @@ class ZynFilesystemClient:
         else:
             zyn.util.unhandled()
 
-    def synchronize_local_files_with_remote(self):
-        return self._state.fs.initial_synchronization(self._connection)
+    def synchronize_local_files_with_remote(self, verify_content=False):
+        return self._state.fs.initial_synchronization(self._connection, verify_content)
 
     def reset_local_filesystem(self):
         self._state.fs.reset_data()
@@ -317,6 +458,10 @@ class ZynFilesystemClient:
                     )
             files[e.node_id()] = OpenLocalFile(e, self._state.fs, self._log)
 
+        # Only notifications of the opened files are expected while files are open
+        if self._connection.open_handle_cache() is not None:
+            self._connection.open_handle_cache().clear()
+
         try:
             for f in files.values():
                 f.open_and_sync(self._connection)
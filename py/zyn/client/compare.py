@@ -0,0 +1,165 @@
+import functools
+import os
+
+import zyn.connection
+import zyn.util
+
+
+COMPARE_WINDOW_SIZE = 4 * 1024 * 1024
+_PAGE_SIZE = 4 * 1024
+
+
+def _first_difference(data_1, data_2):
+    for i in range(len(data_1)):
+        if data_1[i] != data_2[i]:
+            return i
+    return None
+
+
+def _last_difference(data_1, data_2):
+    for i in range(len(data_1) - 1, -1, -1):
+        if data_1[i] != data_2[i]:
+            return i
+    return None
+
+
+def differing_ranges(data_1, data_2, page_size=_PAGE_SIZE):
+    # Returns (offset, size) of ranges that differ between data of same length.
+    # Data is compared page by page, consecutive differing pages form one range
+    # which is trimmed to first and last differing byte
+    if len(data_1) != len(data_2):
+        raise ValueError('Compared data must be of same length')
+
+    view_1 = memoryview(data_1)
+    view_2 = memoryview(data_2)
+    ranges = []
+    start = None
+    end = None
+    for offset in range(0, len(view_1), page_size):
+        page_1 = view_1[offset:offset + page_size]
+        page_2 = view_2[offset:offset + page_size]
+        if page_1 == page_2:
+            continue
+
+        if start is None or offset != end:
+            if start is not None:
+                ranges.append((start, end))
+            start = offset + _first_difference(page_1, page_2)
+        end = offset + len(page_1)
+
+    if start is not None:
+        ranges.append((start, end))
+
+    trimmed = []
+    for start, end in ranges:
+        page_start = (end - 1) // page_size * page_size
+        page_1 = view_1[page_start:end]
+        page_2 = view_2[page_start:end]
+        end = page_start + _last_difference(page_1, page_2) + 1
+        trimmed.append((start, end - start))
+    return trimmed
+
+
+def _windows(size, block_size, window_size):
+    # Windows never cross server block boundaries, so that
+    # writes produced from one window fit into one block
+    window_size = min(window_size, block_size)
+    for block_offset in range(0, size, block_size):
+        block_end = min(block_offset + block_size, size)
+        for offset in range(block_offset, block_end, window_size):
+            yield offset, min(window_size, block_end - offset)
+
+
+def _read_local(fp, offset, size):
+    fp.seek(offset)
+    return fp.read(size)
+
+
+# Compares local file to open remote random access file window by window,
+# so that at most one window of both is kept in memory. Returns batch edit
+# operations (type, offset, size) that make remote content match local file.
+# Remote blocks are at fixed offsets and server only allows deleting from
+# the last block, so differences are expressed as writes at same offsets
+# followed by truncation
+def compare_random_access_file(
+        connection,
+        node_id,
+        remote_size,
+        block_size,
+        path_local,
+        window_size=COMPARE_WINDOW_SIZE,
+):
+    operations = []
+    local_size = os.stat(path_local).st_size
+    with open(path_local, 'rb') as fp:
+        for offset, size in _windows(max(local_size, remote_size), block_size, window_size):
+            local_data = _read_local(fp, offset, size)
+            remote_data = b''
+            if offset < remote_size:
+                rsp, remote_data = connection.read_file(
+                    node_id,
+                    offset,
+                    min(size, remote_size - offset),
+                )
+                zyn.util.check_server_response(rsp)
+
+            common = min(len(local_data), len(remote_data))
+            for start, length in differing_ranges(local_data[:common], remote_data[:common]):
+                operations.append((zyn.connection.BATCH_EDIT_TYPE_WRITE, offset + start, length))
+
+            if len(local_data) > common:
+                start = offset + common
+                # Extend write of the differing end of common part
+                if common > 0 and operations and sum(operations[-1][1:]) == start:
+                    _, start, _ = operations.pop()
+                operations.append((
+                    zyn.connection.BATCH_EDIT_TYPE_WRITE,
+                    start,
+                    offset + len(local_data) - start,
+                ))
+
+            if len(remote_data) > common:
+                operations.append((
+                    zyn.connection.BATCH_EDIT_TYPE_DELETE,
+                    offset + common,
+                    remote_size - offset - common,
+                ))
+                break
+    return operations
+
+
+def edit_random_access_file_streaming(
+        connection,
+        node_id,
+        revision,
+        remote_size,
+        block_size,
+        path_local,
+        logger,
+        window_size=COMPARE_WINDOW_SIZE,
+):
+    operations = compare_random_access_file(
+        connection,
+        node_id,
+        remote_size,
+        block_size,
+        path_local,
+        window_size,
+    )
+    logger.debug('Streaming comparison done, node_id={}, number_of_operations={}'.format(
+        node_id,
+        len(operations),
+    ))
+    if not operations:
+        return revision
+
+    with open(path_local, 'rb') as fp:
+        batch = connection.ra_batch_edit(node_id, revision)
+        for operation_type, offset, size in operations:
+            if operation_type == zyn.connection.BATCH_EDIT_TYPE_WRITE:
+                batch.write_lazy(offset, size, functools.partial(_read_local, fp, offset, size))
+            else:
+                batch.delete(offset, size)
+        rsp = batch.commit()
+    zyn.util.check_server_response(rsp)
+    return rsp.as_batch_edit_response().revision
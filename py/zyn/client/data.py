@@ -1,5 +1,7 @@
+import contextlib
 import os
 import os.path
+import sys
 import traceback
 import logging
 
@@ -7,9 +9,16 @@ import zyn.exception
 import zyn.util
 import zyn.connection
 import zyn.messages
+import zyn.client.compare
+import zyn.client.hashing
+from zyn.client.scanner import (
+    LocalEntry,
+    LocalScanner,
+)
 
 
 _REMOTE_PATH_ROOT = '/'
+_SCAN_WORKERS = 8
 
 
 class ZynClientException(zyn.exception.ZynException):
@@ -18,14 +27,25 @@ class ZynClientException(zyn.exception.ZynException):
 
 
 class LocalFileSystemElement:
+    # Client may track millions of elements, so elements use slots and
+    # store only their name, path of the parent is interned so that it is
+    # shared between all children of a directory
+    __slots__ = ('_name', '_path_parent', '_fs', '_node_id', '_node_id_parent')
+
     def __init__(self, path_remote, fs, node_id=None, node_id_parent=None):
-        self._path_remote = zyn.util.normalized_remote_path(path_remote)
+        path_remote = zyn.util.normalized_remote_path(path_remote)
+        if path_remote == _REMOTE_PATH_ROOT:
+            self._path_parent = None
+            self._name = _REMOTE_PATH_ROOT
+        else:
+            path_parent, self._name = zyn.util.split_remote_path(path_remote)
+            self._path_parent = sys.intern(path_parent)
         self._fs = fs
         self._node_id = node_id
         self._node_id_parent = node_id_parent
 
     def is_root(self):
-        return self._path_remote == _REMOTE_PATH_ROOT
+        return self._path_parent is None
 
     def set_parent(self, parent):
         self._node_id_parent = parent.node_id()
@@ -49,7 +69,11 @@ class LocalFileSystemElement:
         raise NotImplementedError()
 
     def path_remote(self):
-        return self._path_remote
+        if self._path_parent is None:
+            return self._name
+        if self._path_parent == _REMOTE_PATH_ROOT:
+            return _REMOTE_PATH_ROOT + self._name
+        return self._path_parent + '/' + self._name
 
     def path_local(self):
         return self._fs.local_path(self)
@@ -58,23 +82,25 @@ class LocalFileSystemElement:
         return self._fs.local_element_from_node_id(self._node_id_parent)
 
     def local_element_exists(self):
-        path = self.path_local()
+        entry = self._fs.local_entry(self.path_local())
+        if entry is None:
+            return False
         if self.is_directory():
-            return os.path.isdir(path)
+            return entry.is_directory
         elif self.is_file():
-            return os.path.isfile(path)
+            return entry.is_file
         zyn.util.unhandled()
 
     def split_to_parent_filename(self):
-        return zyn.util.split_remote_path(self._path_remote)
+        return self.path_parent(), self.name()
 
     def path_parent(self):
-        return self.split_to_parent_filename()[0]
+        if self.is_root():
+            raise ValueError('Path could not be split, path="{}"'.format(self._name))
+        return self._path_parent
 
     def name(self):
-        if self.is_root():
-            return self._path_remote
-        return self.split_to_parent_filename()[1]
+        return self._name
 
     def create_on_remote(self):
         raise NotImplementedError()
@@ -84,34 +110,40 @@ class LocalFileSystemElement:
         zyn.util.check_server_response(rsp)
 
     def is_attached_to_local_filesystem(self):
-        return self._fs.is_tracked(path_remote=self._path_remote)
+        return self._fs.is_tracked(path_remote=self.path_remote())
 
 
 class LocalDirectory(LocalFileSystemElement):
+    __slots__ = ('_children',)
+
     def __init__(
             self,
             path_in_remote,
             fs,
             node_id=None,
-            node_id_children=None,
+            children=None,
             node_id_parent=None,
     ):
         super().__init__(path_in_remote, fs, node_id, node_id_parent)
-        if node_id_children is None:
-            self._node_id_children = []
+        # Name of child -> node id of child
+        if children is None:
+            self._children = {}
         else:
-            self._node_id_children = node_id_children
+            self._children = children
 
     def add_child(self, child):
-        if child.node_id() in self._node_id_children:
+        if child.name() in self._children:
             raise RuntimeError()
-        self._node_id_children.append(child.node_id())
+        self._children[child.name()] = child.node_id()
 
     def remove_child(self, child):
-        self._node_id_children.remove(child.node_id())
+        del self._children[child.name()]
+
+    def child_node_id(self, name):
+        return self._children.get(name, None)
 
     def node_id_children(self):
-        return self._node_id_children
+        return list(self._children.values())
 
     def is_file(self):
         return False
@@ -124,8 +156,8 @@ class LocalDirectory(LocalFileSystemElement):
             'data-format': 1,
             'node-id': self._node_id,
             'node-id-parent': self._node_id_parent,
-            'path-remote': self._path_remote,
-            'children': self._node_id_children,
+            'path-remote': self.path_remote(),
+            'children': self.node_id_children(),
         }
 
     def from_json(data, fs):
@@ -139,35 +171,34 @@ class LocalDirectory(LocalFileSystemElement):
             data['path-remote'],
             fs,
             node_id=data['node-id'],
-            node_id_children=data['children'],
             node_id_parent=data['node-id-parent'],
         )
         return dir
 
     def remove_local(self):
         os.rmdir(self.path_local())
+        self._fs.refresh_local_entry(self.path_local())
 
     def is_local_empty(self):
         return len(self.local_children()) == 0
 
     def children_local_untracked(self):
         elements = []
-        for c in os.listdir(self.path_local()):
-            path_remote = zyn.util.join_remote_paths([self._path_remote, c])
-            if self._fs.is_tracked(path_remote=path_remote):
+        for c in self._fs.local_children(self.path_local()).values():
+            if c.name in self._children:
                 continue
 
-            path_local = zyn.util.join_remote_paths([self.path_local(), c])
-            if os.path.isfile(path_local):
+            path_remote = zyn.util.join_remote_paths([self.path_remote(), c.name])
+            if c.is_file:
                 elements.append(LocalFile(path_remote, None, self._fs))
-            elif os.path.isdir(path_local):
+            elif c.is_directory:
                 elements.append(LocalDirectory(path_remote, self._fs))
             else:
                 zyn.util.unhandled()
         return elements
 
     def local_children(self):
-        return os.listdir(self.path_local())
+        return list(self._fs.local_children(self.path_local()).keys())
 
     def create_empty(path, fs):
         return LocalDirectory(path, fs)
@@ -189,21 +220,22 @@ class LocalDirectory(LocalFileSystemElement):
     def fetch(self, connection, overwrite=False):
         rsp = self._fs.query_element(self.path_remote(), connection)
         self._node_id = rsp.node_id
-        if os.path.exists(self.path_local()):
+        if self._fs.local_entry(self.path_local()) is not None:
             if not overwrite:
                 raise ZynClientException('Directory already exists, path: "{}"'.format(
                     self.path_remote(),
                 ))
         else:
             os.mkdir(self.path_local())
+            self._fs.refresh_local_entry(self.path_local())
 
     def sync(self, connection, child_filter=None, discard_local_changes=False):
 
-        self._fs.print_progress('Synchronizing files in "{}"'.format(self._path_remote))
+        self._fs.print_progress('Synchronizing files in "{}"'.format(self.path_remote()))
         self._fs._log.debug(
             'Synchronizing directory: child_filter: "{}", path="{}"'.format(
                 child_filter,
-                self._path_remote,
+                self.path_remote(),
             ))
 
         synchronized_elements = []
@@ -228,7 +260,7 @@ class LocalDirectory(LocalFileSystemElement):
                     if c.is_open:
                         self._fs._log.debug(
                             'File is open, query element info for latest revision, path={}'.format(
-                                self._path_remote,
+                                self.path_remote(),
                             ))
                         rsp = self._fs.query_element(element, connection)
                         remote_revision = rsp.revision
@@ -250,7 +282,7 @@ class LocalDirectory(LocalFileSystemElement):
             else:
                 zyn.util.unhandled()
 
-        for c in self._node_id_children:
+        for c in self.node_id_children():
             # todo: this needs more implementation when move is added to server
             if c not in rsp_elements:
                 element = self._fs.local_element_from_node_id(c)
@@ -262,28 +294,34 @@ class LocalDirectory(LocalFileSystemElement):
         self._fs._log.debug(
             'Synchronizing done: elements synchronized: {}, path="{}"'.format(
                 len(synchronized_elements),
-                self._path_remote,
+                self.path_remote(),
             ))
         return synchronized_elements
 
 
 class LocalFileMetadata():
+    __slots__ = ('_edit_timestamp', '_size', '_local_file')
+
     def __init__(self, local_file, edit_timestamp=None, size=None):
         self._edit_timestamp = edit_timestamp
         self._size = size
         self._local_file = local_file
 
     def has_changed(self):
-        stat = os.stat(self._local_file.path_local())
+        entry = self._local_file._fs.local_file_entry(self._local_file.path_local())
         return (
-            self._edit_timestamp != stat.st_mtime
-            or self._size != stat.st_size
+            self._edit_timestamp != entry.mtime
+            or self._size != entry.size
         )
 
     def update(self):
-        stat = os.stat(self._local_file.path_local())
-        self._edit_timestamp = stat.st_mtime
-        self._size = stat.st_size
+        entry = self._local_file._fs.refresh_local_entry(self._local_file.path_local())
+        if entry is None:
+            raise FileNotFoundError('Local file not found, path="{}"'.format(
+                self._local_file.path_local(),
+            ))
+        self._edit_timestamp = entry.mtime
+        self._size = entry.size
 
     def to_json(self):
         return {
@@ -299,7 +337,46 @@ class LocalFileMetadata():
         )
 
 
+# Writes content of local file to remote file opened for writing, returns new revision
+def push_file_content(connection, rsp_open, file_type, path_local):
+    node_id = rsp_open.node_id
+    revision = rsp_open.revision
+    stream = zyn.connection.FileStream(path_local)
+    try:
+        if file_type == zyn.connection.FILE_TYPE_BLOB:
+            rsp = connection.blob_write_stream(
+                node_id,
+                revision,
+                stream,
+                rsp_open.block_size,
+            )
+            zyn.util.check_server_response(rsp)
+            return rsp.as_write_rsp().revision
+
+        elif file_type == zyn.connection.FILE_TYPE_RANDOM_ACCESS:
+            # Content is written in parts of at most server block size in one
+            # batch edit, so only one part of the file is kept in memory at a time
+            size = stream.size()
+            batch = connection.ra_batch_edit(node_id, revision)
+            block_size = connection.transfer_block_size(rsp_open.block_size)
+            batch.write_stream(0, stream, size, block_size)
+            if rsp_open.size > size:
+                batch.delete(size, rsp_open.size - size)
+            if batch.number_of_operations() == 0:
+                return revision
+            rsp = batch.commit()
+            zyn.util.check_server_response(rsp)
+            return rsp.as_batch_edit_response().revision
+
+        else:
+            zyn.util.unhandled()
+    finally:
+        stream.close()
+
+
 class LocalFile(LocalFileSystemElement):
+    __slots__ = ('_file_type', '_revision', '_local_file_metadata')
+
     def __init__(
             self,
             path_in_remote,
@@ -333,7 +410,7 @@ class LocalFile(LocalFileSystemElement):
         return self._revision
 
     def is_empty_local(self):
-        return os.stat(self.path_local()).st_size == 0
+        return self._fs.local_file_entry(self.path_local()).size == 0
 
     def size_local(self):
         return self._local_file_metadata._size
@@ -345,7 +422,7 @@ class LocalFile(LocalFileSystemElement):
             'file-type': self._file_type,
             'node-id': self._node_id,
             'node-id-parent': self._node_id_parent,
-            'path-remote': self._path_remote,
+            'path-remote': self.path_remote(),
             'local-file': self._local_file_metadata.to_json(),
         }
 
@@ -389,6 +466,35 @@ class LocalFile(LocalFileSystemElement):
 
     def remove_local(self):
         os.remove(self.path_local())
+        self._fs.refresh_local_entry(self.path_local())
+
+    def remote_content_matches(self, connection, block_hashes):
+        open_rsp = self._fs.open_read(self.path_remote(), connection)
+        try:
+            hasher = zyn.client.hashing.BlockHasher()
+            offset = 0
+            while offset < open_rsp.size:
+                rsp, data = connection.read_file(
+                    open_rsp.node_id,
+                    offset,
+                    min(open_rsp.block_size, open_rsp.size - offset),
+                )
+                zyn.util.check_server_response(rsp)
+                if not data:
+                    break
+                offset += len(data)
+
+                # Stop reading at first block that differs
+                for index, digest in hasher.update(data):
+                    if index >= len(block_hashes) or block_hashes[index] != digest:
+                        return False
+
+            for index, digest in hasher.finish():
+                if index >= len(block_hashes) or block_hashes[index] != digest:
+                    return False
+            return offset == open_rsp.size and hasher.number_of_blocks() == len(block_hashes)
+        finally:
+            self._fs.release_read(open_rsp.node_id, connection)
 
     def push_to_remote(self, connection):
         rsp_open = self._fs.open_write(self, connection)
@@ -400,55 +506,28 @@ class LocalFile(LocalFileSystemElement):
                 ))
 
         try:
-            if self.is_empty_local():
-                pass
-            else:
-                if self.is_blob():
-                    stream = zyn.connection.FileStream(self.path_local())
-                    rsp = connection.blob_write_stream(
-                        self.node_id(),
-                        self._revision,
-                        stream,
-                        rsp_open.block_size,
-                    )
-                elif self.is_random_access():
-                    data = self.local_data()
-                    if rsp_open.size > len(data):
-                        rsp = connection.ra_delete(
-                            self.node_id(),
-                            self._revision,
-                            len(data),
-                            rsp_open.size - len(data),
-                        )
-                        zyn.util.check_server_response(rsp)
-                        self._revision = rsp.as_delete_rsp().revision
-
-                    rsp = connection.ra_write(
-                        self.node_id(),
-                        self._revision,
-                        0,
-                        data,
-                    )
-                else:
-                    zyn.util.unhandled()
-
-                zyn.util.check_server_response(rsp)
-                rsp = rsp.as_write_rsp()
-                self._revision = rsp.revision
+            if not self.is_empty_local():
+                self._revision = push_file_content(
+                    connection,
+                    rsp_open,
+                    self._file_type,
+                    self.path_local(),
+                )
 
             self._local_file_metadata.update()
+            self._fs.element_modified(self)
 
         finally:
             self._fs.close(self, connection)
 
     def fetch(self, connection, overwrite=False):
         path_local = self.path_local()
-        if not overwrite and os.path.exists(path_local):
+        if not overwrite and self._fs.local_entry(path_local) is not None:
             raise ZynClientException('Local file already exists, path: "{}"'.format(
                 self.path_remote(),
             ))
 
-        open_rsp = self._fs.open_read(self._path_remote, connection)
+        open_rsp = self._fs.open_read(self.path_remote(), connection)
         try:
             with open(self.path_local(), 'wb') as fp:
                 stream = zyn.connection.InputFileStream(fp)
@@ -462,11 +541,15 @@ class LocalFile(LocalFileSystemElement):
                 if stream.is_error():
                     zyn.util.check_server_response(stream.error_rsp())
 
-            self._node_id = open_rsp.node_id
-            self._revision = open_rsp.revision
-            self._local_file_metadata.update()
+            self.set_synchronized(open_rsp.node_id, open_rsp.revision)
         finally:
-            self._fs.close(self, connection)
+            self._fs.release_read(open_rsp.node_id, connection)
+
+    def set_synchronized(self, node_id, revision):
+        self._node_id = node_id
+        self._revision = revision
+        self._local_file_metadata.update()
+        self._fs.element_modified(self)
 
     def apply_notification(self, connection, notification, byte_buffer):
         if self._local_file_metadata.has_changed():
@@ -510,6 +593,7 @@ class LocalFile(LocalFileSystemElement):
         open(self.path_local(), 'wb').write(byte_buffer)
         self._revision = n.revision
         self._local_file_metadata.update()
+        self._fs.element_modified(self)
         return byte_buffer
 
     def push_random_access_changes(self, connection, remote_data):
@@ -526,6 +610,7 @@ class LocalFile(LocalFileSystemElement):
             self._fs._log,
         )
         self._local_file_metadata.update()
+        self._fs.element_modified(self)
         return local_data
 
     def synchronize(self, connection, remote_revision, discard_local_changes):
@@ -544,7 +629,7 @@ class LocalFile(LocalFileSystemElement):
                 remote_revision,
                 has_changes_local,
                 str(discard_local_changes),
-                self._path_remote,
+                self.path_remote(),
             ))
 
         if has_changes_remote and has_changes_local:
@@ -573,20 +658,36 @@ class LocalFile(LocalFileSystemElement):
                     zyn.util.check_server_response(rsp)
                     self._revision = rsp.as_write_rsp().revision
                 elif self.is_random_access():
-                    remote_data = bytearray()
-                    if rsp_open.size > 0:
-                        rsp, remote_data = connection.read_file(
+                    window_size = self._fs.compare_window_size()
+                    local_size = self._fs.local_file_entry(self.path_local()).size
+                    if max(rsp_open.size, local_size) > window_size:
+                        # Large files are compared block by block without loading them
+                        self._revision = zyn.client.compare.edit_random_access_file_streaming(
+                            connection,
                             rsp_open.node_id,
-                            0,
-                            rsp_open.size
+                            self._revision,
+                            rsp_open.size,
+                            rsp_open.block_size,
+                            self.path_local(),
+                            self._fs._log,
+                            window_size,
                         )
-                        zyn.util.check_server_response(rsp)
-
-                    self.push_random_access_changes(connection, remote_data)
+                    else:
+                        remote_data = bytearray()
+                        if rsp_open.size > 0:
+                            rsp, remote_data = connection.read_file(
+                                rsp_open.node_id,
+                                0,
+                                rsp_open.size
+                            )
+                            zyn.util.check_server_response(rsp)
+
+                        self.push_random_access_changes(connection, remote_data)
                 else:
                     zyn.util.unhandled()
 
                 self._local_file_metadata.update()
+                self._fs.element_modified(self)
             finally:
                 if rsp_open is not None:
                     self._fs.close(self, connection)
@@ -671,7 +772,7 @@ class OpenLocalFile():
 class LocalFilesystemManager:
     def to_dict(self):
         elements = []
-        for e in self._elements.values():
+        for e in self._all_elements().values():
             if e.is_file():
                 elements.append({
                     'file': e.to_json()
@@ -702,12 +803,30 @@ class LocalFilesystemManager:
                 zyn.util.unhandled()
 
             fs._elements[element.node_id()] = element
-            fs._path_to_node_id[element.path_remote()] = element.node_id()
+            fs._modified.add(element.node_id())
+
+        for element in fs._elements.values():
+            if not element.is_root():
+                fs._elements[element.node_id_parent()].add_child(element)
+        return fs
+
+    def from_store(store, path_local_root, log):
+        fs = LocalFilesystemManager(path_local_root, log)
+        fs._store = store
+        fs._elements = {}
+        fs._modified = set()
+        fs._removed = set()
+        fs._cleared = False
+        if fs._load_element(0) is None:
+            fs.reset_data()
         return fs
 
     def __init__(self, path_local_root, log):
         self._path_root = path_local_root
         self._log = log
+        self._store = None
+        self._scanner = None
+        self._compare_window_size = zyn.client.compare.COMPARE_WINDOW_SIZE
         self.reset_data()
         self._log.debug('Initialized, root="{}"'.format(self._path_root))
 
@@ -717,16 +836,192 @@ class LocalFilesystemManager:
         self._elements = {
             0: rootdir,
         }
-        self._path_to_node_id = {
-            _REMOTE_PATH_ROOT: 0,
-        }
+        # Elements are loaded from store on first use and changes
+        # are kept track of so that only they need to be saved
+        self._modified = {0}
+        self._removed = set()
+        self._cleared = True
+
+    def path_root(self):
+        return self._path_root
+
+    def compare_window_size(self):
+        return self._compare_window_size
+
+    def set_compare_window_size(self, size):
+        self._compare_window_size = size
+
+    def _is_store_readable(self):
+        return self._store is not None and not self._cleared
+
+    def _load_element(self, node_id):
+        element = self._elements.get(node_id, None)
+        if element is not None or not self._is_store_readable() or node_id in self._removed:
+            return element
+
+        data = self._store.element(node_id)
+        if data is None:
+            return None
+
+        element = self._element_from_row(data)
+        if element.is_directory():
+            element._children = self._store.children(node_id)
+        self._elements[node_id] = element
+        return element
+
+    def _element_from_row(self, data):
+        f = data.get('file', None)
+        d = data.get('directory', None)
+        if f is not None:
+            return LocalFile.from_json(f, self)
+        elif d is not None:
+            return LocalDirectory.from_json(d, self)
+        zyn.util.unhandled()
+
+    def _node_id_from_path(self, path_remote):
+        # Paths are not stored, path is resolved by walking from root
+        node_id = 0
+        for name in zyn.util.normalized_remote_path(path_remote).split('/'):
+            if not name:
+                continue
+            directory = self._load_element(node_id)
+            if directory is None or not directory.is_directory():
+                return None
+            node_id = directory.child_node_id(name)
+            if node_id is None:
+                return None
+        return node_id
+
+    def _all_node_ids(self):
+        node_ids = set(self._elements.keys())
+        if self._is_store_readable():
+            node_ids.update(n for n in self._store.node_ids() if n not in self._removed)
+        return node_ids
+
+    def _all_elements(self):
+        if self._is_store_readable():
+            # Load everything not yet loaded with single query,
+            # children of loaded directories are filled from loaded elements
+            loaded = {}
+            for node_id, data in self._store.elements():
+                if node_id in self._elements or node_id in self._removed:
+                    continue
+                loaded[node_id] = self._element_from_row(data)
+
+            for element in loaded.values():
+                if element.is_root():
+                    continue
+                parent = loaded.get(element.node_id_parent(), None)
+                if parent is not None:
+                    parent._children[element.name()] = element.node_id()
+            self._elements.update(loaded)
+        return dict(self._elements)
+
+    def _element_to_row(self, element):
+        data = element.to_json()
+        if element.is_file():
+            data = {'file': data}
+        elif element.is_directory():
+            # Children are stored with parent node id in the element rows
+            del data['children']
+            data = {'directory': data}
+        else:
+            zyn.util.unhandled()
+        return (element.node_id(), element.node_id_parent(), element.name(), data)
+
+    def element_modified(self, element):
+        if element.node_id() is not None:
+            self._modified.add(element.node_id())
+
+    def save(self, store):
+        if store is not self._store:
+            self._log.debug('Writing all elements to new state store')
+            elements = self._all_elements()
+            store.write(
+                [self._element_to_row(e) for e in elements.values()],
+                [],
+                clear=True,
+            )
+            self._store = store
+            self._elements = elements
+        else:
+            modified = [
+                self._element_to_row(self._elements[n])
+                for n in self._modified if n in self._elements
+            ]
+            self._log.debug('Saving elements: modified={}, removed={}'.format(
+                len(modified),
+                len(self._removed),
+            ))
+            store.write(modified, list(self._removed), clear=self._cleared)
+
+        self._modified = set()
+        self._removed = set()
+        self._cleared = False
 
     def is_empty(self):
-        return len(self._elements) == 1
+        return len(self._all_node_ids()) == 1
 
     def print_progress(self, msg):
         print(msg)
 
+    @contextlib.contextmanager
+    def stat_cache(self):
+        # Local filesystem is scanned once per directory and the results are
+        # reused until the end of the block, nested blocks share the cache
+        if self._scanner is not None:
+            yield self._scanner
+            return
+
+        self._scanner = LocalScanner()
+        try:
+            yield self._scanner
+        finally:
+            self._log.debug('Stat cache released, directories scanned: {}'.format(
+                self._scanner.number_of_scanned_directories(),
+            ))
+            self._scanner = None
+
+    def scan_local_tree(self, directory, max_workers=_SCAN_WORKERS):
+        if self._scanner is None:
+            return
+
+        paths = []
+        directories = [directory]
+        while directories:
+            d = directories.pop()
+            paths.append(d.path_local())
+            for n in d.node_id_children():
+                c = self._load_element(n)
+                if c is not None and c.is_directory():
+                    directories.append(c)
+        self._scanner.scan_directories(paths, max_workers)
+
+    def local_entry(self, path_local):
+        if self._scanner is None:
+            return LocalEntry.from_path(path_local)
+        return self._scanner.entry(path_local)
+
+    def local_file_entry(self, path_local):
+        entry = self.local_entry(path_local)
+        if entry is None or not entry.is_file:
+            raise FileNotFoundError('Local file not found, path="{}"'.format(path_local))
+        return entry
+
+    def local_children(self, path_local):
+        if self._scanner is None:
+            children = LocalScanner().children(path_local)
+        else:
+            children = self._scanner.children(path_local)
+        if children is None:
+            raise FileNotFoundError('Local directory not found, path="{}"'.format(path_local))
+        return children
+
+    def refresh_local_entry(self, path_local):
+        if self._scanner is None:
+            return LocalEntry.from_path(path_local)
+        return self._scanner.refresh(path_local)
+
     def local_path(self, element):
         if isinstance(element, str):
             return zyn.util.join_remote_paths([self._path_root, element])
@@ -754,10 +1049,11 @@ class LocalFilesystemManager:
         return rsp.as_query_fs_children_rsp()
 
     def open_read(self, element, connection):
+        # Handle must be released with release_read()
         if isinstance(element, str):
-            rsp = connection.open_file_read(path=element)
+            rsp = connection.open_read_handle(path=element)
         elif isinstance(element, LocalFileSystemElement):
-            rsp = connection.open_file_read(node_id=element.node_id())
+            rsp = connection.open_read_handle(node_id=element.node_id())
         zyn.util.check_server_response(rsp)
         return rsp.as_open_rsp()
 
@@ -769,6 +1065,12 @@ class LocalFilesystemManager:
         zyn.util.check_server_response(rsp)
         return rsp.as_open_rsp()
 
+    def release_read(self, node_id, connection):
+        rsp = connection.release_read_handle(node_id)
+        if rsp is not None:
+            zyn.util.check_server_response(rsp)
+        return rsp
+
     def close(self, element, connection):
         if isinstance(element, int):
             rsp = connection.close_file(element)
@@ -778,7 +1080,7 @@ class LocalFilesystemManager:
         return rsp
 
     def size(self):
-        return len(self._path_to_node_id)
+        return len(self._all_node_ids())
 
     def create_local_file_element(self, path_remote, type_of):
         return LocalFile.create_empty(path_remote, type_of, self)
@@ -795,7 +1097,8 @@ class LocalFilesystemManager:
         element.set_parent(parent)
         parent.add_child(element)
         self._elements[element.node_id()] = element
-        self._path_to_node_id[element.path_remote()] = element.node_id()
+        self._modified.add(element.node_id())
+        self._removed.discard(element.node_id())
 
     def _remove_element_from_filesystem(self, element):
         parent = self.local_element_from_node_id(element.node_id_parent())
@@ -806,34 +1109,38 @@ class LocalFilesystemManager:
             ))
         parent.remove_child(element)
         del self._elements[element.node_id()]
-        del self._path_to_node_id[element.path_remote()]
+        self._modified.discard(element.node_id())
+        self._removed.add(element.node_id())
 
     def exists_in_filesystem(self, element):
         if isinstance(element, str):
-            return element in self._path_to_node_id
+            return self._node_id_from_path(element) is not None
         elif isinstance(element, LocalFileSystemElement):
-            return element.path_remote() in self._path_to_node_id
+            return self._node_id_from_path(element.path_remote()) is not None
         zyn.util.unhandled()
 
     def local_element_from_remote_path(self, path_remote):
-        node_id = self._path_to_node_id.get(path_remote, None)
+        node_id = self._node_id_from_path(path_remote)
         if node_id is None:
             raise ZynClientException(
                 'Element is not known for client, path="{}"'.format(
                     path_remote
                 ))
-        return self._elements[node_id]
+        return self._load_element(node_id)
 
     def local_element_from_node_id(self, node_id):
-        return self._elements[node_id]
+        element = self._load_element(node_id)
+        if element is None:
+            raise KeyError(node_id)
+        return element
 
     def is_tracked(self, path_remote=None, node_id=None):
         if path_remote is not None:
             if not isinstance(path_remote, str):
                 raise ValueError('Path should be str')
-            return path_remote in self._path_to_node_id
+            return self._node_id_from_path(path_remote) is not None
         elif node_id is not None:
-            return node_id in self._elements
+            return self._load_element(node_id) is not None
         else:
             raise ZynClientException(
                 'Must pass either Node Id or path'
@@ -841,7 +1148,7 @@ class LocalFilesystemManager:
 
     def element(self, path_remote, connection):
         if path_remote == _REMOTE_PATH_ROOT:
-            return Element.root_element(self._elements[0])
+            return Element.root_element(self.local_element_from_node_id(0))
 
         path_parent, name = zyn.util.split_remote_path(path_remote)
         children = self.query_fs_children(path_parent, connection)
@@ -901,12 +1208,12 @@ class LocalFilesystemManager:
                 ))
 
         path_parent = element.path_parent()
-        if path_parent not in self._path_to_node_id:
+        if not self.is_tracked(path_remote=path_parent):
             raise ZynClientException(
                 'Parent does not exists in client, parent="{}"'.format(
                     path_parent,
                 ))
-        parent = self._elements[self._path_to_node_id[path_parent]]
+        parent = self.local_element_from_remote_path(path_parent)
         try:
             element.create_on_remote(parent, connection)
         except zyn.exception.ZynServerException as create_error:
@@ -941,6 +1248,9 @@ class LocalFilesystemManager:
             ))
             raise fetch_error
 
+    def add_synchronized_element(self, element, parent):
+        self._add_element_to_filesystem(element, parent)
+
     def fetch_children_and_add_to_tracked(self, connection, parent, overwrite=False):
 
         self.print_progress('Fetching files in "{}"'.format(parent.path_remote()))
@@ -949,7 +1259,7 @@ class LocalFilesystemManager:
         rsp = self.query_fs_children(parent, connection)
         for e in rsp.elements:
 
-            if e.node_id not in self._elements:
+            if not self.is_tracked(node_id=e.node_id):
                 path_remote = zyn.util.join_remote_paths([parent.path_remote(), e.name])
                 if e.is_file():
                     element = LocalFile.create_empty(path_remote, e.file_type, self)
@@ -982,7 +1292,7 @@ class LocalFilesystemManager:
 
         return fetched_elements
 
-    def _initial_synchronization_for_directory(self, parent, elements, connection):
+    def _initial_synchronization_for_directory(self, parent, elements, connection, candidates):
         files_pushed = []
         files_assumed_to_already_exists = []
         self.print_progress('Initial synchronization for files in "{}"'.format(
@@ -994,10 +1304,10 @@ class LocalFilesystemManager:
         for e in rsp.elements:
             remote_elements[e.name] = e
 
-        children = parent._node_id_children
-        parent._node_id_children = []
+        children = parent._children
+        parent._children = {}
 
-        for n in children:
+        for n in children.values():
             c = elements[n]
             if not c.local_element_exists():
                 self._log.debug('Element "{}" does not exists locally, skipping'.format(c.name()))
@@ -1017,6 +1327,7 @@ class LocalFilesystemManager:
                         c,
                         elements,
                         connection,
+                        candidates,
                     )
                     files_pushed += p
                     files_assumed_to_already_exists += e
@@ -1025,7 +1336,18 @@ class LocalFilesystemManager:
             else:
                 remote_element = remote_elements[c.name()]
                 if c.is_file():
-                    if c.size_local() == remote_element.size:
+                    if candidates is not None:
+                        # Content is verified after all directories have been processed
+                        if self.local_file_entry(c.path_local()).size == remote_element.size:
+                            c._revision = remote_element.revision
+                            c._node_id = remote_element.node_id
+                            candidates.append((c, parent))
+                        else:
+                            self._log.debug(
+                                'Element "{}" found on remote, but size differs, skipping'.format(
+                                    c.name())
+                            )
+                    elif c.size_local() == remote_element.size:
                         # File with same name and size is found on remote,
                         # assume the they are the same
                         # This assumption may cause problems if file was edited
@@ -1051,6 +1373,7 @@ class LocalFilesystemManager:
                         c,
                         elements,
                         connection,
+                        candidates,
                     )
                     files_pushed += p
                     files_assumed_to_already_exists += e
@@ -1058,8 +1381,34 @@ class LocalFilesystemManager:
                     zyn.util.unhandled()
         return files_pushed, files_assumed_to_already_exists
 
-    def initial_synchronization(self, connection):
-        elements = self._elements
+    def _verify_initial_synchronization_candidates(self, candidates, connection):
+        verified = []
+        if not candidates:
+            return verified
+
+        self.print_progress('Hashing {} local files'.format(len(candidates)))
+        cache = zyn.client.hashing.HashCache(self._store)
+        hashes = cache.hash_files({
+            c.path_local(): self.local_file_entry(c.path_local())
+            for c, _ in candidates
+        })
+
+        for c, parent in candidates:
+            self.print_progress('Verifying content of "{}"'.format(c.path_remote()))
+            if c.remote_content_matches(connection, hashes[c.path_local()]):
+                self._log.debug('Element "{}" has equal content on remote'.format(c.name()))
+                self._add_element_to_filesystem(c, parent)
+                c._local_file_metadata.update()
+                verified.append(c)
+            else:
+                self._log.warning(
+                    'Element "{}" found on remote, but content differs, skipping'.format(
+                        c.path_remote())
+                )
+        return verified
+
+    def initial_synchronization(self, connection, verify_content=False):
+        elements = self._all_elements()
         self.reset_data()
         self._log.debug('Initial synchronization, fs has {} local elements'.format(
             len(elements),
@@ -1067,5 +1416,25 @@ class LocalFilesystemManager:
 
         # Clone root to have children of previous state
         # this is to set starting point for initial sync
-        self._elements[0]._node_id_children = elements[0]._node_id_children
-        return self._initial_synchronization_for_directory(self._elements[0], elements, connection)
+        self._elements[0]._children = elements[0]._children
+        with self.stat_cache() as scanner:
+            scanner.scan_directories(
+                [e.path_local() for e in elements.values() if e.is_directory()],
+                _SCAN_WORKERS,
+            )
+            candidates = None
+            if verify_content:
+                candidates = []
+
+            files_pushed, files_existing = self._initial_synchronization_for_directory(
+                self._elements[0],
+                elements,
+                connection,
+                candidates,
+            )
+            if verify_content:
+                files_existing += self._verify_initial_synchronization_candidates(
+                    candidates,
+                    connection,
+                )
+            return files_pushed, files_existing
@@ -0,0 +1,129 @@
+import concurrent.futures
+import hashlib
+import multiprocessing
+
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+_READ_SIZE = 1024 * 1024
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Splits content to fixed size blocks and hashes each of them,
+# comparing block hashes allows to stop at first differing block
+class BlockHasher:
+    def __init__(self, block_size=HASH_BLOCK_SIZE):
+        self._block_size = block_size
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+        self._index = 0
+
+    def update(self, data):
+        completed = []
+        view = memoryview(data)
+        while view:
+            size = min(len(view), self._block_size - self._hashed)
+            self._hash.update(view[:size])
+            self._hashed += size
+            view = view[size:]
+            if self._hashed == self._block_size:
+                completed.append((self._index, self._hash.hexdigest()))
+                self._hash = hashlib.sha256()
+                self._hashed = 0
+                self._index += 1
+        return completed
+
+    def finish(self):
+        if self._hashed == 0:
+            return []
+        completed = [(self._index, self._hash.hexdigest())]
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+        self._index += 1
+        return completed
+
+    def number_of_blocks(self):
+        return self._index
+
+
+# Executed in worker processes
+def hash_file(path, block_size=HASH_BLOCK_SIZE):
+    hasher = BlockHasher(block_size)
+    digests = []
+    with open(path, 'rb') as fp:
+        while True:
+            data = fp.read(_READ_SIZE)
+            if not data:
+                break
+            digests += [d for _, d in hasher.update(data)]
+    digests += [d for _, d in hasher.finish()]
+    return digests
+
+
+def hash_data(data, block_size=HASH_BLOCK_SIZE):
+    hasher = BlockHasher(block_size)
+    return [d for _, d in hasher.update(data) + hasher.finish()]
+
+
+# Block hashes of local files keyed by (inode, mtime, size), if any of these
+# change the file is hashed again. Optionally backed by state store so that
+# hashes are kept between runs
+class HashCache:
+    def __init__(self, store=None, block_size=HASH_BLOCK_SIZE):
+        self._store = store
+        self._block_size = block_size
+        self._hashes = {}
+
+    def _key(self, entry):
+        return (entry.inode, entry.mtime, entry.size, self._block_size)
+
+    def get(self, entry):
+        key = self._key(entry)
+        digests = self._hashes.get(key, None)
+        if digests is None and self._store is not None:
+            digests = self._store.file_hashes(key)
+            if digests is not None:
+                self._hashes[key] = digests
+        return digests
+
+    def set(self, entry, digests):
+        key = self._key(entry)
+        self._hashes[key] = digests
+        if self._store is not None:
+            self._store.set_file_hashes(key, digests)
+
+    def hash_files(self, entries, max_workers=None):
+        # entries: path -> LocalEntry, returns path -> list of block hashes
+        hashes = {}
+        missing = {}
+        for path, entry in entries.items():
+            digests = self.get(entry)
+            if digests is None:
+                missing[path] = entry
+            else:
+                hashes[path] = digests
+
+        if not missing:
+            return hashes
+
+        # Forking a process that has threads and open connections is not safe
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        else:
+            context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=context,
+        ) as executor:
+            futures = {
+                executor.submit(hash_file, path, self._block_size): path
+                for path in missing.keys()
+            }
+            for f in concurrent.futures.as_completed(futures):
+                path = futures[f]
+                digests = f.result()
+                self.set(missing[path], digests)
+                hashes[path] = digests
+        return hashes
@@ -0,0 +1,99 @@
+import concurrent.futures
+import os
+import os.path
+import stat
+
+
+class LocalEntry:
+    __slots__ = ('name', 'is_file', 'is_directory', 'size', 'mtime', 'inode')
+
+    def __init__(self, name, is_file, is_directory, size=None, mtime=None, inode=None):
+        self.name = name
+        self.is_file = is_file
+        self.is_directory = is_directory
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+
+    def from_stat(name, st):
+        return LocalEntry(
+            name,
+            stat.S_ISREG(st.st_mode),
+            stat.S_ISDIR(st.st_mode),
+            st.st_size,
+            st.st_mtime,
+            st.st_ino,
+        )
+
+    def from_dir_entry(entry):
+        try:
+            return LocalEntry.from_stat(entry.name, entry.stat())
+        except FileNotFoundError:
+            # Broken symbolic link
+            return LocalEntry(entry.name, False, False)
+
+    def from_path(path_local):
+        try:
+            return LocalEntry.from_stat(os.path.basename(path_local), os.stat(path_local))
+        except FileNotFoundError:
+            return None
+
+
+# Caches results of scanning local directories, one os.scandir
+# is used to get stat of all elements in a directory.
+# Cache is meant to be used for duration of single command,
+# changes made by client must be updated with refresh()
+class LocalScanner:
+    def __init__(self):
+        self._directories = {}
+
+    def _scan(self, path_local_directory):
+        children = {}
+        try:
+            with os.scandir(path_local_directory) as it:
+                for entry in it:
+                    children[entry.name] = LocalEntry.from_dir_entry(entry)
+        except (FileNotFoundError, NotADirectoryError):
+            children = None
+        # Assignment to dict is atomic, so directories can be scanned from multiple threads
+        self._directories[path_local_directory] = children
+        return children
+
+    def number_of_scanned_directories(self):
+        return len(self._directories)
+
+    def children(self, path_local_directory):
+        if path_local_directory in self._directories:
+            return self._directories[path_local_directory]
+        return self._scan(path_local_directory)
+
+    def entry(self, path_local):
+        path_parent, name = os.path.split(path_local)
+        children = self.children(path_parent)
+        if children is None:
+            return None
+        return children.get(name, None)
+
+    def refresh(self, path_local):
+        entry = LocalEntry.from_path(path_local)
+        path_parent, name = os.path.split(path_local)
+        children = self._directories.get(path_parent, None)
+        if children is not None:
+            if entry is None:
+                children.pop(name, None)
+            else:
+                children[name] = entry
+        if entry is None or not entry.is_directory:
+            self._directories.pop(path_local, None)
+        return entry
+
+    def scan_directories(self, paths_local_directory, max_workers=1):
+        paths = [p for p in paths_local_directory if p not in self._directories]
+        if max_workers <= 1 or len(paths) <= 1:
+            for p in paths:
+                self._scan(p)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in executor.map(self._scan, paths):
+                pass
@@ -21,6 +21,15 @@ def _command_completed():
     print('Command completed successfully')
 
 
+def _add_priority_argument(parser):
+    parser.add_argument(
+        '--priority',
+        choices=zyn.connection.PRIORITIES,
+        default=zyn.connection.PRIORITY_BULK,
+        help='Priority of the transfer traffic compared to other traffic of the process',
+    )
+
+
 class ZynShell(cmd.Cmd):
     intro = 'Zyn CLI client, type "help" for help'
     prompt = ' '
@@ -159,6 +168,8 @@ class ZynShell(cmd.Cmd):
         group = parser.add_mutually_exclusive_group(required=False)
         group.add_argument('-ra', '--random-access', action='store_true')
         group.add_argument('-b', '--blob', action='store_true')
+        parser.add_argument('-r', '--recursive', action='store_true')
+        _add_priority_argument(parser)
         return parser
 
     def help_add(self):
@@ -176,9 +187,10 @@ class ZynShell(cmd.Cmd):
 
         paths = args['paths']
         elements = []
-        for path in paths:
-            path_remote = self._to_absolute_remote_path(path)
-            elements += self._client.add(path_remote, file_type)
+        with self._client.priority(args['priority']):
+            for path in paths:
+                path_remote = self._to_absolute_remote_path(path)
+                elements += self._client.add(path_remote, file_type, args['recursive'])
 
         print('Added elements:')
         self._local_elements_header()
@@ -206,6 +218,7 @@ class ZynShell(cmd.Cmd):
         parser = argparse.ArgumentParser(prog='fetch')
         parser.add_argument('-p', '--path', type=str, default='/')
         parser.add_argument('-o', '--overwrite-local', action='store_true')
+        _add_priority_argument(parser)
         return parser
 
     def help_fetch(self):
@@ -217,7 +230,8 @@ class ZynShell(cmd.Cmd):
 
         path = args['path']
         path_remote = self._to_absolute_remote_path(path)
-        elements = self._client.fetch(path_remote, args['overwrite_local'])
+        with self._client.priority(args['priority']):
+            elements = self._client.fetch(path_remote, args['overwrite_local'])
         if elements:
             print('Fetched elements:')
             self._local_elements_header()
@@ -231,6 +245,7 @@ class ZynShell(cmd.Cmd):
         parser = argparse.ArgumentParser(prog='sync')
         parser.add_argument('-p', '--path', type=str, default='/')
         parser.add_argument('-dl', '--discard-local-changes', action='store_true')
+        _add_priority_argument(parser)
         return parser
 
     def help_sync(self):
@@ -240,10 +255,11 @@ class ZynShell(cmd.Cmd):
         parser = self._parser_sync()
         args = vars(parser.parse_args(self._parse_args(args)))
         path_remote = self._to_absolute_remote_path(args['path'])
-        elements = self._client.sync(
-            path_remote,
-            args['discard_local_changes']
-        )
+        with self._client.priority(args['priority']):
+            elements = self._client.sync(
+                path_remote,
+                args['discard_local_changes']
+            )
         if elements:
             print('Elements synchronized')
             self._local_elements_header()
@@ -471,3 +487,21 @@ class ZynShell(cmd.Cmd):
         print('{}: {}'.format('active-connections', rsp.active_connections))
         print('{}: {}'.format('number-of-files', rsp.number_of_files))
         print('{}: {}'.format('number-of-open-files', rsp.number_of_open_files))
+
+        metrics = self._client.block_cache_metrics()
+        if metrics is not None:
+            for name in ['hits', 'disk-hits', 'misses', 'evictions', 'size', 'size-on-disk']:
+                print('{}: {}'.format('block-cache-' + name, metrics[name]))
+
+        metrics = self._client.concurrency_metrics()
+        if metrics is not None:
+            print('{}: {}'.format('transfer-concurrency-limit', metrics['limit']))
+            print('{}: {}'.format('transfer-concurrency-increases', metrics['increases']))
+            print('{}: {}'.format('transfer-concurrency-decreases', metrics['decreases']))
+            for timestamp, action, limit, reason in metrics['decisions'][-5:]:
+                print('\t{} {} to {}: {}'.format(
+                    zyn.util.timestamp_to_datetime(timestamp),
+                    action,
+                    limit,
+                    reason,
+                ))
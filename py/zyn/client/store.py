@@ -0,0 +1,151 @@
+import json
+import os
+import os.path
+import sqlite3
+
+
+DATA_FORMAT = 2
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_state_store(path):
+    with open(path, 'rb') as fp:
+        return fp.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+
+
+def _remove_database_files(path):
+    for p in [path, path + '-wal', path + '-shm', path + '-journal']:
+        if os.path.exists(p):
+            os.remove(p)
+
+
+# Client state is stored in SQLite with one row per filesystem element,
+# saving state only writes the elements that changed since previous save.
+# Each save is a single transaction, so an interrupted write leaves
+# the previous state intact
+class StateStore:
+    def __init__(self, path, db):
+        self._path = path
+        self._db = db
+
+    def create(path):
+        _remove_database_files(path)
+        store = StateStore.open(path)
+        store.set_info({'data-format': DATA_FORMAT})
+        return store
+
+    def open(path):
+        db = sqlite3.connect(path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        with db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS info ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT NOT NULL)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS elements ('
+                'node_id INTEGER PRIMARY KEY, '
+                'node_id_parent INTEGER, '
+                'name TEXT NOT NULL, '
+                'data TEXT NOT NULL)'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS elements_by_parent '
+                'ON elements (node_id_parent, name)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS file_hashes ('
+                'inode INTEGER NOT NULL, '
+                'mtime REAL NOT NULL, '
+                'size INTEGER NOT NULL, '
+                'block_size INTEGER NOT NULL, '
+                'digests TEXT NOT NULL, '
+                'PRIMARY KEY (inode, mtime, size, block_size))'
+            )
+        return StateStore(path, db)
+
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._db.close()
+
+    def info(self):
+        return {
+            key: json.loads(value)
+            for key, value in self._db.execute('SELECT key, value FROM info')
+        }
+
+    def set_info(self, values):
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in values.items()],
+            )
+
+    def number_of_elements(self):
+        return self._db.execute('SELECT COUNT(*) FROM elements').fetchone()[0]
+
+    def element(self, node_id):
+        row = self._db.execute(
+            'SELECT data FROM elements WHERE node_id = ?',
+            (node_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def children(self, node_id_parent):
+        # Name of child -> node id of child
+        return {
+            name: node_id for name, node_id in self._db.execute(
+                'SELECT name, node_id FROM elements WHERE node_id_parent = ?',
+                (node_id_parent,),
+            )
+        }
+
+    def elements(self):
+        for node_id, data in self._db.execute('SELECT node_id, data FROM elements'):
+            yield node_id, json.loads(data)
+
+    def node_ids(self):
+        return [row[0] for row in self._db.execute('SELECT node_id FROM elements')]
+
+    def write(self, modified, removed, clear=False):
+        # modified: list of (node_id, node_id_parent, name, data), removed: list of node ids
+        with self._db:
+            if clear:
+                self._db.execute('DELETE FROM elements')
+            self._db.executemany(
+                'DELETE FROM elements WHERE node_id = ?',
+                [(node_id,) for node_id in removed],
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO elements (node_id, node_id_parent, name, data) '
+                'VALUES (?, ?, ?, ?)',
+                [
+                    (node_id, node_id_parent, name, json.dumps(data))
+                    for node_id, node_id_parent, name, data in modified
+                ],
+            )
+
+    def file_hashes(self, key):
+        # key: (inode, mtime, size, block_size)
+        row = self._db.execute(
+            'SELECT digests FROM file_hashes '
+            'WHERE inode = ? AND mtime = ? AND size = ? AND block_size = ?',
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_file_hashes(self, key, digests):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO file_hashes (inode, mtime, size, block_size, digests) '
+                'VALUES (?, ?, ?, ?, ?)',
+                tuple(key) + (json.dumps(digests),),
+            )
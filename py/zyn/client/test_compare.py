@@ -0,0 +1,119 @@
+import logging
+import os.path
+import tempfile
+import unittest
+
+import zyn.client.compare
+from zyn.connection import (
+    BATCH_EDIT_TYPE_DELETE,
+    BATCH_EDIT_TYPE_WRITE,
+)
+
+
+class FakeResponse:
+    def is_error(self):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, data, block_size):
+        self.data = bytearray(data)
+        self.block_size = block_size
+        self.reads = []
+
+    def read_file(self, node_id, offset, size):
+        # Server does not allow reads over block boundary
+        if offset // self.block_size != (offset + size - 1) // self.block_size:
+            raise RuntimeError('Read over block boundary')
+        self.reads.append((offset, size))
+        return FakeResponse(), bytes(self.data[offset:offset + size])
+
+
+class TestDifferingRanges(unittest.TestCase):
+    def test_ranges_are_trimmed_to_differing_bytes(self):
+        data_1 = bytearray(100)
+        data_2 = bytearray(100)
+        data_2[3] = 1
+        data_2[12] = 1
+        data_2[50] = 1
+        ranges = zyn.client.compare.differing_ranges(bytes(data_1), bytes(data_2), page_size=10)
+        self.assertEqual(ranges, [(3, 10), (50, 1)])
+
+    def test_equal_data(self):
+        self.assertEqual(zyn.client.compare.differing_ranges(b'abc', b'abc'), [])
+
+
+class TestCompareRandomAccessFile(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _compare(self, remote, local, block_size=16, window_size=8):
+        path = os.path.join(self._dir.name, 'file')
+        with open(path, 'wb') as fp:
+            fp.write(local)
+        connection = FakeConnection(remote, block_size)
+        operations = zyn.client.compare.compare_random_access_file(
+            connection,
+            1,
+            len(remote),
+            block_size,
+            path,
+            window_size,
+        )
+        return operations, connection
+
+    def _apply(self, remote, local, operations):
+        data = bytearray(remote)
+        for operation_type, offset, size in operations:
+            if operation_type == BATCH_EDIT_TYPE_WRITE:
+                data[offset:offset + size] = local[offset:offset + size]
+            else:
+                del data[offset:offset + size]
+        return bytes(data)
+
+    def test_writes_are_limited_to_differing_parts(self):
+        remote = bytes(range(40))
+        local = bytearray(remote)
+        local[5] = 0xff
+        local[30] = 0xff
+        operations, connection = self._compare(remote, bytes(local))
+        self.assertEqual(operations, [
+            (BATCH_EDIT_TYPE_WRITE, 5, 1),
+            (BATCH_EDIT_TYPE_WRITE, 30, 1),
+        ])
+        self.assertTrue(all(size <= 8 for _, size in connection.reads))
+
+    def test_local_file_is_longer(self):
+        remote = b'a' * 20
+        local = b'a' * 18 + b'b' * 20
+        operations, _ = self._compare(remote, local)
+        self.assertEqual(self._apply(remote, local, operations), local)
+        for operation_type, offset, size in operations:
+            self.assertEqual(offset // 16, (offset + size - 1) // 16)
+
+    def test_local_file_is_shorter(self):
+        remote = b'a' * 40
+        local = b'a' * 10 + b'b' * 10
+        operations, _ = self._compare(remote, local)
+        self.assertEqual(operations[-1], (BATCH_EDIT_TYPE_DELETE, 20, 20))
+        self.assertEqual(self._apply(remote, local, operations), local)
+
+    def test_edit_without_changes(self):
+        remote = b'a' * 40
+        path = os.path.join(self._dir.name, 'file')
+        with open(path, 'wb') as fp:
+            fp.write(remote)
+        revision = zyn.client.compare.edit_random_access_file_streaming(
+            FakeConnection(remote, 16),
+            1,
+            5,
+            len(remote),
+            16,
+            path,
+            logging.getLogger(__name__),
+            window_size=8,
+        )
+        self.assertEqual(revision, 5)
@@ -0,0 +1,58 @@
+import os.path
+import tempfile
+import unittest
+
+import zyn.client.hashing
+from zyn.client.scanner import LocalEntry
+from zyn.client.store import StateStore
+
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, name, data):
+        path = os.path.join(self._dir.name, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def test_block_hashes_do_not_depend_on_update_sizes(self):
+        data = bytes(range(256)) * 10
+        expected = zyn.client.hashing.hash_data(data, block_size=1000)
+        self.assertEqual(len(expected), 3)
+
+        hasher = zyn.client.hashing.BlockHasher(block_size=1000)
+        digests = []
+        for i in range(0, len(data), 333):
+            digests += [d for _, d in hasher.update(data[i:i + 333])]
+        digests += [d for _, d in hasher.finish()]
+        self.assertEqual(digests, expected)
+        self.assertEqual(hasher.number_of_blocks(), 3)
+
+    def test_hash_file(self):
+        data = b'a' * 2500
+        path = self._write('file', data)
+        self.assertEqual(
+            zyn.client.hashing.hash_file(path, block_size=1000),
+            zyn.client.hashing.hash_data(data, block_size=1000),
+        )
+        self.assertEqual(zyn.client.hashing.hash_file(self._write('empty', b'')), [])
+
+    def test_hash_cache(self):
+        path_1 = self._write('file-1', b'1')
+        path_2 = self._write('file-2', b'2')
+        store = StateStore.create(os.path.join(self._dir.name, 'state'))
+        cache = zyn.client.hashing.HashCache(store)
+        entries = {p: LocalEntry.from_path(p) for p in [path_1, path_2]}
+        hashes = cache.hash_files(entries, max_workers=2)
+        self.assertEqual(hashes[path_1], zyn.client.hashing.hash_data(b'1'))
+        self.assertEqual(hashes[path_2], zyn.client.hashing.hash_data(b'2'))
+
+        cache = zyn.client.hashing.HashCache(store)
+        self.assertEqual(cache.get(entries[path_1]), hashes[path_1])
+        self.assertIsNone(cache.get(LocalEntry('file', True, False, 1, 0.0, 0)))
+        store.close()
@@ -0,0 +1,89 @@
+import logging
+import os
+import os.path
+import tempfile
+import unittest
+
+from zyn.client.scanner import LocalScanner
+from zyn.client.data import (
+    LocalDirectory,
+    LocalFilesystemManager,
+)
+
+
+class TestLocalScanner(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = self._dir.name
+        os.mkdir(os.path.join(self._path, 'dir'))
+        with open(os.path.join(self._path, 'file'), 'wb') as fp:
+            fp.write(b'data')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_entries(self):
+        scanner = LocalScanner()
+        children = scanner.children(self._path)
+        self.assertEqual(sorted(children.keys()), ['dir', 'file'])
+        self.assertTrue(children['dir'].is_directory)
+        self.assertTrue(children['file'].is_file)
+        self.assertEqual(children['file'].size, 4)
+        self.assertIs(scanner.entry(os.path.join(self._path, 'file')), children['file'])
+        self.assertIsNone(scanner.entry(os.path.join(self._path, 'missing')))
+        self.assertIsNone(scanner.children(os.path.join(self._path, 'missing')))
+
+    def test_results_are_cached_until_refreshed(self):
+        scanner = LocalScanner()
+        path_file = os.path.join(self._path, 'file')
+        self.assertEqual(scanner.entry(path_file).size, 4)
+        with open(path_file, 'wb') as fp:
+            fp.write(b'more data')
+        self.assertEqual(scanner.entry(path_file).size, 4)
+        self.assertEqual(scanner.refresh(path_file).size, 9)
+        self.assertEqual(scanner.entry(path_file).size, 9)
+
+        os.remove(path_file)
+        self.assertIsNone(scanner.refresh(path_file))
+        self.assertIsNone(scanner.entry(path_file))
+
+    def test_scan_directories_in_parallel(self):
+        paths = [self._path]
+        for i in range(10):
+            path = os.path.join(self._path, 'dir', str(i))
+            os.mkdir(path)
+            paths.append(path)
+        scanner = LocalScanner()
+        scanner.scan_directories(paths, max_workers=4)
+        self.assertEqual(scanner.number_of_scanned_directories(), len(paths))
+        self.assertEqual(scanner.children(paths[-1]), {})
+
+
+class TestStatCache(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._fs = LocalFilesystemManager(self._dir.name, logging.getLogger(__name__))
+        os.mkdir(os.path.join(self._dir.name, 'tracked'))
+        os.mkdir(os.path.join(self._dir.name, 'untracked'))
+        with open(os.path.join(self._dir.name, 'file'), 'wb') as fp:
+            fp.write(b'data')
+        directory = LocalDirectory('/tracked', self._fs, 1)
+        self._fs._add_element_to_filesystem(directory, self._fs.local_element_from_node_id(0))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_untracked_children(self):
+        root = self._fs.local_element_from_node_id(0)
+        with self._fs.stat_cache() as scanner:
+            untracked = sorted(e.path_remote() for e in root.children_local_untracked())
+            self.assertEqual(untracked, ['/file', '/untracked'])
+            self.assertTrue(self._fs.local_element_from_node_id(1).local_element_exists())
+            self.assertEqual(scanner.number_of_scanned_directories(), 1)
+
+    def test_cache_is_released_after_block(self):
+        with self._fs.stat_cache():
+            with self._fs.stat_cache() as scanner:
+                self.assertIs(scanner, self._fs._scanner)
+            self.assertIsNotNone(self._fs._scanner)
+        self.assertIsNone(self._fs._scanner)
@@ -0,0 +1,114 @@
+import json
+import logging
+import os.path
+import tempfile
+import unittest
+
+import zyn.connection
+import zyn.client.store
+from zyn.client.client import State
+from zyn.client.data import (
+    LocalDirectory,
+    LocalFile,
+    LocalFilesystemManager,
+)
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path_state = os.path.join(self._dir.name, 'state')
+        self._log = logging.getLogger(__name__)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _state(self):
+        return State(
+            'user',
+            '127.0.0.1',
+            1234,
+            LocalFilesystemManager(self._dir.name, self._log),
+            server_id=1,
+            server_started_at='2020-01-01',
+        )
+
+    def _add_directory(self, fs, path, node_id):
+        element = LocalDirectory(path, fs, node_id)
+        fs._add_element_to_filesystem(element, fs.local_element_from_remote_path(
+            element.path_parent()
+        ))
+        return element
+
+    def _add_file(self, fs, path, node_id, revision):
+        element = LocalFile(path, zyn.connection.FILE_TYPE_BLOB, fs, node_id, revision)
+        fs._add_element_to_filesystem(element, fs.local_element_from_remote_path(
+            element.path_parent()
+        ))
+        return element
+
+    def _reopen(self, state):
+        state.to_file(self._path_state)
+        state.close()
+        return State.from_file(self._path_state, self._log)
+
+    def test_save_and_load_elements(self):
+        state = self._state()
+        self._add_directory(state.fs, '/dir', 1)
+        self._add_file(state.fs, '/dir/file', 2, 3)
+
+        state = self._reopen(state)
+        self.assertEqual(state.username, 'user')
+        self.assertEqual(state.server_id, 1)
+        self.assertEqual(state.fs.size(), 3)
+        self.assertTrue(state.fs.is_tracked(path_remote='/dir/file'))
+        element = state.fs.local_element_from_remote_path('/dir/file')
+        self.assertEqual(element.node_id(), 2)
+        self.assertEqual(element.revision(), 3)
+        self.assertEqual(element.parent().node_id_children(), [2])
+        self.assertFalse(state.fs.is_tracked(path_remote='/dir/other'))
+        state.close()
+
+    def test_only_changes_are_written(self):
+        state = self._state()
+        self._add_directory(state.fs, '/dir', 1)
+        self._add_file(state.fs, '/dir/file', 2, 3)
+        state = self._reopen(state)
+
+        element = state.fs.local_element_from_remote_path('/dir/file')
+        state.fs.remove(element)
+        self._add_file(state.fs, '/file', 4, 5)
+        self.assertEqual(state.fs._modified, {4})
+        self.assertEqual(state.fs._removed, {2})
+
+        state = self._reopen(state)
+        self.assertFalse(state.fs.is_tracked(path_remote='/dir/file'))
+        self.assertFalse(state.fs.is_tracked(node_id=2))
+        self.assertTrue(state.fs.is_tracked(path_remote='/file'))
+        self.assertEqual(state.fs.size(), 3)
+        state.close()
+
+    def test_reused_node_id_is_not_resolved_with_old_path(self):
+        state = self._state()
+        self._add_file(state.fs, '/a', 1, 1)
+        state = self._reopen(state)
+
+        state.fs.remove(state.fs.local_element_from_remote_path('/a'))
+        self._add_file(state.fs, '/b', 1, 2)
+        state = self._reopen(state)
+        self.assertFalse(state.fs.is_tracked(path_remote='/a'))
+        self.assertEqual(state.fs.local_element_from_remote_path('/b').revision(), 2)
+        state.close()
+
+    def test_data_format_1_is_converted(self):
+        state = self._state()
+        self._add_directory(state.fs, '/dir', 1)
+        with open(self._path_state, 'w') as fp:
+            json.dump(state.to_dict(), fp)
+
+        state = State.from_file(self._path_state, self._log)
+        self.assertTrue(zyn.client.store.is_state_store(self._path_state))
+        self.assertTrue(os.path.exists(self._path_state + '.data-format-1'))
+        self.assertTrue(state.fs.is_tracked(path_remote='/dir'))
+        self.assertEqual(state.fs.size(), 2)
+        state.close()
@@ -0,0 +1,325 @@
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import tornado.httputil
+import tornado.web
+
+import zyn.client.web
+import zyn.connection
+
+
+class TestRanges(unittest.TestCase):
+    def test_parse_range(self):
+        parse = zyn.client.web._parse_range
+        self.assertEqual(parse('bytes=0-9', 100), [(0, 10)])
+        self.assertEqual(parse('bytes=90-', 100), [(90, 10)])
+        self.assertEqual(parse('bytes=-10', 100), [(90, 10)])
+        self.assertEqual(parse('bytes=95-200', 100), [(95, 5)])
+        self.assertEqual(parse('bytes=0-0, 10-19', 100), [(0, 1), (10, 10)])
+        self.assertEqual(parse('bytes=100-', 100), [])
+        self.assertIsNone(parse('bytes=10-5', 100))
+        self.assertIsNone(parse('bytes=a-b', 100))
+        self.assertIsNone(parse('items=0-9', 100))
+
+    def test_etag_matches(self):
+        matches = zyn.client.web._etag_matches
+        self.assertTrue(matches('"1-2"', '"1-2"'))
+        self.assertTrue(matches('"1-1", W/"1-2"', '"1-2"'))
+        self.assertTrue(matches('*', '"1-2"'))
+        self.assertFalse(matches('"1-1"', '"1-2"'))
+        self.assertFalse(matches('', '"1-2"'))
+
+
+class FakeHttpConnection:
+    def set_close_callback(self, callback):
+        pass
+
+
+class FakeOpenResponse:
+    def __init__(self, node_id, revision, size):
+        self.node_id = node_id
+        self.revision = revision
+        self.size = size
+
+
+class TestRawResponse(unittest.TestCase):
+    def _handler(self, headers):
+        request = tornado.httputil.HTTPServerRequest(
+            method='GET',
+            uri='/raw/file',
+            headers=tornado.httputil.HTTPHeaders(headers),
+            connection=FakeHttpConnection(),
+        )
+        handler = zyn.client.web.RawHandler(tornado.web.Application(), request)
+        handler._filename = 'file'
+        return handler
+
+    def test_recreated_file_is_not_matched(self):
+        # Recreated file gets same node id and revision as deleted file
+        etag = zyn.client.web._etag(5, 1700000000, 0)
+        open_rsp = FakeOpenResponse(5, 0, 10)
+
+        handler = self._handler({'If-None-Match': etag})
+        self.assertEqual(handler.response_parts(open_rsp, 1700000000), [])
+        self.assertEqual(handler.get_status(), 304)
+
+        handler = self._handler({'If-None-Match': etag})
+        self.assertEqual(handler.response_parts(open_rsp, 1700000001), [(None, 0, 10)])
+        self.assertEqual(handler.get_status(), 200)
+
+        handler = self._handler({'Range': 'bytes=0-4', 'If-Range': etag})
+        self.assertEqual(handler.response_parts(open_rsp, 1700000001), [(None, 0, 10)])
+        self.assertEqual(handler.get_status(), 200)
+
+    def test_range_is_served_for_matching_file(self):
+        etag = zyn.client.web._etag(5, 1700000000, 0)
+        handler = self._handler({'Range': 'bytes=0-4', 'If-Range': etag})
+        parts = handler.response_parts(FakeOpenResponse(5, 0, 10), 1700000000)
+        self.assertEqual(parts, [(None, 0, 5)])
+        self.assertEqual(handler.get_status(), 206)
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, 'sessions.db')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_sessions_are_kept_over_restart(self):
+        store = zyn.client.web.SessionStore(self._path)
+        secret = store.cookie_secret()
+        store.add(2 ** 100, 'user', 'password', 10.0)
+        store.close()
+
+        store = zyn.client.web.SessionStore(self._path)
+        self.assertEqual(store.cookie_secret(), secret)
+        self.assertEqual(store.get(2 ** 100), ('user', 'password', 10.0))
+        self.assertEqual(os.stat(self._path).st_mode & 0o777, 0o600)
+        store.remove(2 ** 100)
+        self.assertIsNone(store.get(2 ** 100))
+        store.close()
+
+    def test_existing_files_are_restricted_to_owner(self):
+        store = zyn.client.web.SessionStore(self._path)
+        store.close()
+        paths = [self._path, self._path + '-wal', self._path + '-shm']
+        for path in paths:
+            with open(path, 'ab'):
+                pass
+            os.chmod(path, 0o644)
+
+        store = zyn.client.web.SessionStore(self._path)
+        self.addCleanup(store.close)
+        for path in paths:
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_session_removed_by_other_process(self):
+        for name, value in [
+                ('log', logging.getLogger(__name__)),
+                ('backend_connections', zyn.client.web.BackendConnections(4, 2, 60)),
+        ]:
+            self.addCleanup(setattr, zyn.client.web, name, getattr(zyn.client.web, name))
+            setattr(zyn.client.web, name, value)
+        store_1 = zyn.client.web.SessionStore(self._path)
+        store_2 = zyn.client.web.SessionStore(self._path)
+        self.addCleanup(store_1.close)
+        self.addCleanup(store_2.close)
+        sessions_1 = zyn.client.web.UserSessions(store_1)
+        sessions_2 = zyn.client.web.UserSessions(store_2)
+
+        id_ = sessions_1.add(zyn.client.web.UserSession('user', 'password'))
+        session = sessions_2.session(id_)
+        self.assertEqual(session.username(), 'user')
+        self.assertIs(sessions_2.session(id_), session)
+        sessions_1.remove(id_)
+        self.assertIsNone(sessions_2.session(id_))
+        with self.assertRaises(RuntimeError):
+            with session.connection():
+                pass
+
+    def test_remove_created_before(self):
+        store = zyn.client.web.SessionStore()
+        store.add(1, 'user', 'password', 10.0)
+        store.add(2, 'user', 'password', 20.0)
+        self.assertEqual(store.remove_created_before(15.0), [1])
+        self.assertIsNone(store.get(1))
+        self.assertIsNotNone(store.get(2))
+        store.close()
+
+
+class FakeElement:
+    def __init__(self, name, size=None):
+        self.name = name
+        self.node_id = len(name)
+        self.revision = 1
+        self.size = size
+        self.is_open = False
+
+    def is_directory(self):
+        return self.size is None
+
+    def is_blob(self):
+        return True
+
+
+class TestListing(unittest.TestCase):
+    def test_view(self):
+        listing = zyn.client.web._Listing([
+            FakeElement('b', 1),
+            FakeElement('dir'),
+            FakeElement('A', 3),
+            FakeElement('c', 2),
+        ])
+        names = [e['name'] for e in listing.view('name', '')]
+        self.assertEqual(names, ['dir', 'A', 'b', 'c'])
+        names = [e['name'] for e in listing.view('-size', '')]
+        self.assertEqual(names, ['dir', 'A', 'c', 'b'])
+        names = [e['name'] for e in listing.view('name', 'B')]
+        self.assertEqual(names, ['b'])
+        self.assertIs(listing.view('name', ''), listing.view('name', ''))
+
+
+class FakeStream:
+    def __init__(self):
+        self.data = io.BytesIO()
+        self.number_of_writes = 0
+
+    def handle_data(self, _, data):
+        self.data.write(data)
+        self.number_of_writes += 1
+
+
+class TestArchive(unittest.TestCase):
+    def _write(self, archive, out):
+        archive.start_member('d/sub', {'type': 'dir'}, 1700000000)
+        archive.end_member()
+        archive.start_member('d/a', {'type': 'file', 'size': 5}, 1700000000)
+        archive.write(b'abc')
+        out.flush()
+        archive.write(b'de')
+        out.flush()
+        archive.end_member()
+        archive.close()
+        out.flush()
+
+    def test_tar(self):
+        stream = FakeStream()
+        out = zyn.client.web._ArchiveOutput(stream)
+        self._write(zyn.client.web._TarArchive(out), out)
+        self.assertEqual(len(stream.data.getvalue()) % tarfile.RECORDSIZE, 0)
+        stream.data.seek(0)
+        with tarfile.open(fileobj=stream.data) as tar:
+            self.assertEqual(tar.getnames(), ['d/sub', 'd/a'])
+            self.assertEqual(tar.extractfile('d/a').read(), b'abcde')
+
+    def test_zip(self):
+        stream = FakeStream()
+        out = zyn.client.web._ArchiveOutput(stream)
+        self._write(zyn.client.web._ZipArchive(out, zipfile.ZIP_DEFLATED), out)
+        self.assertGreater(stream.number_of_writes, 1)
+        with zipfile.ZipFile(stream.data) as z:
+            self.assertEqual(z.namelist(), ['d/sub/', 'd/a'])
+            self.assertEqual(z.read('d/a'), b'abcde')
+
+
+class TestRequestBodyStream(unittest.TestCase):
+    def test_body_is_read_in_blocks(self):
+        async def upload():
+            loop = asyncio.get_running_loop()
+            stream = zyn.client.web._RequestBodyStream('/a', 10, loop, 1)
+            await stream.put(b'abc')
+            await stream.put(b'defghij')
+            stream.complete()
+            return [await loop.run_in_executor(None, stream.get, 4) for _ in range(4)]
+
+        self.assertEqual(asyncio.run(upload()), [b'abcd', b'efgh', b'ij', None])
+
+    def test_aborted_upload_is_not_read(self):
+        async def upload():
+            loop = asyncio.get_running_loop()
+            stream = zyn.client.web._RequestBodyStream('/a', 10, loop, 1)
+            await stream.put(b'abc')
+            stream.abort()
+            await loop.run_in_executor(None, stream.get, 4)
+
+        with self.assertRaises(ConnectionAbortedError):
+            asyncio.run(upload())
+
+
+class FakeUploadResponse:
+    def __init__(self, node_id=5, revision=3, size=4, block_size=8):
+        self.node_id = node_id
+        self.revision = revision
+        self.size = size
+        self.block_size = block_size
+        self.type_of_file = zyn.connection.FILE_TYPE_BLOB
+
+    def is_error(self):
+        return False
+
+    def as_open_rsp(self):
+        return self
+
+    def as_write_rsp(self):
+        return self
+
+
+class FakeUploadConnection:
+    def __init__(self):
+        self.content = b'data'
+        self.is_closed = False
+
+    def open_file_write(self, node_id=None, path=None):
+        return FakeUploadResponse(size=len(self.content))
+
+    def blob_write_stream(self, node_id, revision, stream, block_size):
+        self.content = b''
+        while True:
+            block = stream.get(min(block_size, stream.size()))
+            if block is None:
+                break
+            self.content += block
+        return FakeUploadResponse(revision=revision + 1, size=len(self.content))
+
+    def close_file(self, node_id):
+        self.is_closed = True
+        return FakeUploadResponse()
+
+
+class FakeUploadSession:
+    def __init__(self):
+        self.fake_connection = FakeUploadConnection()
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.fake_connection
+
+
+class TestUpload(unittest.TestCase):
+    def test_empty_body_truncates_file(self):
+        session = FakeUploadSession()
+
+        async def upload():
+            loop = asyncio.get_running_loop()
+            stream = zyn.client.web._RequestBodyStream('/a', 0, loop, 1)
+            stream.complete()
+            return await loop.run_in_executor(
+                None,
+                zyn.client.web._upload,
+                session,
+                '/a',
+                stream,
+            )
+
+        self.assertEqual(asyncio.run(upload()), (5, 4))
+        self.assertEqual(session.fake_connection.content, b'')
+        self.assertTrue(session.fake_connection.is_closed)
@@ -1,21 +1,37 @@
 import argparse
+import asyncio
 import base64
+import collections
+import concurrent.futures
 import datetime
+import io
 import logging
+import mimetypes
 import os
 import os.path
+import posixpath
+import socket
+import sqlite3
 import ssl
 import uuid
 import subprocess
 import sys
+import tarfile
+import threading
 import time
+import zipfile
 
+import tornado.httpserver
+import tornado.ioloop
 import tornado.log
+import tornado.netutil
+import tornado.process
 import tornado.web
 import tornado.websocket
 
 import zyn.connection
 import zyn.errors
+import zyn.exception
 import zyn.util
 
 
@@ -31,13 +47,44 @@ COOKIE_NAME = 'zyn-cookie'
 FILE_TYPE_RANDOM_ACCESS = 'random-access'
 FILE_TYPE_BLOB = 'blob'
 COOKIE_DURATION_DAYS = 30
+ZYN_WORKERS = 8
+TRANSFER_WORKERS = 4
+REQUEST_TIMEOUT_SECONDS = 30
+TRANSFER_TIMEOUT_SECONDS = 120
+MAX_BACKEND_CONNECTIONS = 64
+CONNECTIONS_PER_SESSION = 4
+CONNECTION_IDLE_TIMEOUT_SECONDS = 5 * 60
+# Server default duration of authentication token is 10 seconds
+TOKEN_VALIDITY_SECONDS = 5
 create_zyn_connection = None
 log = None
+zyn_executor = None
+transfer_executor = None
+request_timeout = None
+transfer_timeout = None
+backend_connections = None
+token_validity = None
 URL_LOGIN = '/login'
 URL_FS = '/fs'
 QUERY_PARAN_NAME_PATH = 'path'
 QUERY_PARAN_NAME_MODE = 'mode'
 QUERY_PARAN_NAME_ERROR = 'error'
+MAX_NUMBER_OF_RANGES = 16
+LISTING_PAGE_SIZE = 500
+MAX_LISTING_PAGE_SIZE = 5000
+LISTINGS_PER_SESSION = 8
+LISTING_REFRESH_SECONDS = 2
+LISTING_CACHE_SECONDS = 60
+ARCHIVE_RANGE_SIZE = 1024 * 1024
+ARCHIVE_READ_AHEAD = 8
+ARCHIVE_READERS = 3
+UPLOAD_BUFFER_SIZE = 8 * 1024 * 1024
+UPLOAD_PROGRESS_INTERVAL_SECONDS = 10
+ARCHIVE_FORMATS = {
+    'zip': ('application/zip', '.zip'),
+    'zip-deflate': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+}
 
 
 def _get_client_cookie(handler):
@@ -56,7 +103,36 @@ def _get_client_cookie(handler):
     return cookie_user_id
 
 
-def _logout_user(handler):
+async def _run_in_executor(executor, timeout, function, *args):
+    # Zyn connections are blocking, so their I/O is done in worker threads
+    # and IOLoop keeps serving other requests. Function that times out is
+    # left to complete in its worker
+    future = tornado.ioloop.IOLoop.current().run_in_executor(executor, function, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        log.warning(f'Zyn request did not complete in {timeout} seconds')
+        raise tornado.web.HTTPError(504)
+
+
+async def _zyn_request(function, *args):
+    return await _run_in_executor(zyn_executor, request_timeout, function, *args)
+
+
+async def _user_session(handler):
+    # Returns session of logged in user or None. Session store is shared by
+    # processes and may be locked by another one, so it is read in worker
+    # instead of IOLoop
+    user_id = _get_client_cookie(handler)
+    if user_id is None:
+        return None
+    return await _zyn_request(user_sessions.session, user_id)
+
+
+async def _logout_user(handler):
+    user_id = _get_client_cookie(handler)
+    if user_id is not None:
+        await _zyn_request(user_sessions.remove, user_id)
     handler.clear_cookie(COOKIE_NAME)
     handler.redirect(URL_LOGIN)
 
@@ -82,51 +158,242 @@ def _generate_url(base_url, file_path=None, mode=None, error=None):
     return url
 
 
+def _element_to_json(element):
+    if element.is_directory():
+        return {
+            'type': 'dir',
+            'name': element.name,
+            'node_id': element.node_id,
+        }
+    return {
+        'type': 'file',
+        'name': element.name,
+        'node_id': element.node_id,
+        'revision': element.revision,
+        'file_type': FILE_TYPE_BLOB if element.is_blob() else FILE_TYPE_RANDOM_ACCESS,
+        'size': element.size,
+        'is_open': element.is_open,
+    }
+
+
+_LISTING_SORT_KEYS = {
+    'name': lambda e: e['name'].casefold(),
+    'size': lambda e: e.get('size', 0),
+    'type': lambda e: e.get('file_type', ''),
+    'revision': lambda e: e.get('revision', 0),
+}
+
+
+# Children of directory as listed by server, with sorted and filtered views
+# of it kept for following pages
+class _Listing:
+    MAX_NUMBER_OF_VIEWS = 16
+
+    def __init__(self, elements):
+        self._created = time.monotonic()
+        self._elements = [_element_to_json(e) for e in elements]
+        self._views = {}
+
+    def age(self):
+        return time.monotonic() - self._created
+
+    def view(self, sort, name_filter):
+        key = (sort, name_filter)
+        view = self._views.get(key, None)
+        if view is not None:
+            return view
+
+        elements = self._elements
+        if name_filter:
+            name_filter = name_filter.casefold()
+            elements = [e for e in elements if name_filter in e['name'].casefold()]
+        elements = sorted(
+            elements,
+            key=_LISTING_SORT_KEYS[sort.lstrip('-')],
+            reverse=sort.startswith('-'),
+        )
+        # Directories first, sort is stable so order is otherwise kept
+        elements.sort(key=lambda e: e['type'] != 'dir')
+
+        if len(self._views) >= self.MAX_NUMBER_OF_VIEWS:
+            self._views.clear()
+        self._views[key] = elements
+        return elements
+
+
+# Directory listings of session. Server does not keep revisions of
+# directories, so listing can not be validated against server. Instead a
+# listing is refreshed when its first page is requested, unless it was just
+# listed, and following pages are served from the same listing as long as it
+# is not too old, so that pages are consistent
+class DirectoryListings:
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.Lock()
+        self._listings = collections.OrderedDict()
+
+    def children(self, path):
+        return self._listing(path, LISTING_REFRESH_SECONDS).view('name', '')
+
+    def page(self, path, offset, limit, sort, name_filter):
+        max_age = LISTING_CACHE_SECONDS if offset > 0 else LISTING_REFRESH_SECONDS
+        elements = self._listing(path, max_age).view(sort, name_filter)
+        return len(elements), elements[offset:offset + limit]
+
+    def _listing(self, path, max_age):
+        with self._lock:
+            listing = self._listings.get(path, None)
+            if listing is not None and listing.age() < max_age:
+                self._listings.move_to_end(path)
+                return listing
+
+        with self._session.connection() as connection:
+            rsp = connection.query_fs_children(path=path)
+        zyn.util.check_server_response(rsp)
+        listing = _Listing(rsp.as_query_fs_children_rsp().elements)
+
+        with self._lock:
+            self._listings[path] = listing
+            self._listings.move_to_end(path)
+            while len(self._listings) > LISTINGS_PER_SESSION:
+                self._listings.popitem(last=False)
+        return listing
+
+
+# Caps number of connections web server has to Zyn server. Each session keeps
+# its authenticated connections in its own pool, so that requests of a session
+# do not need to connect and authenticate. Connections unused for idle_timeout
+# seconds are closed, and when cap is reached idle connections of all sessions
+# are closed to make room
+class BackendConnections:
+    def __init__(self, max_number_of_connections, connections_per_session, idle_timeout):
+        self._slots = threading.BoundedSemaphore(max_number_of_connections)
+        self._connections_per_session = connections_per_session
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pools = []
+
+    def create_pool(self, create_connection):
+        def create():
+            self._acquire_slot()
+            try:
+                return create_connection()
+            except BaseException:
+                self._slots.release()
+                raise
+
+        def close(connection):
+            try:
+                connection.disconnect()
+            finally:
+                self._slots.release()
+
+        pool = zyn.connection.ConnectionPool(
+            create,
+            self._connections_per_session,
+            close_connection=close,
+        )
+        with self._lock:
+            self._pools.append(pool)
+        return pool
+
+    def remove_pool(self, pool):
+        with self._lock:
+            self._pools.remove(pool)
+        pool.close()
+
+    def close_idle(self, max_idle_duration=None):
+        if max_idle_duration is None:
+            max_idle_duration = self._idle_timeout
+        with self._lock:
+            pools = list(self._pools)
+        return sum(p.close_idle(max_idle_duration) for p in pools)
+
+    def _acquire_slot(self):
+        if self._slots.acquire(blocking=False):
+            return
+        if self.close_idle(0) == 0:
+            log.warning('Maximum number of connections to Zyn server in use, waiting')
+        if not self._slots.acquire(timeout=request_timeout):
+            raise RuntimeError('No free connections to Zyn server')
+
+
 class UserSession:
-    def __init__(self, username, password):
+    def __init__(self, username, password, created_timestamp=None):
         self._username = username
         self._password = password
-        self._connection = None
-        self._created_timestamp = time.time()
+        self._pool = backend_connections.create_pool(self.create_logged_in_connection)
+        self._created_timestamp = created_timestamp or time.time()
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_allocated = None
+        self.listings = DirectoryListings(self)
+
+    def username(self):
+        return self._username
+
+    def password(self):
+        return self._password
+
+    def created_timestamp(self):
+        return self._created_timestamp
 
     def session_duration_sec(self):
         return time.time() - self._created_timestamp
 
-    def connect(self):
-        self._connection = create_zyn_connection()
+    def connection(self):
+        return self._pool.connection(zyn.connection.PRIORITY_INTERACTIVE)
 
-    def release_connection(self):
-        self._connection.disconnect()
-        self._connection = None
+    def close(self):
+        backend_connections.remove_pool(self._pool)
 
     def create_logged_in_connection(self):
         c = create_zyn_connection()
         rsp = c.authenticate(self._username, self._password)
         if rsp.is_error():
-            raise RuntimeError(f'Login failed, username="{username}", error="{rsp.error_code()}')
+            c.disconnect()
+            if rsp.error_code() == zyn.errors.InvalidUsernamePassword:
+                raise PermissionError(f'Invalid credentials, username="{self._username}"')
+            raise RuntimeError(
+                f'Login failed, username="{self._username}", error="{rsp.error_code()}'
+            )
         return c
 
-    def _reconnect_if_needed(self):
-        if self._connection is None:
-            log.debug(f'Creating new connection for user {self._username}')
-            self._connection = create_zyn_connection()
-            self.authenticate()
-
-    def authenticate(self):
-        rsp = self._connection.authenticate(self._username, self._password)
-        if rsp.is_error():
-            if rsp.error_code() == zyn.errors.InvalidUsernamePassword:
-                return False
-            else:
-                raise RuntimeError(f'Login failed, username="{username}", error="{rsp.error_code()}')
+    def login(self):
+        # Connection used to authenticate is kept for following requests
+        try:
+            with self.connection():
+                pass
+        except PermissionError:
+            self.close()
+            return False
+        self.preallocate_token()
         return True
 
-    def allocate_token(self):
-        self._reconnect_if_needed()
-        rsp = self._connection.allocate_authentication_token()
+    def token(self):
+        # Tokens can be used once and are valid only for a short time, token
+        # allocated ahead is used if it is still valid
+        with self._lock:
+            token = self._token
+            allocated = self._token_allocated
+            self._token = None
+        if token is not None and time.monotonic() - allocated < token_validity:
+            return token
+        return self._allocate_token()
+
+    def preallocate_token(self):
+        allocated = time.monotonic()
+        token = self._allocate_token()
+        with self._lock:
+            self._token = token
+            self._token_allocated = allocated
+
+    def _allocate_token(self):
+        with self.connection() as connection:
+            rsp = connection.allocate_authentication_token()
         if rsp.is_error():
             log.error('Failed to allocate login token for user "{}", code: {}'.format(
-                self._username(),
+                self._username,
                 rsp.error_code(),
             ))
             raise RuntimeError()
@@ -138,44 +405,163 @@ class UserSession:
         return rsp.as_allocate_auth_token_response().token
 
 
+def _preallocate_token(session):
+    try:
+        session.preallocate_token()
+    except Exception:
+        log.exception('Failed to preallocate authentication token')
+
+
+async def _session_token(session):
+    token = await _zyn_request(session.token)
+    # Token for next page load is allocated while this one is rendered
+    zyn_executor.submit(_preallocate_token, session)
+    return token
+
+
+# Sessions and cookie secret in SQLite database, so that sessions can be used
+# by all web server processes and are kept over restarts. Database contains
+# passwords of logged in users, so it is only readable by its owner. Without
+# path, database is kept in memory of the process
+def _restrict_to_owner(path):
+    # Store contains passwords, only owner may read it
+    if os.path.exists(path) and os.stat(path).st_mode & 0o077:
+        os.chmod(path, 0o600)
+
+
+class SessionStore:
+    def __init__(self, path=None):
+        self._path = path or ':memory:'
+        self._lock = threading.Lock()
+        if path is not None:
+            if not os.path.exists(path):
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+            _restrict_to_owner(path)
+        self._db = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        if path is not None:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            _restrict_to_owner(path + '-wal')
+            _restrict_to_owner(path + '-shm')
+        self._db.execute('PRAGMA busy_timeout=5000')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'id TEXT PRIMARY KEY, username TEXT NOT NULL, '
+            'password TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+
+    def close(self):
+        self._db.close()
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def cookie_secret(self):
+        self._execute(
+            'INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)',
+            ('cookie-secret', base64.b64encode(os.urandom(50)).decode('utf8')),
+        )
+        return self._execute('SELECT value FROM settings WHERE name = ?', ('cookie-secret', ))[0][0]
+
+    def get(self, id_):
+        rows = self._execute(
+            'SELECT username, password, created FROM sessions WHERE id = ?',
+            (str(id_), ),
+        )
+        if not rows:
+            return None
+        return rows[0]
+
+    def add(self, id_, username, password, created):
+        self._execute(
+            'INSERT INTO sessions (id, username, password, created) VALUES (?, ?, ?, ?)',
+            (str(id_), username, password, created),
+        )
+
+    def remove(self, id_):
+        self._execute('DELETE FROM sessions WHERE id = ?', (str(id_), ))
+
+    def remove_created_before(self, timestamp):
+        rows = self._execute('SELECT id FROM sessions WHERE created < ?', (timestamp, ))
+        self._execute('DELETE FROM sessions WHERE created < ?', (timestamp, ))
+        return [int(id_) for id_, in rows]
+
+
+# Sessions are read from store, session objects holding connections of
+# session are created in each process when session is first used. Store is
+# accessed in worker threads
 class UserSessions:
-    def __init__(self):
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
         self._sessions = {}
 
     def session(self, user_id):
-        try:
-            return self._sessions[user_id]
-        except KeyError:
-            log.error(f'User session not found with id "{user_id}"')
+        # Returns None if there is no session, session may have been removed
+        # by other process
+        row = self._store.get(user_id)
+        if row is None:
+            log.debug(f'User session not found with id "{user_id}"')
+            self._close_local(user_id)
             return None
 
-    def has_session(self, user_id):
-        return user_id in self._sessions
-
-    def sessions(self):
-        return self._sessions.items()
+        with self._lock:
+            session = self._sessions.get(user_id, None)
+            if session is None:
+                username, password, created = row
+                session = UserSession(username, password, created)
+                self._sessions[user_id] = session
+            return session
 
     def add(self, session):
         id_ = uuid.uuid4().int
-        self._sessions[id_] = session
+        self._store.add(
+            id_,
+            session.username(),
+            session.password(),
+            session.created_timestamp(),
+        )
+        with self._lock:
+            self._sessions[id_] = session
         return id_
 
     def remove(self, id_):
-        del self._sessions[id_]
+        self._store.remove(id_)
+        self._close_local(id_)
+
+    def remove_expired(self, max_duration):
+        for id_ in self._store.remove_created_before(time.time() - max_duration):
+            log.info(f'Cleaning up session {id_}')
+        with self._lock:
+            expired = [
+                id_ for id_, session in self._sessions.items()
+                if session.session_duration_sec() > max_duration
+            ]
+        for id_ in expired:
+            self._close_local(id_)
+
+    def _close_local(self, id_):
+        with self._lock:
+            session = self._sessions.pop(id_, None)
+        if session is not None:
+            session.close()
 
 
 class RootHandler(tornado.web.RequestHandler):
-    def get(self, args, kwargs=None):
+    async def get(self, args, kwargs=None):
         user_id = _get_client_cookie(self)
         log.info(f'Root handler, has token {user_id is None}')
-        if user_id is None or not user_sessions.has_session(user_id):
+        if await _user_session(self) is None:
             self.redirect(URL_LOGIN)
         else:
             self.redirect(URL_FS)
 
 
 class MainHandler(tornado.web.RequestHandler):
-    def get(self, args, kwargs=None):
+    async def get(self, args, kwargs=None):
         global user_sessions
         global server_address
         global create_zyn_connection
@@ -185,7 +571,8 @@ class MainHandler(tornado.web.RequestHandler):
 
         log.info(f'Main handler, path "{path}"')
 
-        if user_id is None or not user_sessions.has_session(user_id):
+        session = await _user_session(self)
+        if session is None:
 
             url = _generate_url(URL_LOGIN, path, self.get_argument(QUERY_PARAN_NAME_MODE, None))
             log.info(f'Request for "{path}" without token, redirecting to {url}')
@@ -193,9 +580,7 @@ class MainHandler(tornado.web.RequestHandler):
 
         else:
 
-            session = user_sessions.session(user_id)
-            token = session.allocate_token()
-            session.release_connection()
+            token = await _session_token(session)
 
             path_dir, filename = os.path.split(os.path.normpath(path))
             log.info(f'Rendering web client with parent "{path_dir}" and filename "{filename}"')
@@ -212,66 +597,737 @@ class MainHandler(tornado.web.RequestHandler):
             )
 
 
+# Forwards blocks read in transfer worker to web client. Worker waits until
+# each block is flushed to client, so memory used by download stays at one
+# block regardless of file size and slow clients slow down the reads
+class _ResponseStream:
+    def __init__(self, handler, loop, timeout):
+        self._handler = handler
+        self._loop = loop
+        self._timeout = timeout
+        self._rsp = None
+
+    def is_error(self):
+        return self._rsp is not None
+
+    def error_rsp(self):
+        return self._rsp
+
+    def transaction_id(self):
+        return None
+
+    def handle_error(self, rsp):
+        self._rsp = rsp
+
+    def start(self, open_rsp, created):
+        # Response headers are set in IOLoop, returns parts of file to send
+        return self._call(self._start(open_rsp, created))
+
+    def handle_data(self, _, data):
+        self._call(self._write(data))
+
+    def _call(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(self._timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def _start(self, open_rsp, created):
+        return self._handler.response_parts(open_rsp, created)
+
+    async def _write(self, data):
+        self._handler.write(data)
+        await self._handler.flush()
+
+
+def _etag(node_id, created, revision):
+    # Revision changes on every modification of file. Server reuses node ids
+    # of deleted files and starts revisions of new files from zero, creation
+    # time tells a file recreated at same path apart
+    return f'"{node_id}-{created}-{revision}"'
+
+
+def _etag_matches(header, etag):
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+# Returns list of (offset, size) for value of Range header, empty list if no
+# range is satisfiable and None if header should be ignored
+def _parse_range(header, size):
+    unit, _, specs = header.partition('=')
+    if unit.strip() != 'bytes':
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        first, separator, last = spec.strip().partition('-')
+        if not separator:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start = max(size - suffix, 0)
+                end = size
+            else:
+                start = int(first)
+                end = size
+                if last:
+                    end = int(last) + 1
+                    if end <= start:
+                        return None
+        except ValueError:
+            return None
+
+        end = min(end, size)
+        if start < end:
+            ranges.append((start, end - start))
+
+    if len(ranges) > MAX_NUMBER_OF_RANGES:
+        return None
+    return ranges
+
+
+# Executed in transfer worker, returns response of open
+def _download(session, path_file, stream):
+    with session.connection() as connection:
+        rsp = connection.open_file_read(path=path_file)
+        if rsp.is_error():
+            return rsp
+
+        open_rsp = rsp.as_open_rsp()
+        try:
+            created = connection.file_created_at(open_rsp.node_id)
+            for header, offset, size in stream.start(open_rsp, created):
+                if header:
+                    stream.handle_data(None, header)
+                connection.read_file_stream(
+                    open_rsp.node_id,
+                    offset,
+                    size,
+                    open_rsp.block_size,
+                    stream,
+                )
+                if stream.is_error():
+                    break
+        finally:
+            connection.close_file(open_rsp.node_id)
+        return rsp
+
+
 class RawHandler(tornado.web.RequestHandler):
-    def get(self, path):
-        global user_sessions
-        user_id = _get_client_cookie(self)
+    async def get(self, path):
+        session = await _user_session(self)
         self.clear()
 
-        if user_id is None or not user_sessions.has_session(user_id):
+        if session is None:
             self.set_status(403)
             return
 
         path_file = os.path.normpath('/' + path)
         filename = os.path.basename(path_file)
-        open_rsp = None
 
         log.info(f'Requesting file "{filename}" from path "{path_file}"')
 
+        self._filename = filename
+        stream = _ResponseStream(self, asyncio.get_running_loop(), transfer_timeout)
+
+        # Downloads have their own workers, so that they do not delay logins
+        # and page loads. Download is not limited in total duration, only in
+        # how long each block may take
+        rsp = await _run_in_executor(
+            transfer_executor,
+            None,
+            _download,
+            session,
+            path_file,
+            stream,
+        )
+        if rsp.is_error():
+            error = zyn.errors.error_to_string(rsp.error_code())
+            log.error(f'Failed to open "{path_file}": {error}')
+            self.set_status(400)
+            return
+
+        if stream.is_error():
+            error = zyn.errors.error_to_string(stream.error_rsp().error_code())
+            raise RuntimeError(f'Failed to read "{path_file}": {error}')
+
+    # Sets status and headers of response and returns parts of file to send
+    def response_parts(self, open_rsp, created):
+        filename = self._filename
+        size = open_rsp.size
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.set_header('Accept-Ranges', 'bytes')
+
+        # Without creation time file can not be identified, conditional
+        # requests are then served as unconditional
+        etag = None
+        if created is not None:
+            etag = _etag(open_rsp.node_id, created, open_rsp.revision)
+            self.set_header('ETag', etag)
+            if _etag_matches(self.request.headers.get('If-None-Match', ''), etag):
+                self.set_status(304)
+                return []
+
+        self.set_header('Content-Disposition', 'attachment; filename=' + filename)
+        ranges = None
+        header_range = self.request.headers.get('Range', None)
+        header_if_range = self.request.headers.get('If-Range', None)
+        if header_range is not None and (header_if_range is None or header_if_range == etag):
+            ranges = _parse_range(header_range, size)
+
+        if ranges is None:
+            self.set_header('Content-Type', content_type)
+            self.set_header('Content-Length', size)
+            return [(None, 0, size)]
+
+        if not ranges:
+            self.set_status(416)
+            self.set_header('Content-Range', f'bytes */{size}')
+            return []
+
+        self.set_status(206)
+        if len(ranges) == 1:
+            offset, length = ranges[0]
+            self.set_header('Content-Type', content_type)
+            self.set_header('Content-Range', f'bytes {offset}-{offset + length - 1}/{size}')
+            self.set_header('Content-Length', length)
+            return [(None, offset, length)]
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for offset, length in ranges:
+            header = (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {offset}-{offset + length - 1}/{size}\r\n'
+                '\r\n'
+            ).encode('utf-8')
+            parts.append((header, offset, length))
+        parts.append((f'\r\n--{boundary}--\r\n'.encode('utf-8'), 0, 0))
+        self.set_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.set_header(
+            'Content-Length',
+            sum(len(header) + length for header, _, length in parts),
+        )
+        return parts
+
+
+# Collects archive written by zipfile or tar members and forwards it to
+# web client when a range of file has been written
+class _ArchiveOutput:
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._stream.handle_data(None, bytes(self._buffer))
+            self._buffer = bytearray()
+
+
+class _ZipArchive:
+    def __init__(self, out, compress_type):
+        self._compress_type = compress_type
+        self._zip = zipfile.ZipFile(out, mode='w', compression=compress_type, allowZip64=True)
+        self._member = None
+
+    def start_member(self, name, element, timestamp):
+        date_time = time.localtime(timestamp)[:6]
+        if element['type'] == 'dir':
+            info = zipfile.ZipInfo(name + '/', date_time=date_time)
+            info.external_attr = (0o40755 << 16) | 0x10
+            self._zip.writestr(info, b'')
+            return
+
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.external_attr = 0o644 << 16
+        info.compress_type = self._compress_type
+        info.file_size = element['size']
+        self._member = self._zip.open(
+            info,
+            mode='w',
+            force_zip64=element['size'] > zipfile.ZIP64_LIMIT,
+        )
+
+    def write(self, data):
+        self._member.write(data)
+
+    def end_member(self):
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+
+    def close(self):
+        self._zip.close()
+
+
+# Tar is written without tarfile.TarFile, which can not add members
+# from data that is received in parts
+class _TarArchive:
+    def __init__(self, out):
+        self._out = out
+        self._size = 0
+
+    def start_member(self, name, element, timestamp):
+        info = tarfile.TarInfo(name)
+        info.mtime = int(timestamp)
+        if element['type'] == 'dir':
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            info.size = element['size']
+            info.mode = 0o644
+        self._size = info.size
+        self._out.write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+
+    def write(self, data):
+        self._out.write(data)
+
+    def end_member(self):
+        remainder = self._size % tarfile.BLOCKSIZE
+        if remainder:
+            self._out.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        self._size = 0
+
+    def close(self):
+        self._out.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        remainder = self._out.size % tarfile.RECORDSIZE
+        if remainder:
+            self._out.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+
+# Executed in archive reader, returns None if file has been modified
+# after it was listed
+def _read_archive_range(session, element, offset, size):
+    node_id = element['node_id']
+    with session.connection() as connection:
+        rsp = connection.open_read_handle(node_id=node_id)
+        zyn.util.check_server_response(rsp)
+        open_rsp = rsp.as_open_rsp()
         try:
-            session = user_sessions.session(user_id)
-            connection = session.create_logged_in_connection()
-            rsp = connection.open_file_read(path=path_file)
-            if rsp.is_error():
-                self.set_status(400)
-                raise RuntimeError(zyn.errors.error_to_string(rsp.error_code()))
+            if open_rsp.revision != element['revision']:
+                return None
+            data = io.BytesIO()
+            stream = zyn.connection.InputFileStream(data)
+            connection.read_file_stream(node_id, offset, size, open_rsp.block_size, stream)
+            if stream.is_error():
+                zyn.util.check_server_response(stream.error_rsp())
+            return data.getvalue()
+        finally:
+            rsp = connection.release_read_handle(node_id)
+            if rsp is not None:
+                zyn.util.check_server_response(rsp)
+
+
+# Elements of tree under path with their names in archive, directories are
+# listed when walk reaches them
+def _walk_tree(session, path, name):
+    directories = [(path, name)]
+    while directories:
+        path_dir, name_dir = directories.pop(0)
+        children = session.listings.children(path_dir)
+        for element in children:
+            name_element = name_dir + '/' + element['name']
+            yield name_element, element
+            if element['type'] == 'dir':
+                directories.append((
+                    zyn.util.join_remote_paths([path_dir, element['name']]),
+                    name_element,
+                ))
+
+
+# Ranges of files in the order they are written to archive, directories and
+# empty files have one empty range. Ranges are read ahead in reader threads,
+# each with its own connection from session pool, so memory used by archive
+# is limited to ranges read ahead
+def _archive_ranges(session, path, name, readers):
+    def ranges():
+        for name_element, element in _walk_tree(session, path, name):
+            if element['type'] == 'dir' or element['size'] == 0:
+                yield name_element, element, 0, None
+                continue
+            for offset in range(0, element['size'], ARCHIVE_RANGE_SIZE):
+                size = min(ARCHIVE_RANGE_SIZE, element['size'] - offset)
+                future = readers.submit(_read_archive_range, session, element, offset, size)
+                yield name_element, element, offset, future
+
+    pending = collections.deque()
+    remaining = ranges()
+    while True:
+        while len(pending) < ARCHIVE_READ_AHEAD:
+            r = next(remaining, None)
+            if r is None:
+                break
+            pending.append(r)
+        if not pending:
+            break
+        name_element, element, offset, future = pending.popleft()
+        yield name_element, element, offset, b'' if future is None else future.result()
+
+
+# Executed in transfer worker
+def _write_archive(session, path, name, archive_format, stream):
+    timestamp = time.time()
+    out = _ArchiveOutput(stream)
+    if archive_format == 'tar':
+        archive = _TarArchive(out)
+    elif archive_format == 'zip-deflate':
+        archive = _ZipArchive(out, zipfile.ZIP_DEFLATED)
+    else:
+        archive = _ZipArchive(out, zipfile.ZIP_STORED)
+
+    readers = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ARCHIVE_READERS,
+        thread_name_prefix='zyn-web-archive',
+    )
+    try:
+        skipped = None
+        for name_element, element, offset, data in _archive_ranges(session, path, name, readers):
+            if offset > 0 and element['node_id'] == skipped:
+                continue
+            if data is None:
+                if offset > 0:
+                    raise RuntimeError(f'File "{name_element}" was modified during download')
+                log.warning(f'Skipping "{name_element}" from archive, file was modified')
+                skipped = element['node_id']
+                continue
+
+            if offset == 0:
+                archive.end_member()
+                archive.start_member(name_element, element, timestamp)
+            if data:
+                archive.write(data)
+            out.flush()
+
+        archive.end_member()
+        archive.close()
+        out.flush()
+    finally:
+        readers.shutdown(wait=True, cancel_futures=True)
+
+
+class ArchiveHandler(tornado.web.RequestHandler):
+    async def get(self, path):
+        session = await _user_session(self)
+
+        if session is None:
+            self.set_status(403)
+            return
 
-            open_rsp = rsp.as_open_rsp()
-            if open_rsp.type_of_file == zyn.connection.FILE_TYPE_RANDOM_ACCESS:
-                rsp, data = connection.read_file(open_rsp.node_id, 0, open_rsp.size)
-                if rsp.is_error():
-                    self.set_status(500)
-                    raise RuntimeError(zyn.errors.error_to_string(rsp.error_code()))
-                self.write(data)
-            elif open_rsp.type_of_file == zyn.connection.FILE_TYPE_BLOB:
-                if open_rsp.size > open_rsp.block_size:
-                    # For large files, server should sent the content is blocks
-                    self.set_status(500)
-                    raise RuntimeError('Large file download not implemented')
-
-                rsp, data = connection.read_file(open_rsp.node_id, 0, open_rsp.size)
-                if rsp.is_error():
-                    self.set_status(500)
-                    raise RuntimeError(zyn.errors.error_to_string(rsp.error_code()))
-                self.write(data)
-            else:
-                self.set_status(500)
-                raise RuntimeError()
+        path = zyn.util.normalized_remote_path('/' + path)
+        archive_format = self.get_argument('format', 'zip')
+        if archive_format not in ARCHIVE_FORMATS:
+            raise tornado.web.HTTPError(400)
 
-            self.set_header('Content-Disposition', 'attachment; filename=' + filename)
+        try:
+            # Errors in path are returned before archive is started
+            await _zyn_request(session.listings.children, path)
+        except zyn.exception.ZynServerException as e:
+            log.info(f'Failed to archive "{path}": {e}')
+            self.set_status(400)
+            self.write({'error': str(e)})
+            return
 
-        except Excetion:
-            log.exeption('Failed to read file')
-        finally:
-            if open_rsp is not None:
+        name = posixpath.basename(path) or 'zyn'
+        content_type, extension = ARCHIVE_FORMATS[archive_format]
+        self.set_header('Content-Type', content_type)
+        self.set_header('Content-Disposition', f'attachment; filename={name}{extension}')
+        log.info(f'Archiving "{path}" as {archive_format}')
+
+        stream = _ResponseStream(self, asyncio.get_running_loop(), transfer_timeout)
+        await _run_in_executor(
+            transfer_executor,
+            None,
+            _write_archive,
+            session,
+            path,
+            name,
+            archive_format,
+            stream,
+        )
+
+
+# Request body of upload as stream for blob_write_stream. Body is received in
+# IOLoop and read in transfer worker, receiving is paused while more than
+# UPLOAD_BUFFER_SIZE is waiting, so memory used by upload does not depend on
+# its size
+class _RequestBodyStream:
+    def __init__(self, path, size, loop, timeout):
+        self._path = path
+        self._size = size
+        self._loop = loop
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._complete = False
+        self._aborted = False
+        self._drained = asyncio.Event()
+        self._bytes_read = 0
+        self._started = time.monotonic()
+        self._progress_logged = self._started
+
+    def size(self):
+        return self._size
+
+    # Called in IOLoop
+    async def put(self, chunk):
+        with self._condition:
+            if self._aborted:
+                return
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            self._condition.notify()
+
+        while True:
+            with self._condition:
+                if self._buffered <= UPLOAD_BUFFER_SIZE or self._aborted:
+                    return
+                self._drained.clear()
+            await self._drained.wait()
+
+    def complete(self):
+        with self._condition:
+            self._complete = True
+            self._condition.notify()
+
+    # Called in IOLoop or transfer worker, ends upload
+    def abort(self):
+        with self._condition:
+            self._aborted = True
+            self._chunks.clear()
+            self._buffered = 0
+            self._condition.notify()
+        self._loop.call_soon_threadsafe(self._drained.set)
+
+    # Called in transfer worker, returns size bytes unless body ends
+    def get(self, size):
+        data = bytearray()
+        with self._condition:
+            while len(data) < size:
+                while not self._chunks and not self._complete and not self._aborted:
+                    if not self._condition.wait(self._timeout):
+                        raise TimeoutError(f'Upload of "{self._path}" timed out')
+                if self._aborted:
+                    raise ConnectionAbortedError(f'Upload of "{self._path}" was aborted')
+                if not self._chunks:
+                    break
+                chunk = self._chunks.popleft()
+                needed = size - len(data)
+                if len(chunk) > needed:
+                    self._chunks.appendleft(chunk[needed:])
+                    chunk = chunk[:needed]
+                data += chunk
+                self._buffered -= len(chunk)
+
+        self._loop.call_soon_threadsafe(self._drained.set)
+        self._bytes_read += len(data)
+        self._log_progress()
+        if not data:
+            return None
+        return bytes(data)
+
+    def _log_progress(self):
+        now = time.monotonic()
+        if now - self._progress_logged < UPLOAD_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._progress_logged = now
+        log.info('Uploading "{}", {:.1f}/{:.1f} MB, {:.1f} MB/s'.format(
+            self._path,
+            self._bytes_read / 1024 / 1024,
+            self._size / 1024 / 1024,
+            self._bytes_read / 1024 / 1024 / max(now - self._started, 0.001),
+        ))
+
+
+_NOT_FOUND_ERRORS = [
+    zyn.errors.InvalidPath,
+    zyn.errors.UnknownFile,
+]
+
+
+# Executed in transfer worker, writes request body to blob file which is
+# created if it does not exist
+def _upload(session, path, stream):
+    try:
+        with session.connection() as connection:
+            rsp = connection.open_file_write(path=path)
+            if rsp.is_error() and rsp.error_code() in _NOT_FOUND_ERRORS:
+                path_parent, name = zyn.util.split_remote_path(path)
+                rsp = connection.create_file(
+                    name,
+                    zyn.connection.FILE_TYPE_BLOB,
+                    parent_path=path_parent,
+                )
+                zyn.util.check_server_response(rsp)
+                rsp = connection.open_file_write(node_id=rsp.as_create_rsp().node_id)
+            zyn.util.check_server_response(rsp)
+
+            open_rsp = rsp.as_open_rsp()
+            revision = open_rsp.revision
+            if open_rsp.type_of_file != zyn.connection.FILE_TYPE_BLOB:
+                zyn.util.check_server_response(connection.close_file(open_rsp.node_id))
+                raise ValueError(f'Only blob files can be uploaded, path="{path}"')
+
+            try:
+                # Empty body is written too, so that existing content is removed
+                rsp = connection.blob_write_stream(
+                    open_rsp.node_id,
+                    open_rsp.revision,
+                    stream,
+                    open_rsp.block_size,
+                )
+                zyn.util.check_server_response(rsp)
+                revision = rsp.as_write_rsp().revision
+            except zyn.exception.ZynServerException:
                 connection.close_file(open_rsp.node_id)
+                raise
+            # On other errors connection is discarded, which closes the file
+
+            zyn.util.check_server_response(connection.close_file(open_rsp.node_id))
+            return open_rsp.node_id, revision
+    finally:
+        # Stops receiving if upload failed before whole body was received
+        stream.abort()
+
+
+@tornado.web.stream_request_body
+class UploadHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ('PUT', )
+
+    def initialize(self):
+        self._stream = None
+
+    async def prepare(self):
+        session = await _user_session(self)
+
+        if session is None:
+            raise tornado.web.HTTPError(403)
+
+        try:
+            size = int(self.request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            raise tornado.web.HTTPError(411)
+        self.request.connection.set_max_body_size(size)
+
+        self._path = zyn.util.normalized_remote_path('/' + self.path_args[0])
+        self._started = time.monotonic()
+        log.info(f'Uploading "{self._path}", size {size}')
+
+        self._stream = _RequestBodyStream(
+            self._path,
+            size,
+            asyncio.get_running_loop(),
+            transfer_timeout,
+        )
+        self._upload = asyncio.ensure_future(_run_in_executor(
+            transfer_executor,
+            None,
+            _upload,
+            session,
+            self._path,
+            self._stream,
+        ))
+
+    async def data_received(self, chunk):
+        await self._stream.put(chunk)
+
+    async def put(self, path):
+        self._stream.complete()
+        try:
+            node_id, revision = await self._upload
+        except (zyn.exception.ZynServerException, ValueError) as e:
+            log.info(f'Failed to upload "{self._path}": {e}')
+            self.set_status(400)
+            self.write({'error': str(e)})
+            return
+
+        duration = max(time.monotonic() - self._started, 0.001)
+        log.info('Uploaded "{}", {:.1f} MB/s'.format(
+            self._path,
+            self._stream.size() / 1024 / 1024 / duration,
+        ))
+        self.write({
+            'path': self._path,
+            'node_id': node_id,
+            'revision': revision,
+            'size': self._stream.size(),
+        })
+
+    def on_connection_close(self):
+        if self._stream is not None and not self._upload.done():
+            log.info(f'Upload of "{self._path}" was aborted')
+            self._stream.abort()
+            # Upload fails after abort and its error has no one to report to
+            self._upload.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class ListHandler(tornado.web.RequestHandler):
+    async def get(self):
+        session = await _user_session(self)
+
+        if session is None:
+            self.set_status(403)
+            return
+
+        path = zyn.util.normalized_remote_path('/' + self.get_argument('path', '/'))
+        sort = self.get_argument('sort', 'name')
+        name_filter = self.get_argument('filter', '')
+        try:
+            offset = int(self.get_argument('offset', '0'))
+            limit = int(self.get_argument('limit', str(LISTING_PAGE_SIZE)))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if offset < 0 or limit < 0 or sort.lstrip('-') not in _LISTING_SORT_KEYS:
+            raise tornado.web.HTTPError(400)
+        limit = min(limit, MAX_LISTING_PAGE_SIZE)
+
+        try:
+            total, elements = await _zyn_request(
+                session.listings.page,
+                path,
+                offset,
+                limit,
+                sort,
+                name_filter,
+            )
+        except zyn.exception.ZynServerException as e:
+            log.info(f'Failed to list "{path}": {e}')
+            self.set_status(400)
+            self.write({'error': str(e)})
+            return
+
+        self.write({
+            'path': path,
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+            'elements': elements,
+        })
 
 
 class LoginHandler(tornado.web.RequestHandler):
     def get(self, args, kwargs=None):
         self.render("login.html")
 
-    def post(self, args, kwargs=None):
+    async def post(self, args, kwargs=None):
         global user_sessions
         username = self.get_body_argument("username")
         password = self.get_body_argument("password")
@@ -289,10 +1345,9 @@ class LoginHandler(tornado.web.RequestHandler):
         else:
 
             session = UserSession(username, password)
-            session.connect()
-            if session.authenticate():
+            if await _zyn_request(session.login):
 
-                user_id = user_sessions.add(session)
+                user_id = await _zyn_request(user_sessions.add, session)
                 self.set_signed_cookie(
                     COOKIE_NAME,
                     str(user_id),
@@ -319,38 +1374,36 @@ class LoginHandler(tornado.web.RequestHandler):
 
 
 class ReloginHandler(tornado.web.RequestHandler):
-    def post(self, args, kwargs=None):
-        global user_sessions
-        user_id = _get_client_cookie(self)
+    async def post(self, args, kwargs=None):
+        session = await _user_session(self)
 
-        if user_id is None or not user_sessions.has_session(user_id):
+        if session is None:
             self.set_status(403)
             return
 
-        session = user_sessions.session(user_id)
-        token = session.allocate_token()
-        session.release_connection()
+        token = await _session_token(session)
         self.write({'token': token})
 
 
 class LogoutHandler(tornado.web.RequestHandler):
-    def get(self, args, kwargs=None):
-        _logout_user(self)
+    async def get(self, args, kwargs=None):
+        await _logout_user(self)
 
 
 def _timer_callback():
     global user_sessions
-    expiration_duration_secs = COOKIE_DURATION_DAYS * 24 * 60 * 60
-    expired_sessions = []
+    tornado.ioloop.IOLoop.current().run_in_executor(
+        zyn_executor,
+        user_sessions.remove_expired,
+        COOKIE_DURATION_DAYS * 24 * 60 * 60,
+    )
 
-    for id_, session in user_sessions.sessions():
-        d = session.session_duration_sec()
-        if d > expiration_duration_secs:
-            log.info(f'Cleaning up session {id_}')
-            expired_sessions.append(id_)
 
-    for id_ in expired_sessions:
-        user_sessions.remove(id_)
+def _idle_timer_callback():
+    tornado.ioloop.IOLoop.current().run_in_executor(
+        zyn_executor,
+        backend_connections.close_idle,
+    )
 
 
 def start_server(
@@ -359,31 +1412,86 @@ def start_server(
         create_zyn_connection_callback,
         logger,
         debug_tornado=False,
-
+        zyn_workers=ZYN_WORKERS,
+        transfer_workers=TRANSFER_WORKERS,
+        zyn_request_timeout=REQUEST_TIMEOUT_SECONDS,
+        zyn_transfer_timeout=TRANSFER_TIMEOUT_SECONDS,
+        max_backend_connections=MAX_BACKEND_CONNECTIONS,
+        connections_per_session=CONNECTIONS_PER_SESSION,
+        connection_idle_timeout=CONNECTION_IDLE_TIMEOUT_SECONDS,
+        token_validity_duration=TOKEN_VALIDITY_SECONDS,
+        number_of_processes=1,
+        path_session_db=None,
 ):
     global server_address
     global create_zyn_connection
     global log
+    global zyn_executor
+    global transfer_executor
+    global request_timeout
+    global transfer_timeout
+    global backend_connections
+    global token_validity
+
+    if number_of_processes != 1 and path_session_db is None:
+        raise RuntimeError('Session database is required when using multiple processes')
 
     server_address = websocket_address
     create_zyn_connection = create_zyn_connection_callback
     log = logger
+    request_timeout = zyn_request_timeout
+    transfer_timeout = zyn_transfer_timeout
+    token_validity = token_validity_duration
+
+    # With reused port, new server can be started before old one is stopped
+    sockets = tornado.netutil.bind_sockets(
+        local_port,
+        reuse_port=hasattr(socket, 'SO_REUSEPORT'),
+    )
+    if number_of_processes != 1:
+        # Threads, event loop and database connection must be created
+        # in the forked processes
+        store = SessionStore(path_session_db)
+        store.close()
+        tornado.process.fork_processes(number_of_processes)
+
+    store = SessionStore(path_session_db)
+    zyn_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=zyn_workers,
+        thread_name_prefix='zyn-web',
+    )
+    transfer_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=transfer_workers,
+        thread_name_prefix='zyn-web-transfer',
+    )
+    backend_connections = BackendConnections(
+        max_backend_connections,
+        connections_per_session,
+        connection_idle_timeout,
+    )
 
     timer = tornado.ioloop.PeriodicCallback(
         _timer_callback,
         1000 * 60 * 60,
     )
+    idle_timer = tornado.ioloop.PeriodicCallback(
+        _idle_timer_callback,
+        1000 * 60,
+    )
 
     app = tornado.web.Application(
         [
             (r'/raw/(.*)', RawHandler),
+            (r'/api/list', ListHandler),
+            (r'/archive/(.*)', ArchiveHandler),
+            (r'/upload/(.*)', UploadHandler),
             (r'/fs(.*)', MainHandler),
             (r'/login(.*)', LoginHandler),
             (r'/relogin(.*)', ReloginHandler),
             (r'/logout(.*)', LogoutHandler),
             (r'/(.*)', RootHandler),
         ],
-        cookie_secret=base64.b64encode(os.urandom(50)).decode('utf8'),
+        cookie_secret=store.cookie_secret(),
         static_path=PATH_STATIC_FILES,
         template_path=PATH_TEMPLATES,
         debug=debug_tornado,
@@ -391,8 +1499,10 @@ def start_server(
     tornado.log.enable_pretty_logging()
 
     global user_sessions
-    user_sessions = UserSessions()
+    user_sessions = UserSessions(store)
 
-    app.listen(local_port)
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
     timer.start()
+    idle_timer.start()
     tornado.ioloop.IOLoop.current().start()
@@ -1,3 +1,7 @@
+import collections
+import contextlib
+import functools
+import io
 import logging
 import socket
 import ssl
@@ -5,7 +9,10 @@ import time
 import os
 import threading
 
+import zyn.cache
+import zyn.errors
 import zyn.exception
+import zyn.util
 from zyn.messages import (
     Message,
     Response,
@@ -23,6 +30,51 @@ from zyn.messages import (
 )
 
 
+ROOT_PATH = '/'
+ROOT_NODE_ID = 0
+READAHEAD_SIZE = 1024 * 1024
+PATH_NODE_ID_MAX_AGE_SECONDS = 5
+WRITE_BEHIND_SIZE = 1024 * 1024
+
+# Priority classes of traffic
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+
+class _LazyData:
+    def __init__(self, size, read):
+        self.size = size
+        self._read = read
+
+    def read(self):
+        data = self._read()
+        if data is None or len(data) != self.size:
+            raise RuntimeError('Data source ended before expected size was read')
+        return data
+
+
+# Properties of a file open for reading, that are needed for reading through
+# block cache. Kept up to date with modification notifications
+class _CachedFile:
+    def __init__(self, revision, size, block_size, file_id=None):
+        self.revision = revision
+        self.size = size
+        self.block_size = block_size
+        self.file_id = file_id
+
+    def apply_notification(self, notification):
+        self.revision = notification.revision
+        t = notification.notification_type()
+        end = notification.block_offset + notification.block_size
+        if t == Notification.TYPE_MODIFIED:
+            self.size = max(self.size, end)
+        elif t == Notification.TYPE_INSERTED:
+            self.size += notification.block_size
+        elif t == Notification.TYPE_DELETED:
+            self.size -= notification.block_size
+
+
 class RandomAccessBatchEdit:
     def __init__(self, connection, node_id, revision, transaction_id):
         self.connection = connection
@@ -43,6 +95,17 @@ class RandomAccessBatchEdit:
     def write(self, offset, data):
         self.operations.append((BATCH_EDIT_TYPE_WRITE, offset, data))
 
+    def write_lazy(self, offset, size, read):
+        # Data is read with read() only when the operation is sent
+        self.operations.append((BATCH_EDIT_TYPE_WRITE, offset, _LazyData(size, read)))
+
+    def write_stream(self, offset, stream, size, block_size):
+        # Content is split to writes of at most block size, data of each
+        # write is read from stream only when the operation is sent
+        for block_offset in range(0, size, block_size):
+            block = min(block_size, size - block_offset)
+            self.write_lazy(offset + block_offset, block, functools.partial(stream.get, block))
+
     def commit(self):
         return self.connection._commit_ra_batch(self)
 
@@ -82,6 +145,9 @@ class FileStream:
             return None
         return d
 
+    def close(self):
+        self._fp.close()
+
 
 class InputFileStream:
     def __init__(self, fp):
@@ -104,6 +170,14 @@ class InputFileStream:
         self._fp.write(data)
 
 
+class InputFileRangeStream(InputFileStream):
+    # Writes data to the offset it was read from, allowing
+    # multiple ranges of same file to be read in parallel
+    def handle_data(self, offset, data):
+        self._fp.seek(offset)
+        self._fp.write(data)
+
+
 class DataStream:
     def __init__(self, data):
         self._data = data
@@ -120,6 +194,845 @@ class DataStream:
         return d
 
 
+# Server reuses node ids of deleted elements, so a node id learned for a path
+# may later point to an unrelated element created by another client. Only this
+# connection's own deletes are seen, so entries are trusted only for a short
+# time after the response they were learned from
+class PathNodeIdCache:
+    # Errors server returns when node id used in place of path no longer
+    # points to the element the path used to resolve to
+    STALE_NODE_ID_ERRORS = [
+        zyn.errors.InvalidNodeId,
+        zyn.errors.UnknownFile,
+        zyn.errors.NodeIsNotFile,
+        zyn.errors.NodeIsNotDirectory,
+    ]
+
+    def __init__(self, max_number_of_paths=100000, max_age=PATH_NODE_ID_MAX_AGE_SECONDS):
+        self._max_number_of_paths = max_number_of_paths
+        self._max_age = max_age
+        self._path_to_node_id = collections.OrderedDict()
+        self._node_id_to_path = {}
+        self._learned_at = {}
+        self.learn(ROOT_PATH, ROOT_NODE_ID)
+
+    def size(self):
+        return len(self._path_to_node_id)
+
+    def _is_expired(self, path):
+        if path == ROOT_PATH:
+            return False
+        return time.monotonic() - self._learned_at[path] >= self._max_age
+
+    def _remove(self, path):
+        self._learned_at.pop(path, None)
+        self._node_id_to_path.pop(self._path_to_node_id.pop(path), None)
+
+    def node_id(self, path):
+        path = zyn.util.normalized_remote_path(path)
+        node_id = self._path_to_node_id.get(path, None)
+        if node_id is None:
+            return None
+        if self._is_expired(path):
+            self._remove(path)
+            return None
+        self._path_to_node_id.move_to_end(path)
+        return node_id
+
+    def path(self, node_id):
+        path = self._node_id_to_path.get(node_id, None)
+        if path is None:
+            return None
+        if self._is_expired(path):
+            self._remove(path)
+            return None
+        return path
+
+    def learn(self, path, node_id):
+        path = zyn.util.normalized_remote_path(path)
+        previous_path = self._node_id_to_path.get(node_id, None)
+        if previous_path is not None and previous_path != path:
+            self._path_to_node_id.pop(previous_path, None)
+            self._learned_at.pop(previous_path, None)
+        previous_node_id = self._path_to_node_id.get(path, None)
+        if previous_node_id is not None and previous_node_id != node_id:
+            self._node_id_to_path.pop(previous_node_id, None)
+
+        self._path_to_node_id[path] = node_id
+        self._path_to_node_id.move_to_end(path)
+        self._node_id_to_path[node_id] = path
+        self._learned_at[path] = time.monotonic()
+
+        while len(self._path_to_node_id) > self._max_number_of_paths:
+            evicted_path, evicted_node_id = self._path_to_node_id.popitem(last=False)
+            if evicted_path == ROOT_PATH:
+                self._path_to_node_id[evicted_path] = evicted_node_id
+                continue
+            self._learned_at.pop(evicted_path, None)
+            self._node_id_to_path.pop(evicted_node_id, None)
+
+    def learn_children(self, path_parent, elements):
+        for e in elements:
+            self.learn(zyn.util.join_remote_paths([path_parent, e.name]), e.node_id)
+
+    def invalidate(self, path=None, node_id=None):
+        if path is None and node_id is not None:
+            path = self._node_id_to_path.get(node_id, None)
+        if path is None:
+            return
+
+        path = zyn.util.normalized_remote_path(path)
+        if path == ROOT_PATH:
+            return
+        prefix = path + '/'
+        invalidated = [
+            p for p in self._path_to_node_id.keys()
+            if p == path or p.startswith(prefix)
+        ]
+        for p in invalidated:
+            self._remove(p)
+
+    def clear(self):
+        self._path_to_node_id.clear()
+        self._node_id_to_path.clear()
+        self._learned_at.clear()
+        self.learn(ROOT_PATH, ROOT_NODE_ID)
+
+
+# Keeps files opened for reading open after use, so that repeated reads of
+# same file do not need open and close requests. Server notifies connection
+# of modifications to open files, handle of a modified file is reopened on
+# next use. Least recently used handle is closed when cache is full
+class OpenHandleCache:
+    def __init__(self, connection, max_number_of_handles):
+        self._connection = connection
+        self._max_number_of_handles = max_number_of_handles
+        self._handles = collections.OrderedDict()
+        self._log = logging.getLogger(__name__)
+        self._number_of_hits = 0
+        self._number_of_misses = 0
+
+    def max_number_of_handles(self):
+        return self._max_number_of_handles
+
+    def number_of_handles(self):
+        return len(self._handles)
+
+    def number_of_hits(self):
+        return self._number_of_hits
+
+    def number_of_misses(self):
+        return self._number_of_misses
+
+    def is_cached(self, node_id):
+        return node_id in self._handles
+
+    def _discard_modified(self):
+        for node_id in self._connection.take_notified_node_ids(self._handles.keys()):
+            self._log.debug('Cached file handle is stale, node_id={}'.format(node_id))
+            self.close(node_id)
+
+    def open_read(self, node_id=None, path=None):
+        if node_id is None:
+            node_id = self._connection.path_cache_node_id(path)
+
+        self._discard_modified()
+        if node_id in self._handles:
+            self._handles.move_to_end(node_id)
+            self._number_of_hits += 1
+            return self._handles[node_id]
+
+        self._number_of_misses += 1
+        rsp = self._connection.open_file_read(node_id=node_id, path=path)
+        if rsp.is_error() or self._max_number_of_handles < 1:
+            return rsp
+
+        self._handles[rsp.as_open_rsp().node_id] = rsp
+        while len(self._handles) > self._max_number_of_handles:
+            evicted, _ = self._handles.popitem(last=False)
+            self._close_handle(evicted)
+        return rsp
+
+    def _close_handle(self, node_id):
+        rsp = self._connection.close_file(node_id)
+        if rsp.is_error():
+            # File may have been closed by server
+            self._log.debug('Failed to close cached handle, node_id={}'.format(node_id))
+
+    def close(self, node_id):
+        if self._handles.pop(node_id, None) is not None:
+            self._close_handle(node_id)
+
+    def forget(self, node_id):
+        # Handle was closed without cache
+        self._handles.pop(node_id, None)
+
+    def clear(self):
+        # Pending notifications of cached files are not of interest to anyone
+        self._connection.take_notified_node_ids(set(self._handles.keys()))
+        for node_id in list(self._handles.keys()):
+            self.close(node_id)
+
+
+# Limits rate of data to given bytes per second, allowing bursts of
+# given size. Waiting interactive consumers are served before bulk
+# consumers, interactive consumers may take tokens into debt that
+# bulk consumers then pay for
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self._rate = rate
+        self._burst = burst or rate
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self._interactive_waiting = 0
+
+    def rate(self):
+        return self._rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def consume(self, size, priority=PRIORITY_INTERACTIVE):
+        with self._condition:
+            interactive = priority == PRIORITY_INTERACTIVE
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if interactive or self._interactive_waiting == 0:
+                        needed = min(size, self._burst)
+                        if interactive or self._tokens >= needed:
+                            break
+                        self._condition.wait((needed - self._tokens) / self._rate)
+                    else:
+                        self._condition.wait()
+                self._tokens -= size
+
+                # Interactive consumers go into debt and wait for it to be paid
+                if self._tokens < 0 and interactive:
+                    self._condition.wait(-self._tokens / self._rate)
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._condition.notify_all()
+
+
+# Shapes traffic of sockets in one direction: all traffic is limited to max
+# rate and bulk traffic additionally to max bulk rate. Limits of None are
+# not enforced
+class TrafficShaper:
+    def __init__(self, max_rate=None, max_rate_bulk=None):
+        self._total = None
+        self._bulk = None
+        if max_rate is not None:
+            self._total = TokenBucket(max_rate)
+        if max_rate_bulk is not None:
+            self._bulk = TokenBucket(max_rate_bulk)
+
+    def is_limited(self):
+        return self._total is not None or self._bulk is not None
+
+    def consume(self, size, priority):
+        if priority == PRIORITY_BULK and self._bulk is not None:
+            self._bulk.consume(size, priority)
+        if self._total is not None:
+            self._total.consume(size, priority)
+
+
+# Adaptive limit for number of concurrent transfers to a server, limit is
+# increased additively by one for each window of successful operations and
+# decreased multiplicatively when request latency rises clearly above the
+# lowest seen latency, requests time out or server reports overload
+class ConcurrencyLimiter:
+    OVERLOAD_ERRORS = (
+        zyn.errors.TooManyFilesOpenError,
+        zyn.errors.FailedToReceiveDataError,
+        zyn.errors.AllNodesInUse,
+    )
+    _SMOOTHING = 0.2
+    _LATENCY_MIN_DRIFT = 1.01
+    _MAX_DECISIONS = 100
+
+    def __init__(
+            self,
+            max_limit,
+            initial_limit=1,
+            min_limit=1,
+            latency_tolerance=2.0,
+            decrease_factor=0.5,
+    ):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('Invalid limits, min={}, initial={}, max={}'.format(
+                min_limit,
+                initial_limit,
+                max_limit,
+            ))
+        self._condition = threading.Condition()
+        self._max_limit = max_limit
+        self._min_limit = min_limit
+        self._limit = initial_limit
+        self._latency_tolerance = latency_tolerance
+        self._decrease_factor = decrease_factor
+        self._in_flight = 0
+        self._successes = 0
+        self._completed_since_decrease = initial_limit
+        self._latency_min = None
+        self._latency = None
+        self._number_of_increases = 0
+        self._number_of_decreases = 0
+        self._decisions = collections.deque(maxlen=self._MAX_DECISIONS)
+        self._log = logging.getLogger(__name__)
+
+    def limit(self):
+        with self._condition:
+            return self._limit
+
+    def in_flight(self):
+        with self._condition:
+            return self._in_flight
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'limit': self._limit,
+                'in-flight': self._in_flight,
+                'latency': self._latency,
+                'latency-min': self._latency_min,
+                'increases': self._number_of_increases,
+                'decreases': self._number_of_decreases,
+                'decisions': list(self._decisions),
+            }
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._completed_since_decrease += 1
+            self._condition.notify_all()
+
+    def _decide(self, limit, reason):
+        # Expects lock to be held
+        if limit == self._limit:
+            return
+        action = 'increase' if limit > self._limit else 'decrease'
+        if action == 'increase':
+            self._number_of_increases += 1
+        else:
+            self._number_of_decreases += 1
+            self._completed_since_decrease = 0
+        self._limit = limit
+        self._decisions.append((time.time(), action, limit, reason))
+        self._log.debug('Concurrency limit {}d to {}, reason: {}'.format(action, limit, reason))
+        self._condition.notify_all()
+
+    def _decrease(self, reason):
+        # Operations started before last decrease do not decrease again,
+        # one overload event usually fails many concurrent operations
+        if self._completed_since_decrease < self._limit:
+            return
+        self._decide(max(self._min_limit, int(self._limit * self._decrease_factor)), reason)
+
+    def add_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self._limit:
+                self._successes = 0
+                self._decide(min(self._max_limit, self._limit + 1), 'operations succeeded')
+
+    def add_overload(self, reason):
+        with self._condition:
+            self._successes = 0
+            self._decrease(reason)
+
+    def add_latency(self, seconds):
+        with self._condition:
+            # Lowest latency slowly drifts up so that it follows recent
+            # samples when latency of the link itself changes
+            if self._latency_min is None:
+                self._latency_min = seconds
+            else:
+                self._latency_min = min(seconds, self._latency_min * self._LATENCY_MIN_DRIFT)
+            if self._latency is None:
+                self._latency = seconds
+            else:
+                self._latency += (seconds - self._latency) * self._SMOOTHING
+
+            if self._latency > self._latency_min * self._latency_tolerance:
+                self._successes = 0
+                self._decrease('latency {:.1f} ms, lowest {:.1f} ms'.format(
+                    self._latency * 1000,
+                    self._latency_min * 1000,
+                ))
+
+    def is_overload(self, error):
+        if isinstance(error, zyn.exception.ZynServerException):
+            return error.zyn_error_code in self.OVERLOAD_ERRORS
+        return isinstance(error, (socket.timeout, zyn.exception.ZynConnectionLost))
+
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            if self.is_overload(e):
+                self.add_overload(type(e).__name__)
+            raise
+        else:
+            self.add_success()
+        finally:
+            self.release()
+
+
+# Connections are not thread safe, pool gives each connection to one user at a time.
+# Connections are created on demand with the given callable, which should return
+# connected and authenticated connection, and closed with close_connection
+class ConnectionPool:
+    def __init__(
+            self,
+            create_connection,
+            max_number_of_connections,
+            limiter=None,
+            close_connection=None,
+    ):
+        if max_number_of_connections < 1:
+            raise ValueError('Pool must have at least one connection')
+        self._create_connection = create_connection
+        self._close_connection = close_connection or (lambda c: c.disconnect())
+        self._max_number_of_connections = max_number_of_connections
+        self._limiter = limiter
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._number_in_use = 0
+        self._number_of_interactive_waiting = 0
+        self._idle = []
+        self._connections = []
+        self._is_closed = False
+        self._log = logging.getLogger(__name__)
+
+    def max_number_of_connections(self):
+        return self._max_number_of_connections
+
+    def limiter(self):
+        return self._limiter
+
+    def number_of_connections(self):
+        with self._lock:
+            return len(self._connections)
+
+    def _wait_for_available(self, priority):
+        # Interactive requests get the next free connection before bulk requests
+        interactive = priority == PRIORITY_INTERACTIVE
+        with self._available:
+            if interactive:
+                self._number_of_interactive_waiting += 1
+            try:
+                while self._number_in_use >= self._max_number_of_connections \
+                        or (not interactive and self._number_of_interactive_waiting > 0):
+                    if self._is_closed:
+                        break
+                    self._available.wait()
+                if self._is_closed:
+                    raise RuntimeError('Connection pool is closed')
+                self._number_in_use += 1
+            finally:
+                if interactive:
+                    self._number_of_interactive_waiting -= 1
+                    self._available.notify_all()
+
+    def _acquire(self, priority):
+        self._wait_for_available(priority)
+        try:
+            with self._lock:
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    return connection
+            connection = self._create_connection()
+            if self._limiter is not None:
+                connection.set_concurrency_limiter(self._limiter)
+            with self._lock:
+                self._connections.append(connection)
+            self._log.debug('Pool created connection, number of connections: {}'.format(
+                len(self._connections)
+            ))
+            return connection
+        except BaseException:
+            with self._available:
+                self._number_in_use -= 1
+                self._available.notify_all()
+            raise
+
+    def _release(self, connection, discard=False):
+        # Returns True if the connection should be closed by caller
+        with self._available:
+            self._number_in_use -= 1
+            self._available.notify_all()
+            if discard or self._is_closed:
+                # Connection is not tracked if pool was closed while it was in use
+                if connection in self._connections:
+                    self._connections.remove(connection)
+                return True
+            self._idle.append((connection, time.monotonic()))
+            return False
+
+    @contextlib.contextmanager
+    def connection(self, priority=PRIORITY_BULK):
+        # Concurrency limiter is meant for transfers, interactive
+        # requests are not limited by it
+        if self._limiter is None or priority == PRIORITY_INTERACTIVE:
+            with self._connection(priority) as connection:
+                yield connection
+        else:
+            with self._limiter.slot():
+                with self._connection(priority) as connection:
+                    yield connection
+
+    @contextlib.contextmanager
+    def _connection(self, priority):
+        connection = self._acquire(priority)
+        try:
+            with connection.priority(priority):
+                yield connection
+        except zyn.exception.ZynServerException:
+            self._release_or_close(connection)
+            raise
+        except BaseException:
+            # State of the connection is unknown, for example a response
+            # may not have been read, so the connection is not reused
+            self._log.debug('Discarding connection from pool after error')
+            self._release_or_close(connection, discard=True)
+            raise
+        else:
+            self._release_or_close(connection)
+
+    def _release_or_close(self, connection, discard=False):
+        if self._release(connection, discard):
+            try:
+                self._close_connection(connection)
+            except Exception:
+                self._log.debug('Failed to close connection released to pool')
+
+    def number_of_idle_connections(self):
+        with self._lock:
+            return len(self._idle)
+
+    def close_idle(self, max_idle_duration=0):
+        # Closes connections that have not been used for given number of
+        # seconds, returns number of closed connections
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c, t in self._idle if now - t >= max_idle_duration]
+            self._idle = [(c, t) for c, t in self._idle if now - t < max_idle_duration]
+            for c in expired:
+                self._connections.remove(c)
+        for c in expired:
+            try:
+                self._close_connection(c)
+            except Exception:
+                self._log.debug('Failed to close idle connection')
+        return len(expired)
+
+    def close(self):
+        # Connections in use are closed when they are released, so that
+        # transfers using them are not cut
+        with self._available:
+            self._is_closed = True
+            idle = [c for c, _ in self._idle]
+            self._idle = []
+            for c in idle:
+                self._connections.remove(c)
+            self._available.notify_all()
+        for c in idle:
+            self._close_connection(c)
+
+
+# Chooses size of blocks used in transfers from measured round trip time and
+# throughput: blocks are made large enough that waiting for the response of
+# each block is only a small part of the transfer time. On low latency links
+# this keeps blocks small, on high latency links blocks grow up to server
+# maximum. Chosen size always divides server block size, so that blocks
+# never cross server blocks. Can be shared by connections to same server
+class BlockSizeTuner:
+    MIN_BLOCK_SIZE = 64 * 1024
+    _SMOOTHING = 0.2
+
+    def __init__(self, round_trip=None, throughput=None, overhead=0.1):
+        self._lock = threading.Lock()
+        self._round_trip = round_trip
+        self._throughput = throughput
+        self._overhead = overhead
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'round-trip': self._round_trip,
+                'throughput': self._throughput,
+            }
+
+    def from_dict(data):
+        return BlockSizeTuner(data.get('round-trip', None), data.get('throughput', None))
+
+    def round_trip(self):
+        return self._round_trip
+
+    def throughput(self):
+        return self._throughput
+
+    def _smoothed(self, current, sample):
+        if current is None:
+            return sample
+        return current + (sample - current) * self._SMOOTHING
+
+    def add_round_trip(self, seconds):
+        with self._lock:
+            self._round_trip = self._smoothed(self._round_trip, seconds)
+
+    def add_transfer(self, size, seconds):
+        with self._lock:
+            # Time spent waiting for the response is not part of throughput
+            seconds = max(seconds - (self._round_trip or 0), seconds / 10, 1e-6)
+            self._throughput = self._smoothed(self._throughput, size / seconds)
+
+    def block_size(self, max_block_size):
+        with self._lock:
+            if self._round_trip is None or self._throughput is None:
+                return max_block_size
+            target = self._round_trip * self._throughput * (1 - self._overhead) / self._overhead
+
+        block_size = max_block_size
+        while block_size // 2 >= max(target, self.MIN_BLOCK_SIZE) and block_size % 2 == 0:
+            block_size //= 2
+        return block_size
+
+
+# File object over a remote file, can be wrapped in io.BufferedReader or
+# io.BufferedRandom. While reads are sequential, each read from server is
+# twice the size of the previous one up to readahead size. Writes to random
+# access files are collected until they reach write behind size and sent as
+# one batch edit, writes are also sent before reads and when file is flushed.
+# Server does not allow leaving gaps to files, so writes must start at or
+# before end of file
+class ZynFile(io.RawIOBase):
+    def __init__(
+            self,
+            connection,
+            node_id=None,
+            path=None,
+            mode='rb',
+            readahead_size=READAHEAD_SIZE,
+            write_behind_size=WRITE_BEHIND_SIZE,
+    ):
+        super().__init__()
+        if mode not in ['rb', 'r+b']:
+            raise ValueError('Unsupported mode "{}"'.format(mode))
+
+        if mode == 'rb':
+            rsp = connection.open_read_handle(node_id=node_id, path=path)
+        else:
+            rsp = connection.open_file_write(node_id=node_id, path=path)
+        zyn.util.check_server_response(rsp)
+        open_rsp = rsp.as_open_rsp()
+
+        self._connection = connection
+        self._mode = mode
+        self._readahead_size = readahead_size
+        self._write_behind_size = write_behind_size
+        self._node_id = open_rsp.node_id
+        self._type_of_file = open_rsp.type_of_file
+        self._file = _CachedFile(open_rsp.revision, open_rsp.size, open_rsp.block_size)
+        self._is_modified_by_others = False
+        self._position = 0
+        self._buffer_offset = 0
+        self._buffer = b''
+        self._window = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def node_id(self):
+        return self._node_id
+
+    def revision(self):
+        return self._file.revision
+
+    def size(self):
+        return max([self._file.size] + [offset + len(data) for offset, data in self._pending])
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return self._mode == 'r+b' and self._type_of_file == FILE_TYPE_RANDOM_ACCESS
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size() + offset
+        else:
+            raise ValueError('Invalid whence "{}"'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position {}'.format(position))
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self._send_pending()
+
+        view = memoryview(b).cast('B')
+        buffer_end = self._buffer_offset + len(self._buffer)
+        if not self._buffer_offset <= self._position < buffer_end:
+            self._apply_notifications()
+            if self._position >= self._file.size or len(view) == 0:
+                return 0
+            self._read_to_buffer(len(view))
+
+        start = self._position - self._buffer_offset
+        size = min(len(view), len(self._buffer) - start)
+        view[:size] = self._buffer[start:start + size]
+        self._position += size
+        return size
+
+    def _read_to_buffer(self, size):
+        if self._position == self._buffer_offset + len(self._buffer):
+            self._window = min(max(self._window * 2, size), max(self._readahead_size, size))
+        else:
+            self._window = size
+
+        # Server reads must stay within one block
+        block_end = (self._position // self._file.block_size + 1) * self._file.block_size
+        rsp, data = self._connection.read_file(
+            self._node_id,
+            self._position,
+            min(self._window, block_end - self._position, self._file.size - self._position),
+        )
+        zyn.util.check_server_response(rsp)
+        if not data:
+            raise RuntimeError('Server returned no data, node_id={}, offset={}'.format(
+                self._node_id,
+                self._position,
+            ))
+        self._buffer_offset = self._position
+        self._buffer = bytes(data)
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if not self.writable():
+            raise io.UnsupportedOperation('File is not writable')
+        if self._position > self.size():
+            raise io.UnsupportedOperation('Writing beyond end of file is not supported')
+
+        data = bytes(b)
+        if not data:
+            return 0
+        self._add_pending(self._position, data)
+        self._position += len(data)
+        if self._pending_size >= self._write_behind_size:
+            self._send_pending()
+        return len(data)
+
+    def _add_pending(self, offset, data):
+        # Pending writes are kept sorted and merged, as batch edit
+        # operations must be in order of offsets
+        self._pending_size += len(data)
+        if self._pending:
+            last_offset, last = self._pending[-1]
+            if last_offset + len(last) == offset:
+                last += data
+                return
+
+        end = offset + len(data)
+        merged_offset = offset
+        merged_end = end
+        pending = []
+        overlapping = []
+        for run_offset, run in self._pending:
+            if run_offset + len(run) < offset or run_offset > end:
+                pending.append((run_offset, run))
+            else:
+                overlapping.append((run_offset, run))
+                merged_offset = min(merged_offset, run_offset)
+                merged_end = max(merged_end, run_offset + len(run))
+
+        merged = bytearray(merged_end - merged_offset)
+        for run_offset, run in overlapping:
+            merged[run_offset - merged_offset:run_offset - merged_offset + len(run)] = run
+        merged[offset - merged_offset:end - merged_offset] = data
+        pending.append((merged_offset, merged))
+        pending.sort(key=lambda run: run[0])
+        self._pending = pending
+        self._pending_size = sum(len(run) for _, run in pending)
+
+    def _send_pending(self):
+        if not self._pending:
+            return
+
+        self._apply_notifications()
+        size = self.size()
+        batch = self._connection.ra_batch_edit(self._node_id, self._file.revision)
+        for offset, data in self._pending:
+            # Writes must stay within one block
+            view = memoryview(data)
+            while view:
+                block_end = (offset // self._file.block_size + 1) * self._file.block_size
+                write_size = min(len(view), block_end - offset)
+                batch.write(offset, bytes(view[:write_size]))
+                offset += write_size
+                view = view[write_size:]
+
+        self._pending = []
+        self._pending_size = 0
+        self._buffer = b''
+        rsp = batch.commit()
+        zyn.util.check_server_response(rsp)
+        self._file.revision = rsp.as_batch_edit_response().revision
+        self._file.size = size
+
+    def _apply_notifications(self):
+        for n in self._connection.take_notifications([self._node_id]):
+            self._file.apply_notification(n)
+            self._is_modified_by_others = True
+            self._buffer = b''
+
+    def flush(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self._send_pending()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._send_pending()
+        finally:
+            super().close()
+            if self._mode == 'rb' and not self._is_modified_by_others:
+                rsp = self._connection.release_read_handle(self._node_id)
+            else:
+                rsp = self._connection.close_file(self._node_id)
+            if rsp is not None:
+                zyn.util.check_server_response(rsp)
+
+
 class ZynConnection:
 
     def __init__(self, zyn_socket, debug_messages=False):
@@ -130,6 +1043,14 @@ class ZynConnection:
         self._input_buffer = b''
         self._heartbeat = None
         self._notifications = []
+        self._path_cache = None
+        self._block_size_tuner = None
+        self._concurrency_limiter = None
+        self._open_handle_cache = None
+        self._block_cache = None
+        self._cached_files = {}
+        self._file_ids = {}
+        self._server_id = None
 
     def disconnect(self):
         if self._heartbeat is not None:
@@ -139,6 +1060,166 @@ class ZynConnection:
     def enable_debug_messages(self):
         self._debug_messages = True
 
+    def enable_path_resolution(
+            self,
+            max_number_of_paths=100000,
+            max_age=PATH_NODE_ID_MAX_AGE_SECONDS,
+    ):
+        # Requests made with paths are sent with node ids when the path has
+        # been seen in a response within max_age seconds, saving server from
+        # resolving the path. Cache only sees the traffic of this connection,
+        # node ids of elements other clients delete are detected from errors
+        # and request is retried with the path, unless the node id was already
+        # reused, which is why entries expire
+        self._path_cache = PathNodeIdCache(max_number_of_paths, max_age)
+
+    def path_cache(self):
+        return self._path_cache
+
+    def path_cache_node_id(self, path):
+        if self._path_cache is None or path is None:
+            return None
+        return self._path_cache.node_id(path)
+
+    def enable_open_handle_cache(self, max_number_of_handles):
+        self._open_handle_cache = OpenHandleCache(self, max_number_of_handles)
+
+    def open_handle_cache(self):
+        return self._open_handle_cache
+
+    def set_block_cache(self, cache):
+        self._block_cache = cache
+
+    def block_cache(self):
+        return self._block_cache
+
+    def _track_cached_file(self, mode, rsp):
+        if self._block_cache is None or rsp.is_error():
+            return
+        open_rsp = rsp.as_open_rsp()
+        if mode != 0:
+            # Writes through this connection are not notified
+            self._forget_cached_file(open_rsp.node_id)
+            return
+
+        file_id = self._cached_file_id(open_rsp.node_id, open_rsp.revision)
+        if file_id is None:
+            return
+        self._cached_files[open_rsp.node_id] = _CachedFile(
+            open_rsp.revision,
+            open_rsp.size,
+            open_rsp.block_size,
+            file_id,
+        )
+
+    def _cached_file_id(self, node_id, revision):
+        # Identifies file in block cache, see zyn.cache.BlockCache. Revision
+        # of a reused node id restarts from zero, so creation time is queried
+        # again only when revision has decreased or file has been deleted
+        known = self._file_ids.get(node_id, None)
+        if known is not None and revision >= known[1]:
+            self._file_ids[node_id] = (known[0], revision)
+            return known[0]
+
+        if self._server_id is None:
+            rsp = self.query_system()
+            if rsp.is_error():
+                return None
+            self._server_id = rsp.field(0).key_value_list_to_dict()['server-id'].as_uint()
+
+        created = self.file_created_at(node_id)
+        if created is None:
+            return None
+        file_id = (self._server_id, node_id, created)
+        self._file_ids[node_id] = (file_id, revision)
+        return file_id
+
+    def _forget_file_id(self, node_id=None):
+        if node_id is None:
+            self._file_ids.clear()
+        else:
+            self._file_ids.pop(node_id, None)
+
+    def file_created_at(self, node_id):
+        # Server reuses node ids, creation time tells a recreated file apart
+        rsp = self.query_fs_element(node_id=node_id)
+        if rsp.is_error():
+            return None
+        return rsp.field(0).key_value_list_to_dict()['created-at'].as_uint()
+
+    def _forget_cached_file(self, node_id):
+        f = self._cached_files.pop(node_id, None)
+        if f is not None:
+            self._block_cache.invalidate(f.file_id)
+
+    def open_read_handle(self, node_id=None, path=None):
+        # Opens file for reading, handle may be shared with earlier reads
+        # and must be released with release_read_handle()
+        if self._open_handle_cache is None:
+            return self.open_file_read(node_id=node_id, path=path)
+        return self._open_handle_cache.open_read(node_id=node_id, path=path)
+
+    def release_read_handle(self, node_id):
+        if self._open_handle_cache is not None and self._open_handle_cache.is_cached(node_id):
+            return None
+        return self.close_file(node_id)
+
+    def take_notifications(self, node_ids):
+        # Reads pending notifications and removes the ones concerning given nodes
+        while self._read_notification(timeout=0):
+            pass
+
+        taken = []
+        remaining = []
+        for n in self._notifications:
+            if getattr(n, 'node_id', None) in node_ids:
+                taken.append(n)
+            else:
+                remaining.append(n)
+        self._notifications = remaining
+        return taken
+
+    def take_notified_node_ids(self, node_ids):
+        return set(n.node_id for n in self.take_notifications(node_ids))
+
+    def open_file_object(
+            self,
+            node_id=None,
+            path=None,
+            mode='rb',
+            buffering=io.DEFAULT_BUFFER_SIZE,
+    ):
+        # Buffered file object, see ZynFile
+        raw = ZynFile(self, node_id=node_id, path=path, mode=mode)
+        if mode == 'rb':
+            return io.BufferedReader(raw, buffering)
+        return io.BufferedRandom(raw, buffering)
+
+    def _send_with_resolved_path(self, send, node_id, path):
+        if self._path_cache is None or path is None or node_id is not None:
+            return send(node_id, path)
+
+        cached_node_id = self._path_cache.node_id(path)
+        if cached_node_id is None:
+            return send(node_id, path)
+
+        rsp = send(cached_node_id, None)
+        if rsp.is_error() and rsp.error_code() in PathNodeIdCache.STALE_NODE_ID_ERRORS:
+            self._log.debug('Cached node id for path is stale, path="{}", node_id={}'.format(
+                path,
+                cached_node_id,
+            ))
+            self._path_cache.invalidate(path=path)
+            return send(None, path)
+        return rsp
+
+    def _path_of(self, node_id, path):
+        if path is not None:
+            return path
+        if self._path_cache is not None and node_id is not None:
+            return self._path_cache.path(node_id)
+        return None
+
     def start_heartbeat_thread(self):
         interval = 60
         self._log.info(
@@ -146,16 +1227,65 @@ class ZynConnection:
         )
         self._heartbeat = ConnectionHearbeat(interval, self)
 
+    def set_block_size_tuner(self, tuner):
+        self._block_size_tuner = tuner
+
+    def block_size_tuner(self):
+        return self._block_size_tuner
+
+    def transfer_block_size(self, max_block_size):
+        if self._block_size_tuner is None or max_block_size is None:
+            return max_block_size
+        return self._block_size_tuner.block_size(max_block_size)
+
+    def set_concurrency_limiter(self, limiter):
+        self._concurrency_limiter = limiter
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        # Priority class of traffic sent and received within the block
+        previous = self._socket.priority()
+        self._socket.set_priority(priority)
+        try:
+            yield
+        finally:
+            self._socket.set_priority(previous)
+
+    def _add_round_trip(self, started):
+        duration = time.monotonic() - started
+        if self._block_size_tuner is not None:
+            self._block_size_tuner.add_round_trip(duration)
+        if self._concurrency_limiter is not None:
+            self._concurrency_limiter.add_latency(duration)
+
+    def _add_transfer(self, size, started):
+        if self._block_size_tuner is not None:
+            self._block_size_tuner.add_transfer(size, time.monotonic() - started)
+
     def _send_receive(self, req):
+        started = time.monotonic()
         self.write(req)
-        return self.read_response()
+        rsp = self.read_response()
+        self._add_round_trip(started)
+        return rsp
+
+    def _add_notification(self, notification):
+        if notification.notification_type() == Notification.TYPE_DISCONNECTED:
+            # Open files may have been deleted
+            self._forget_file_id()
+        f = self._cached_files.get(getattr(notification, 'node_id', None), None)
+        if f is not None:
+            f.apply_notification(notification)
+            self._file_ids[notification.node_id] = (f.file_id, f.revision)
+            self._block_cache.invalidate(f.file_id)
+        self._notifications.append(notification)
 
     def _read_notification(self, timeout=0):
         msg = self.read_message(timeout=timeout)
         if msg is not None:
             if msg.type() != Message.NOTIFICATION:
                 raise RuntimeError('Server sent an unexpected response')
-            self._notifications.append(msg)
+            self._add_notification(msg)
             return True
         return False
 
@@ -225,24 +1355,38 @@ class ZynConnection:
             block_size=None,
             transaction_id=None
     ):
-        parent = self.file_descriptor(parent_node_id, parent_path)
-        req = \
-            self.field_version() \
-            + 'CREATE-FILE:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + parent \
-            + self.field_string(name) \
-            + self.field_unsigned(file_type)
-
-        if block_size is not None:
-            req += self.field_unsigned(block_size)
-
-        req = \
-            req \
-            + ';' \
-            + self.field_end_of_message() \
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'CREATE-FILE:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + self.field_string(name) \
+                + self.field_unsigned(file_type)
+
+            if block_size is not None:
+                req += self.field_unsigned(block_size)
+
+            req = \
+                req \
+                + ';' \
+                + self.field_end_of_message() \
+
+            return self._send_receive(req)
+
+        rsp = self._send_with_resolved_path(send, parent_node_id, parent_path)
+        self._learn_created(rsp, name, parent_node_id, parent_path)
+        return rsp
 
-        return self._send_receive(req)
+    def _learn_created(self, rsp, name, parent_node_id, parent_path):
+        if rsp.is_error() or self._path_cache is None:
+            return
+        path_parent = self._path_of(parent_node_id, parent_path)
+        if path_parent is not None:
+            self._path_cache.learn(
+                zyn.util.join_remote_paths([path_parent, name]),
+                rsp.as_create_rsp().node_id,
+            )
 
     def create_file_random_access(
             self,
@@ -279,17 +1423,21 @@ class ZynConnection:
         )
 
     def create_directory(self, name, parent_node_id=None, parent_path=None, transaction_id=None):
-        parent = self.file_descriptor(parent_node_id, parent_path)
-        req = \
-            self.field_version() \
-            + 'CREATE-DIRECTORY:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + parent \
-            + self.field_string(name) \
-            + ';' \
-            + self.field_end_of_message() \
-
-        return self._send_receive(req)
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'CREATE-DIRECTORY:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + self.field_string(name) \
+                + ';' \
+                + self.field_end_of_message() \
+
+            return self._send_receive(req)
+
+        rsp = self._send_with_resolved_path(send, parent_node_id, parent_path)
+        self._learn_created(rsp, name, parent_node_id, parent_path)
+        return rsp
 
     def file_descriptor(self, node_id=None, path=None):
         if node_id is not None and path is None:
@@ -300,28 +1448,55 @@ class ZynConnection:
             raise RuntimeError('File descriptor needs either node_id or path')
 
     def delete(self, node_id=None, path=None, transaction_id=None):
-        req = \
-            self.field_version() \
-            + 'DELETE:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + self.file_descriptor(node_id, path) \
-            + ';' \
-            + self.field_end_of_message() \
+        self._close_cached_handle(node_id, path)
+
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'DELETE:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + ';' \
+                + self.field_end_of_message() \
+
+            return self._send_receive(req)
+
+        # All creation times are forgotten when node id of path is not known
+        self._forget_file_id(node_id if node_id is not None else self.path_cache_node_id(path))
+        rsp = self._send_with_resolved_path(send, node_id, path)
+        if not rsp.is_error() and self._path_cache is not None:
+            self._path_cache.invalidate(path=path, node_id=node_id)
+        return rsp
 
-        return self._send_receive(req)
+    def _close_cached_handle(self, node_id=None, path=None):
+        if self._open_handle_cache is None:
+            return
+        if node_id is None:
+            node_id = self.path_cache_node_id(path)
+        self._open_handle_cache.close(node_id)
 
     def file_open(self, mode, node_id=None, path=None, transaction_id=None):
-
-        req = \
-            self.field_version() \
-            + 'O:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + self.file_descriptor(node_id, path) \
-            + self.field_unsigned(mode) \
-            + ';' \
-            + self.field_end_of_message() \
-
-        return self._send_receive(req)
+        if mode != 0:
+            # File can not be open for reading and writing at the same time
+            self._close_cached_handle(node_id, path)
+
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'O:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + self.field_unsigned(mode) \
+                + ';' \
+                + self.field_end_of_message() \
+
+            return self._send_receive(req)
+
+        rsp = self._send_with_resolved_path(send, node_id, path)
+        if not rsp.is_error() and path is not None and self._path_cache is not None:
+            self._path_cache.learn(path, rsp.as_open_rsp().node_id)
+        self._track_cached_file(mode, rsp)
+        return rsp
 
     def open_file_read(self, node_id=None, path=None, transaction_id=None):
         return self.file_open(0, node_id, path, transaction_id)
@@ -330,6 +1505,9 @@ class ZynConnection:
         return self.file_open(1, node_id, path, transaction_id)
 
     def close_file(self, node_id=None, transaction_id=None):
+        if self._open_handle_cache is not None:
+            self._open_handle_cache.forget(node_id)
+        self._cached_files.pop(node_id, None)
 
         req = \
             self.field_version() \
@@ -398,6 +1576,8 @@ class ZynConnection:
             return rsp
 
         for operation_type, offset, param in batch.operations:
+            started = time.monotonic()
+            data = None
             if operation_type == BATCH_EDIT_TYPE_DELETE:
                 req = \
                     self.field_unsigned(operation_type) \
@@ -417,6 +1597,8 @@ class ZynConnection:
 
             elif operation_type == BATCH_EDIT_TYPE_WRITE:
                 data = param
+                if isinstance(data, _LazyData):
+                    data = data.read()
                 req = \
                     self.field_unsigned(operation_type) \
                     + self.field_block(offset, len(data)) \
@@ -434,14 +1616,19 @@ class ZynConnection:
                     return rsp
             else:
                 raise RuntimeError()
+            if data is not None:
+                self._add_transfer(len(data), started)
 
         return rsp  # Return latest rsp
 
     def blob_write_stream(self, node_id, revision, stream, block_size=None, transaction_id=None):
         # If block size is not set, try to use data length as size
         # also if block size is larger than actual data, use data length
-        if block_size is None or block_size > stream.size():
+        if block_size is None or block_size >= stream.size():
             block_size = stream.size()
+        else:
+            # Server requires blocks that divide its block size when file is larger than it
+            block_size = self.transfer_block_size(block_size)
 
         size = stream.size()
         req = \
@@ -465,11 +1652,13 @@ class ZynConnection:
             block = stream.get(block_size)
             if block is None:
                 break
+            started = time.monotonic()
             self._socket.sendall(block)
             bytes_send += len(block)
             rsp = self.read_response(timeout=60*5)
             if rsp.is_error():
                 return rsp
+            self._add_transfer(len(block), started)
 
         if bytes_send != size:
             raise RuntimeError('Sent bytes does not match the size of ')
@@ -527,6 +1716,65 @@ class ZynConnection:
         if size == 0:
             return
 
+        if node_id in self._cached_files:
+            rsp, data = self._read_file_cached(node_id, offset, size, transaction_id)
+            if rsp is not None:
+                return rsp, data
+        return self._read_file(node_id, offset, size, transaction_id)
+
+    def _read_response(self, transaction_id, revision, offset, size):
+        return Response(self.parse_message(
+            self.field_version()
+            + 'RSP:'
+            + self.field_transaction_id(transaction_id)
+            + self.field_unsigned(0)
+            + ';'
+            + self.field_unsigned(revision)
+            + self.field_block(offset, size)
+            + self.field_end_of_message()
+        ))
+
+    def _read_file_cached(self, node_id, offset, size, transaction_id):
+        # Reads whole server block through cache, returns None as response
+        # if range can not be read from cache
+        while self._read_notification(timeout=0):
+            pass
+
+        f = self._cached_files.get(node_id, None)
+        if f is None or offset >= f.size:
+            return None, None
+        index = offset // f.block_size
+        block_offset = index * f.block_size
+        if offset + size > block_offset + f.block_size:
+            return None, None
+
+        transaction_id = transaction_id or self._consume_transaction_id()
+        revision = f.revision
+        data, is_locked = self._block_cache.get_or_lock(f.file_id, revision, index, f.size)
+        if data is None:
+            try:
+                rsp, data = self._read_file(
+                    node_id,
+                    block_offset,
+                    min(f.block_size, f.size - block_offset),
+                    transaction_id,
+                )
+                if rsp.is_error():
+                    return None, None
+                revision = rsp.field(0).as_uint()
+                if revision == f.revision:
+                    self._block_cache.put(f.file_id, revision, index, data, f.size)
+                else:
+                    # Modified without notification, properties are not known
+                    self._forget_cached_file(node_id)
+            finally:
+                if is_locked:
+                    self._block_cache.release(f.file_id, f.revision, index)
+
+        data = data[offset - block_offset:offset - block_offset + size]
+        return self._read_response(transaction_id, revision, offset, len(data)), data
+
+    def _read_file(self, node_id, offset, size, transaction_id=None):
         req = \
             self.field_version() \
             + 'R:' \
@@ -536,6 +1784,7 @@ class ZynConnection:
             + ';' \
             + self.field_end_of_message() \
 
+        started = time.monotonic()
         self.write(req)
         rsp = self.read_response()
         if rsp.is_error():
@@ -545,9 +1794,12 @@ class ZynConnection:
         data = bytearray()
         if read_size > 0:
             data = self.read_data(read_size)
+            self._add_transfer(read_size, started)
         return rsp, data
 
     def read_file_stream(self, node_id, offset, size, block_size, stream):
+        server_block_size = block_size
+        block_size = self.transfer_block_size(block_size)
         offset_start = offset
         offset_block_start = offset_start
         offset_end = offset_start + size
@@ -555,30 +1807,48 @@ class ZynConnection:
             if offset_block_start >= offset_end:
                 break
             bytes_remaining = offset_end - offset_block_start
-            block_size = min(block_size, bytes_remaining)
+            read_size = min(block_size, bytes_remaining)
+            if server_block_size:
+                # Reads can not cross server blocks, unaligned
+                # start is read up to the end of its block
+                read_size = min(
+                    read_size,
+                    server_block_size - offset_block_start % server_block_size,
+                )
             rsp, d = self.read_file(
                 node_id,
                 offset_block_start,
-                block_size,
+                read_size,
                 stream.transaction_id(),
             )
             if rsp.is_error():
                 stream.handle_error(rsp)
                 break
+            if not d:
+                break
             stream.handle_data(offset_block_start, d)
             offset_block_start += len(d)
 
     def query_fs_children(self, node_id=None, path=None, transaction_id=None):
-        req = \
-            self.field_version() \
-            + 'Q-FS-C:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + self.file_descriptor(node_id, path) \
-            + ';' \
-            + self.field_end_of_message() \
-
-        self.write(req)
-        rsp = self.read_response()
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'Q-FS-C:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + ';' \
+                + self.field_end_of_message() \
+
+            self.write(req)
+            return self.read_response()
+
+        rsp = self._send_with_resolved_path(send, node_id, path)
+        path_parent = self._path_of(node_id, path)
+        if not rsp.is_error() and path_parent is not None and self._path_cache is not None:
+            self._path_cache.learn_children(
+                path_parent,
+                rsp.as_query_fs_children_rsp().elements,
+            )
         return rsp
 
     def query_fs_element_properties(
@@ -602,16 +1872,22 @@ class ZynConnection:
         return rsp
 
     def query_fs_element(self, node_id=None, path=None, transaction_id=None):
-        req = \
-            self.field_version() \
-            + 'Q-FS-E:' \
-            + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
-            + self.file_descriptor(node_id, path) \
-            + ';' \
-            + self.field_end_of_message() \
-
-        self.write(req)
-        rsp = self.read_response()
+        def send(node_id, path):
+            req = \
+                self.field_version() \
+                + 'Q-FS-E:' \
+                + self.field_transaction_id(transaction_id or self._consume_transaction_id()) \
+                + self.file_descriptor(node_id, path) \
+                + ';' \
+                + self.field_end_of_message() \
+
+            self.write(req)
+            return self.read_response()
+
+        rsp = self._send_with_resolved_path(send, node_id, path)
+        if not rsp.is_error() and path is not None and self._path_cache is not None:
+            desc = rsp.field(0).key_value_list_to_dict()
+            self._path_cache.learn(path, desc['node-id'].as_uint())
         return rsp
 
     def query_counters(self, transaction_id=None):
@@ -738,7 +2014,7 @@ class ZynConnection:
             if message is None:
                 raise TimeoutError('No response received from socket on time')
             if message.type() == Message.NOTIFICATION:
-                self._notifications.append(message)
+                self._add_notification(message)
                 continue
             return message
 
@@ -5,10 +5,12 @@ import os.path
 import traceback
 import sys
 
+import zyn.cache
 import zyn.socket
 import zyn.connection
 import zyn.client.shell
 import zyn.client.client
+import zyn.client.compare
 import zyn.client.data
 import zyn.client.web
 import zyn.util
@@ -17,17 +19,79 @@ import zyn.util
 PATH_TO_DEFAULT_STATE_FILE = os.path.expanduser("~/.zyn-cli-client")
 
 
-def _create_socket(address, port, no_tls=False):
+def _create_socket(address, port, no_tls=False, shapers=None):
     if no_tls:
-        return zyn.socket.ZynSocket.create_no_tls(address, port)
+        s = zyn.socket.ZynSocket.create_no_tls(address, port)
     else:
-        return zyn.socket.ZynSocket.create_tls(address, port)
+        s = zyn.socket.ZynSocket.create_tls(address, port)
+    if shapers is not None:
+        s.set_shapers(*shapers)
+    return s
+
+
+def _create_shapers(args):
+    # Limits are given in KiB/s and shared by all connections of the process
+    def rate(name):
+        if args[name] is None:
+            return None
+        return args[name] * 1024
+
+    return (
+        zyn.connection.TrafficShaper(rate('max_upload_rate'), rate('max_upload_rate_bulk')),
+        zyn.connection.TrafficShaper(rate('max_download_rate'), rate('max_download_rate_bulk')),
+    )
+
+
+def _add_block_cache_arguments(parser):
+    parser.add_argument(
+        '--block-cache-size',
+        type=int,
+        default=zyn.cache.BLOCK_CACHE_SIZE // (1024 * 1024),
+        help='Size in MiB of file content cached in memory, 0 disables caching',
+    )
+    parser.add_argument(
+        '--block-cache-dir',
+        default=None,
+        help='Directory where file content is cached, can be shared by processes',
+    )
+    parser.add_argument(
+        '--block-cache-dir-size',
+        type=int,
+        default=zyn.cache.BLOCK_CACHE_SIZE_ON_DISK // (1024 * 1024),
+        help='Size in MiB of file content cached in directory',
+    )
+    parser.add_argument(
+        '--block-cache-memory-file-size',
+        type=int,
+        default=zyn.cache.BLOCK_CACHE_MEMORY_FILE_SIZE // (1024 * 1024),
+        help='Size in MiB of largest file cached in memory when directory is used',
+    )
+
+
+def _create_block_cache(args):
+    # Cache is shared by all connections of the process
+    if args['block_cache_size'] <= 0:
+        return None
+    return zyn.cache.BlockCache(
+        args['block_cache_size'] * 1024 * 1024,
+        args['block_cache_dir'],
+        args['block_cache_dir_size'] * 1024 * 1024,
+        args['block_cache_memory_file_size'] * 1024 * 1024,
+    )
 
 
 def _create_connection(socket, debug_protocol):
     return zyn.connection.ZynConnection(socket, debug_protocol)
 
 
+def _enable_open_handle_cache(connection):
+    # Leave room for files opened for writing and for uncached reads
+    rsp = connection.query_system()
+    zyn.util.check_server_response(rsp)
+    max_number_of_open_files = rsp.as_query_system_rsp().max_number_of_open_files_per_connection
+    connection.enable_open_handle_cache(max(0, max_number_of_open_files - 2))
+
+
 def get_logger(verbose_count):
     level = logging.WARNING
     if verbose_count == 1:
@@ -104,6 +168,28 @@ def shell():
     parser.add_argument('--debug-protocol', help='', action='store_true')
     parser.add_argument('--verbose', '-v', action='count', default=0)
     parser.add_argument('--hearbeat', action='store_true')
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=4,
+        help='Number of connections used for transferring files',
+    )
+    parser.add_argument(
+        '--verify-content',
+        action='store_true',
+        help='Compare content hashes when adding local files to new remote',
+    )
+    parser.add_argument('--max-upload-rate', type=int, help='KiB/s, all traffic')
+    parser.add_argument('--max-download-rate', type=int, help='KiB/s, all traffic')
+    parser.add_argument('--max-upload-rate-bulk', type=int, help='KiB/s, bulk transfers')
+    parser.add_argument('--max-download-rate-bulk', type=int, help='KiB/s, bulk transfers')
+    parser.add_argument(
+        '--compare-window',
+        type=int,
+        default=zyn.client.compare.COMPARE_WINDOW_SIZE // (1024 * 1024),
+        help='Size in MiB of parts in which large random access files are compared to remote',
+    )
+    _add_block_cache_arguments(parser)
 
     subparsers = parser.add_subparsers(dest='cmd')
     parser_init = subparsers.add_parser('init')
@@ -143,6 +229,7 @@ def shell():
             zyn.client.data.LocalFilesystemManager(path_local_data, log),
         )
         state.to_file(path_client_conf)
+        state.close()
         print('Configuration initialized')
 
     if not os.path.exists(path_client_conf):
@@ -150,8 +237,15 @@ def shell():
         raise RuntimeError(f'Client configuration at path "{path_client_conf}" does not exists')
 
     client_state = zyn.client.client.State.from_file(path_client_conf, log)
-    socket = _create_socket(client_state.address, client_state.port, args['no_tls'])
+    client_state.fs.set_compare_window_size(args['compare_window'] * 1024 * 1024)
+    shapers = _create_shapers(args)
+    socket = _create_socket(client_state.address, client_state.port, args['no_tls'], shapers)
     connection = _create_connection(socket, args['debug_protocol'])
+    connection.enable_path_resolution()
+    block_size_tuner = client_state.block_size_tuner(client_state.address, client_state.port)
+    connection.set_block_size_tuner(block_size_tuner)
+    block_cache = _create_block_cache(args)
+    connection.set_block_cache(block_cache)
 
     if password is None:
         password = getpass.getpass('Password: ')
@@ -160,8 +254,33 @@ def shell():
     zyn.util.check_server_response(rsp)
 
     print('Successfully connected and authenticated to remote')
+    _enable_open_handle_cache(connection)
 
-    client = zyn.client.client.ZynFilesystemClient(connection, client_state, log)
+    def create_pool_connection():
+        c = _create_connection(
+            _create_socket(client_state.address, client_state.port, args['no_tls'], shapers),
+            args['debug_protocol'],
+        )
+        c.set_block_size_tuner(block_size_tuner)
+        c.set_block_cache(block_cache)
+        zyn.util.check_server_response(c.authenticate(client_state.username, password))
+        _enable_open_handle_cache(c)
+        return c
+
+    connection_pool = None
+    if args['connections'] > 1:
+        connection_pool = zyn.connection.ConnectionPool(
+            create_pool_connection,
+            args['connections'],
+            limiter=zyn.connection.ConcurrencyLimiter(args['connections']),
+        )
+
+    client = zyn.client.client.ZynFilesystemClient(
+        connection,
+        client_state,
+        log,
+        connection_pool=connection_pool,
+    )
     if not client.has_remote_info():
         log.debug('Setting remote info')
         client.update_remote_info()
@@ -189,7 +308,9 @@ def shell():
                 print('Answering "no" will reset state of local client')
                 answer = input('yes/no? ')
                 if answer.strip().lower() == 'yes':
-                    added, existed = client.synchronize_local_files_with_remote()
+                    added, existed = client.synchronize_local_files_with_remote(
+                        args['verify_content']
+                    )
                     print('Done\n')
                     if added:
                         print()
@@ -201,7 +322,10 @@ def shell():
                     if existed:
                         print()
                         print('Note: Following files already existed on remote,')
-                        print('they are assumed to be same as local files')
+                        if args['verify_content']:
+                            print('their content was verified to be same as local files')
+                        else:
+                            print('they are assumed to be same as local files')
                         for e in existed:
                             print('\tName: "{}", Node Id: {}'.format(e.path_remote(), e.node_id()))
                         print()
@@ -234,9 +358,12 @@ def shell():
             client_state.to_file(path_client_conf)
 
     connection.disconnect()
+    if connection_pool is not None:
+        connection_pool.close()
     print()
     print('Exiting, saving client state')
     client_state.to_file(path_client_conf)
+    client_state.close()
 
 
 def webserver():
@@ -253,13 +380,77 @@ def webserver():
     parser.add_argument('--verbose', '-v', action='count', default=0)
     parser.add_argument('--remote-hostname', default=None)
     parser.add_argument('--server-websocket-address', default=None)
+    parser.add_argument(
+        '--zyn-workers',
+        type=int,
+        default=zyn.client.web.ZYN_WORKERS,
+        help='Number of threads serving Zyn requests of web clients',
+    )
+    parser.add_argument(
+        '--transfer-workers',
+        type=int,
+        default=zyn.client.web.TRANSFER_WORKERS,
+        help='Number of threads serving file downloads',
+    )
+    parser.add_argument(
+        '--request-timeout',
+        type=float,
+        default=zyn.client.web.REQUEST_TIMEOUT_SECONDS,
+        help='Seconds to wait for Zyn request before failing web request',
+    )
+    parser.add_argument(
+        '--transfer-timeout',
+        type=float,
+        default=zyn.client.web.TRANSFER_TIMEOUT_SECONDS,
+        help='Seconds to wait for each block of file download before failing it',
+    )
+    parser.add_argument(
+        '--max-backend-connections',
+        type=int,
+        default=zyn.client.web.MAX_BACKEND_CONNECTIONS,
+        help='Maximum number of connections to Zyn server from each process',
+    )
+    parser.add_argument(
+        '--connections-per-session',
+        type=int,
+        default=zyn.client.web.CONNECTIONS_PER_SESSION,
+        help='Maximum number of connections to Zyn server kept by each user session',
+    )
+    parser.add_argument(
+        '--connection-idle-timeout',
+        type=float,
+        default=zyn.client.web.CONNECTION_IDLE_TIMEOUT_SECONDS,
+        help='Seconds after which unused connections to Zyn server are closed',
+    )
+    parser.add_argument(
+        '--token-validity',
+        type=float,
+        default=zyn.client.web.TOKEN_VALIDITY_SECONDS,
+        help='Seconds preallocated authentication token is used, '
+        + 'must be less than server authentication token duration',
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of web server processes, 0 starts one for each CPU',
+    )
+    parser.add_argument(
+        '--session-db',
+        default=None,
+        help='Path to database where sessions are stored, required with multiple processes',
+    )
+    _add_block_cache_arguments(parser)
 
     args = vars(parser.parse_args())
     log = get_logger(args['verbose'])
+    block_cache = _create_block_cache(args)
 
     def create_connection_callback():
         s = _create_socket(args['zyn-server-ip'], args['zyn-server-port'], args['no_tls'])
-        return _create_connection(s, args['debug_protocol'])
+        c = _create_connection(s, args['debug_protocol'])
+        c.set_block_cache(block_cache)
+        return c
 
     # Try connection once to make sure it works
     try:
@@ -283,4 +474,14 @@ def webserver():
         create_connection_callback,
         log,
         args['debug_tornado'],
+        args['zyn_workers'],
+        args['transfer_workers'],
+        args['request_timeout'],
+        args['transfer_timeout'],
+        args['max_backend_connections'],
+        args['connections_per_session'],
+        args['connection_idle_timeout'],
+        args['token_validity'],
+        args['processes'],
+        args['session_db'],
     )
@@ -4,14 +4,24 @@ import socket
 
 import certifi
 
+from zyn.connection import (
+    PRIORITY_INTERACTIVE,
+    PRIORITIES,
+)
+
 log = logging.getLogger(__name__)
 
 
 class ZynSocket:
+    _SHAPED_SEND_SIZE = 64 * 1024
+
     def __init__(self, socket, tls_socket=None, tls_context=None):
         self._socket = socket
         self._socket_tls = tls_socket
         self._tls_context = tls_context
+        self._shaper_send = None
+        self._shaper_receive = None
+        self._priority = PRIORITY_INTERACTIVE
 
     def _create_socket(remote_address, remote_port):
         info = socket.getaddrinfo(remote_address, remote_port, type=socket.SOCK_STREAM)[0]
@@ -48,14 +58,38 @@ class ZynSocket:
     def settimeout(self, timeout):
         return self.socket().settimeout(timeout)
 
+    def set_shapers(self, shaper_send, shaper_receive):
+        # Shapers can be shared by sockets to share the limits
+        self._shaper_send = shaper_send if shaper_send and shaper_send.is_limited() else None
+        self._shaper_receive = \
+            shaper_receive if shaper_receive and shaper_receive.is_limited() else None
+
+    def priority(self):
+        return self._priority
+
+    def set_priority(self, priority):
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority "{}"'.format(priority))
+        self._priority = priority
+
     def recv(self, size=None):
         if size is None:
-            return self.socket().recv(1024)
+            data = self.socket().recv(1024)
         else:
-            return self.socket().recv(size)
+            data = self.socket().recv(size)
+        if self._shaper_receive is not None and data:
+            self._shaper_receive.consume(len(data), self._priority)
+        return data
 
     def sendall(self, data):
-        return self.socket().sendall(data)
+        if self._shaper_send is None:
+            return self.socket().sendall(data)
+
+        view = memoryview(data)
+        for offset in range(0, len(view), self._SHAPED_SEND_SIZE):
+            block = view[offset:offset + self._SHAPED_SEND_SIZE]
+            self._shaper_send.consume(len(block), self._priority)
+            self.socket().sendall(block)
 
     def close(self):
         self.socket().shutdown(socket.SHUT_WR)
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import zyn.cache
+
+
+# (server id, node id, creation time)
+FILE_1 = (7, 1, 1700000000)
+FILE_2 = (7, 2, 1700000000)
+
+
+class TestBlockCache(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_blocks_are_keyed_by_revision(self):
+        cache = zyn.cache.BlockCache(max_size=100)
+        cache.put(FILE_1, 2, 0, b'data')
+        self.assertEqual(cache.get(FILE_1, 2, 0), b'data')
+        self.assertIsNone(cache.get(FILE_1, 3, 0))
+        self.assertIsNone(cache.get(FILE_1, 2, 1))
+        metrics = cache.metrics()
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['misses'], 2)
+
+    def test_least_recently_used_block_is_evicted(self):
+        cache = zyn.cache.BlockCache(max_size=10)
+        cache.put(FILE_1, 1, 0, b'a' * 4)
+        cache.put(FILE_1, 1, 1, b'b' * 4)
+        cache.get(FILE_1, 1, 0)
+        cache.put(FILE_1, 1, 2, b'c' * 4)
+        self.assertEqual(cache.get(FILE_1, 1, 0), b'a' * 4)
+        self.assertIsNone(cache.get(FILE_1, 1, 1))
+        self.assertEqual(cache.size(), 8)
+        self.assertEqual(cache.metrics()['evictions'], 1)
+
+    def test_invalidate(self):
+        cache = zyn.cache.BlockCache(max_size=100)
+        cache.put(FILE_1, 1, 0, b'a')
+        cache.put(FILE_2, 1, 0, b'b')
+        cache.invalidate(FILE_1)
+        self.assertIsNone(cache.get(FILE_1, 1, 0))
+        self.assertEqual(cache.get(FILE_2, 1, 0), b'b')
+        self.assertEqual(cache.metrics()['invalidations'], 1)
+
+    def test_blocks_are_kept_on_disk(self):
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name, max_size_on_disk=10)
+        cache.put(FILE_1, 1, 0, b'a' * 4)
+        cache.put(FILE_1, 1, 1, b'b' * 4)
+
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name, max_size_on_disk=10)
+        self.assertEqual(cache.get(FILE_1, 1, 0), b'a' * 4)
+        self.assertEqual(cache.metrics()['disk-hits'], 1)
+        cache.put(FILE_1, 1, 2, b'c' * 4)
+        self.assertEqual(cache.size_on_disk(), 8)
+        self.assertEqual(
+            sorted(os.listdir(self._dir.name)),
+            ['7-1-1700000000-1-0', '7-1-1700000000-1-2'],
+        )
+
+    def test_recreated_file_and_other_server_are_not_read_from_disk(self):
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name)
+        cache.put(FILE_1, 0, 0, b'a')
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name)
+        self.assertIsNone(cache.get((7, 1, 1700000001), 0, 0))
+        self.assertIsNone(cache.get((8, 1, 1700000000), 0, 0))
+        self.assertEqual(cache.get(FILE_1, 0, 0), b'a')
+
+    def test_blocks_without_file_identity_are_removed(self):
+        with open(os.path.join(self._dir.name, '1-0-0'), 'wb') as fp:
+            fp.write(b'a')
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name)
+        self.assertEqual(os.listdir(self._dir.name), [])
+        self.assertEqual(cache.size_on_disk(), 0)
+
+    def test_large_files_are_kept_only_on_disk(self):
+        cache = zyn.cache.BlockCache(
+            max_size=100,
+            path=self._dir.name,
+            max_size_on_disk=100,
+            max_file_size_in_memory=10,
+        )
+        cache.put(FILE_1, 1, 0, b'a' * 4, file_size=8)
+        cache.put(FILE_2, 1, 0, b'b' * 4, file_size=20)
+        self.assertEqual(cache.size(), 4)
+        self.assertEqual(cache.size_on_disk(), 8)
+        self.assertEqual(cache.get(FILE_2, 1, 0, file_size=20), b'b' * 4)
+        self.assertEqual(cache.size(), 4)
+
+    def test_concurrent_readers_wait_for_first_fill(self):
+        cache = zyn.cache.BlockCache(max_size=100)
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (None, True))
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(cache.get_or_lock(FILE_1, 1, 0)))
+        waiter.start()
+        while cache.metrics()['fill-waits'] == 0:
+            waiter.join(0.01)
+        cache.put(FILE_1, 1, 0, b'data')
+        cache.release(FILE_1, 1, 0)
+        waiter.join()
+        self.assertEqual(results, [(b'data', False)])
+        self.assertEqual(cache.metrics()['misses'], 1)
+
+    def test_failed_fill_is_passed_to_next_reader(self):
+        cache = zyn.cache.BlockCache(max_size=100)
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (None, True))
+        cache.release(FILE_1, 1, 0)
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (None, True))
+        cache.release(FILE_1, 1, 0)
+
+    def test_reader_does_not_wait_for_stuck_fill(self):
+        cache = zyn.cache.BlockCache(max_size=100, fill_wait_timeout=0.01)
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (None, True))
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (None, False))
+        self.assertEqual(cache.metrics()['fill-wait-timeouts'], 1)
+
+    def test_blocks_on_disk_are_filled_once(self):
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name)
+        cache.put(FILE_1, 1, 0, b'data', file_size=100)
+        cache = zyn.cache.BlockCache(max_size=100, path=self._dir.name)
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (b'data', False))
+        self.assertEqual(cache.get_or_lock(FILE_1, 1, 0), (b'data', False))
+        self.assertEqual(cache.metrics()['disk-hits'], 1)
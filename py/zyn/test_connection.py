@@ -1,6 +1,13 @@
+import contextlib
+import io
+import threading
+import time
 import unittest
 
+import zyn.cache
 import zyn.connection
+import zyn.errors
+import zyn.exception
 
 
 class TestConnection(unittest.TestCase):
@@ -99,3 +106,655 @@ class TestNotification(unittest.TestCase):
     def test_get_field(self):
         n = self._notification_with_uint_field()
         self.assertEqual(n.field(0).as_uint(), 5)
+
+
+class FakeSocket:
+    def __init__(self, responses=None):
+        self.sent = []
+        self._responses = list(responses or [])
+
+    def add_response(self, msg):
+        self._responses.append(msg)
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def recv(self, size=None):
+        if not self._responses:
+            return None
+        return self._responses.pop(0).encode('utf-8')
+
+
+class TestPathNodeIdCache(unittest.TestCase):
+    def test_root_is_known(self):
+        cache = zyn.connection.PathNodeIdCache()
+        self.assertEqual(cache.node_id('/'), 0)
+
+    def test_learn_and_invalidate_descendants(self):
+        cache = zyn.connection.PathNodeIdCache()
+        cache.learn('/dir', 1)
+        cache.learn('/dir/file', 2)
+        cache.learn('/dir-2', 3)
+        cache.invalidate(path='/dir')
+        self.assertIsNone(cache.node_id('/dir'))
+        self.assertIsNone(cache.node_id('/dir/file'))
+        self.assertIsNone(cache.path(2))
+        self.assertEqual(cache.node_id('/dir-2'), 3)
+
+    def test_invalidate_with_node_id(self):
+        cache = zyn.connection.PathNodeIdCache()
+        cache.learn('/file', 4)
+        cache.invalidate(node_id=4)
+        self.assertIsNone(cache.node_id('/file'))
+
+    def test_relearning_node_id_replaces_old_path(self):
+        cache = zyn.connection.PathNodeIdCache()
+        cache.learn('/file-1', 4)
+        cache.learn('/file-2', 4)
+        self.assertIsNone(cache.node_id('/file-1'))
+        self.assertEqual(cache.path(4), '/file-2')
+
+    def test_least_recently_used_path_is_evicted(self):
+        cache = zyn.connection.PathNodeIdCache(max_number_of_paths=3)
+        cache.learn('/file-1', 1)
+        cache.learn('/file-2', 2)
+        cache.node_id('/file-1')
+        cache.learn('/file-3', 3)
+        self.assertEqual(cache.node_id('/'), 0)
+        self.assertEqual(cache.node_id('/file-1'), 1)
+        self.assertIsNone(cache.node_id('/file-2'))
+
+    def test_expired_path_is_forgotten(self):
+        cache = zyn.connection.PathNodeIdCache(max_age=0)
+        cache.learn('/file', 4)
+        self.assertIsNone(cache.node_id('/file'))
+        self.assertIsNone(cache.path(4))
+        self.assertEqual(cache.node_id('/'), 0)
+
+
+class TestPathResolution(unittest.TestCase):
+    RSP_CHILDREN = 'V:1;RSP:T:U:1;;U:0;;L:U:1;LE:U:0;S:U:4;B:file;;N:U:5;;U:3;U:1;U:4;U:0;;;E:;'
+    RSP_OPEN = 'V:1;RSP:T:U:{};;U:0;;N:U:5;;U:3;U:4;U:1024;U:1;E:;'
+    RSP_ERROR = 'V:1;RSP:T:U:{};;U:{};;E:;'
+
+    def _connection(self, responses):
+        socket = FakeSocket(responses)
+        connection = zyn.connection.ZynConnection(socket)
+        connection.enable_path_resolution()
+        return connection, socket
+
+    def test_path_learned_from_listing_is_sent_as_node_id(self):
+        c, socket = self._connection([self.RSP_CHILDREN, self.RSP_OPEN.format(2)])
+        c.query_fs_children(path='/')
+        rsp = c.open_file_read(path='/file')
+        self.assertFalse(rsp.is_error())
+        self.assertIn(b'F:N:U:5;;;', socket.sent[-1])
+
+    def test_stale_node_id_is_retried_with_path(self):
+        c, socket = self._connection([
+            self.RSP_CHILDREN,
+            self.RSP_ERROR.format(2, zyn.errors.InvalidNodeId),
+            self.RSP_OPEN.format(3),
+        ])
+        c.query_fs_children(path='/')
+        rsp = c.open_file_read(path='/file')
+        self.assertFalse(rsp.is_error())
+        self.assertIn(b'F:P:S:U:5;B:/file;;;', socket.sent[-1])
+
+    def test_expired_node_id_is_not_used(self):
+        # Node id of deleted file may have been given to a file created elsewhere
+        socket = FakeSocket([self.RSP_CHILDREN, self.RSP_OPEN.format(2)])
+        c = zyn.connection.ZynConnection(socket)
+        c.enable_path_resolution(max_age=0)
+        c.query_fs_children(path='/')
+        c.open_file_read(path='/file')
+        self.assertIn(b'F:P:S:U:5;B:/file;;;', socket.sent[-1])
+
+    def test_delete_invalidates_path(self):
+        c, socket = self._connection([self.RSP_CHILDREN, self.RSP_ERROR.format(2, 0)])
+        c.query_fs_children(path='/')
+        c.delete(path='/file')
+        self.assertIsNone(c.path_cache().node_id('/file'))
+
+
+# Returns only notifications when polled without timeout
+class FakeNotifyingSocket(FakeSocket):
+    def __init__(self, responses=None):
+        super().__init__(responses)
+        self._timeout = None
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self, size=None):
+        if self._timeout == 0 and not (
+                self._responses and self._responses[0].startswith('V:1;NOTIFICATION')
+        ):
+            return None
+        return super().recv(size)
+
+
+class TestOpenHandleCache(unittest.TestCase):
+    RSP_OPEN = 'V:1;RSP:T:U:{};;U:0;;N:U:{};;U:3;U:4;U:1024;U:1;E:;'
+    RSP_CLOSE = 'V:1;RSP:T:U:{};;U:0;;E:;'
+    NOTIFICATION_MODIFIED = 'V:1;NOTIFICATION:;F-MOD:N:U:{};;U:4;BL:U:0;U:10;;;E:;'
+
+    def _connection(self, responses, max_number_of_handles=2):
+        socket = FakeNotifyingSocket(responses)
+        connection = zyn.connection.ZynConnection(socket)
+        connection.enable_open_handle_cache(max_number_of_handles)
+        return connection, socket
+
+    def test_handle_is_reused(self):
+        c, socket = self._connection([self.RSP_OPEN.format(1, 5)])
+        for _ in range(2):
+            rsp = c.open_read_handle(node_id=5)
+            self.assertEqual(rsp.as_open_rsp().node_id, 5)
+            self.assertIsNone(c.release_read_handle(5))
+        self.assertEqual(len(socket.sent), 1)
+        self.assertEqual(c.open_handle_cache().number_of_hits(), 1)
+        self.assertEqual(c.open_handle_cache().number_of_misses(), 1)
+
+    def test_least_recently_used_handle_is_closed(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(1, 5),
+            self.RSP_OPEN.format(2, 6),
+            self.RSP_OPEN.format(3, 7),
+            self.RSP_CLOSE.format(4),
+        ])
+        c.open_read_handle(node_id=5)
+        c.open_read_handle(node_id=6)
+        c.open_read_handle(node_id=5)
+        c.open_read_handle(node_id=7)
+        self.assertIn(b'CLOSE:T:U:4;;N:U:6;;;E:;', socket.sent[-1])
+        self.assertTrue(c.open_handle_cache().is_cached(5))
+        self.assertFalse(c.open_handle_cache().is_cached(6))
+
+    def test_modified_file_is_reopened(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(1, 5),
+            self.NOTIFICATION_MODIFIED.format(5),
+            self.RSP_CLOSE.format(2),
+            self.RSP_OPEN.format(3, 5),
+        ])
+        c.open_read_handle(node_id=5)
+        c.open_read_handle(node_id=5)
+        self.assertEqual(len(socket.sent), 3)
+        self.assertEqual(c.open_handle_cache().number_of_misses(), 2)
+        self.assertIsNone(c.pop_notification())
+
+    def test_open_for_writing_closes_cached_handle(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(1, 5),
+            self.RSP_CLOSE.format(2),
+            self.RSP_OPEN.format(3, 5),
+        ])
+        c.open_read_handle(node_id=5)
+        rsp = c.open_file_write(node_id=5)
+        self.assertFalse(rsp.is_error())
+        self.assertIn(b'CLOSE:', socket.sent[1])
+        self.assertFalse(c.open_handle_cache().is_cached(5))
+
+
+# Responses to queries connection makes when file is opened with block cache
+RSP_QUERY_SERVER_ID = 'V:1;RSP:T:U:{};;U:0;;L:U:1;LE:KVP:S:U:9;B:server-id;;U:7;;;;E:;'
+RSP_QUERY_CREATED_AT = 'V:1;RSP:T:U:{};;U:0;;L:U:1;LE:KVP:S:U:10;B:created-at;;U:{};;;;E:;'
+
+
+class TestBlockCacheReads(unittest.TestCase):
+    RSP_OPEN = 'V:1;RSP:T:U:1;;U:0;;N:U:5;;U:3;U:12;U:8;U:0;E:;'
+    RSP_READ = 'V:1;RSP:T:U:{};;U:0;;U:{};BL:U:{};U:{};;E:;'
+    RSP_CLOSE = 'V:1;RSP:T:U:{};;U:0;;E:;'
+    NOTIFICATION_MODIFIED = 'V:1;NOTIFICATION:;F-MOD:N:U:5;;U:4;BL:U:0;U:2;;;E:;'
+
+    def _connection(self, responses, cache=None):
+        socket = FakeNotifyingSocket([
+            self.RSP_OPEN,
+            RSP_QUERY_SERVER_ID.format(2),
+            RSP_QUERY_CREATED_AT.format(3, 1700000000),
+        ] + responses)
+        connection = zyn.connection.ZynConnection(socket)
+        connection.set_block_cache(cache or zyn.cache.BlockCache())
+        connection.open_file_read(node_id=5)
+        socket.sent.clear()
+        return connection, socket
+
+    def test_blocks_are_read_through_cache(self):
+        c, socket = self._connection([
+            self.RSP_READ.format(4, 3, 0, 8), 'abcdefgh',
+            self.RSP_READ.format(6, 3, 8, 4), 'ijkl',
+        ])
+        rsp, data = c.read_file(5, 2, 4)
+        self.assertEqual(data, b'cdef')
+        self.assertEqual(rsp.field(1).as_block(), (2, 4))
+        rsp, data = c.read_file(5, 0, 8)
+        self.assertEqual(data, b'abcdefgh')
+        self.assertEqual(rsp.field(0).as_uint(), 3)
+
+        fp = io.BytesIO()
+        c.read_file_stream(5, 0, 12, 8, zyn.connection.InputFileStream(fp))
+        self.assertEqual(fp.getvalue(), b'abcdefghijkl')
+        self.assertEqual(len(socket.sent), 2)
+        self.assertEqual(c.block_cache().metrics()['hits'], 2)
+
+        # Unaligned range is split at block boundary
+        fp = io.BytesIO()
+        c.read_file_stream(5, 6, 6, 8, zyn.connection.InputFileStream(fp))
+        self.assertEqual(fp.getvalue(), b'ghijkl')
+        self.assertEqual(len(socket.sent), 2)
+
+    def test_notification_invalidates_blocks(self):
+        c, socket = self._connection([
+            self.RSP_READ.format(4, 3, 0, 8), 'abcdefgh',
+            self.NOTIFICATION_MODIFIED,
+            self.RSP_READ.format(5, 4, 0, 8), 'xycdefgh',
+        ])
+        c.read_file(5, 0, 8)
+        rsp, data = c.read_file(5, 0, 2)
+        self.assertEqual(data, b'xy')
+        self.assertEqual(rsp.field(0).as_uint(), 4)
+        self.assertIsNotNone(c.pop_notification())
+
+    def test_reopened_file_is_read_from_cache(self):
+        c, socket = self._connection([
+            self.RSP_READ.format(4, 3, 0, 8), 'abcdefgh',
+            self.RSP_CLOSE.format(5),
+            self.RSP_OPEN,
+        ])
+        c.read_file(5, 0, 8)
+        c.close_file(5)
+        c.open_file_read(node_id=5)
+        rsp, data = c.read_file(5, 0, 8)
+        self.assertEqual(data, b'abcdefgh')
+        self.assertEqual(len(socket.sent), 3)
+        self.assertEqual(c.block_cache().metrics()['hits'], 1)
+
+    def test_recreated_file_is_not_read_from_cache(self):
+        # Server gives recreated file the node id of deleted file and
+        # starts revisions again from zero
+        c, socket = self._connection([
+            self.RSP_READ.format(4, 3, 0, 8), 'abcdefgh',
+            self.RSP_CLOSE.format(5),
+            self.RSP_OPEN.replace('N:U:5;;U:3;', 'N:U:5;;U:1;'),
+            RSP_QUERY_CREATED_AT.format(7, 1700000001),
+            self.RSP_READ.format(8, 1, 0, 8), 'ABCDEFGH',
+        ])
+        c.read_file(5, 0, 8)
+        c.close_file(5)
+        c.open_file_read(node_id=5)
+        rsp, data = c.read_file(5, 0, 8)
+        self.assertEqual(data, b'ABCDEFGH')
+        self.assertEqual(c.block_cache().metrics()['hits'], 0)
+
+    def test_creation_time_is_queried_after_delete(self):
+        c, socket = self._connection([
+            self.RSP_CLOSE.format(4),
+            self.RSP_CLOSE.format(5),
+            self.RSP_OPEN,
+            RSP_QUERY_CREATED_AT.format(7, 1700000001),
+        ])
+        c.close_file(5)
+        c.delete(node_id=5)
+        c.open_file_read(node_id=5)
+        self.assertIn(b'Q-FS-E:', socket.sent[3])
+
+
+class TestZynFile(unittest.TestCase):
+    RSP_OPEN = 'V:1;RSP:T:U:1;;U:0;;N:U:5;;U:3;U:{};U:8;U:0;E:;'
+    RSP_READ = 'V:1;RSP:T:U:{};;U:0;;U:3;BL:U:{};U:{};;E:;'
+    RSP_OK = 'V:1;RSP:T:U:{};;U:0;;E:;'
+    RSP_OPERATION = 'V:1;RSP-BATCH:T:U:2;;U:0;;U:{};U:{};E:;'
+
+    def _connection(self, responses):
+        socket = FakeNotifyingSocket(responses)
+        return zyn.connection.ZynConnection(socket), socket
+
+    def test_sequential_reads_are_read_ahead(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(12),
+            self.RSP_READ.format(2, 0, 2), 'ab',
+            self.RSP_READ.format(3, 2, 4), 'cdef',
+            self.RSP_READ.format(4, 6, 2), 'gh',
+            self.RSP_READ.format(5, 8, 4), 'ijkl',
+            self.RSP_OK.format(6),
+        ])
+        f = zyn.connection.ZynFile(c, node_id=5, readahead_size=4)
+        self.assertEqual(f.read(2), b'ab')
+        self.assertEqual(f.read(1), b'c')
+        self.assertEqual(f.read(2), b'de')
+        self.assertIn(b'BL:U:2;U:4;;', socket.sent[2])
+        self.assertEqual(f.read(), b'fghijkl')
+        self.assertEqual(f.read(), b'')
+        f.close()
+        self.assertIn(b'CLOSE:', socket.sent[-1])
+
+    def test_buffered_random_access(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(4),
+            self.RSP_READ.format(2, 1, 3), 'bcd',
+            self.RSP_OK.format(3),
+            self.RSP_OPERATION.format(0, 4),
+            self.RSP_OPERATION.format(1, 5),
+            self.RSP_OK.format(4),
+        ])
+        raw = zyn.connection.ZynFile(c, node_id=5, mode='r+b')
+        with io.BufferedRandom(raw) as f:
+            f.seek(1)
+            self.assertEqual(f.read(), b'bcd')
+            f.write(b'efgh')
+            f.seek(0)
+            f.write(b'a')
+            self.assertEqual(f.tell(), 1)
+        self.assertEqual(raw.revision(), 5)
+        self.assertEqual(raw.size(), 8)
+        self.assertEqual(
+            socket.sent[3:7],
+            [b'U:3;BL:U:0;U:1;;E:;', b'a', b'U:3;BL:U:4;U:4;;E:;', b'efgh'],
+        )
+
+    def test_writes_are_split_at_block_boundaries(self):
+        c, socket = self._connection([
+            self.RSP_OPEN.format(6),
+            self.RSP_OK.format(2),
+            self.RSP_OPERATION.format(0, 4),
+            self.RSP_OPERATION.format(1, 5),
+        ])
+        f = zyn.connection.ZynFile(c, node_id=5, mode='r+b', write_behind_size=4)
+        f.seek(2)
+        f.write(b'cd')
+        self.assertEqual(len(socket.sent), 1)
+        f.write(b'efghij')
+        self.assertEqual(
+            socket.sent[2:],
+            [b'U:3;BL:U:2;U:6;;E:;', b'cdefgh', b'U:3;BL:U:8;U:2;;E:;', b'ij'],
+        )
+        with self.assertRaises(io.UnsupportedOperation):
+            f.seek(11)
+            f.write(b'k')
+
+
+class FakePoolConnection:
+    def __init__(self):
+        self.disconnected = False
+        self.limiter = None
+        self.priorities = []
+
+    def disconnect(self):
+        self.disconnected = True
+
+    def set_concurrency_limiter(self, limiter):
+        self.limiter = limiter
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        self.priorities.append(priority)
+        yield
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+
+    def _create(self):
+        c = FakePoolConnection()
+        self.created.append(c)
+        return c
+
+    def test_connections_are_reused(self):
+        pool = zyn.connection.ConnectionPool(self._create, 2)
+        with pool.connection() as c_1:
+            pass
+        with pool.connection() as c_2:
+            self.assertIs(c_1, c_2)
+        self.assertEqual(pool.number_of_connections(), 1)
+
+    def test_connections_are_not_shared(self):
+        pool = zyn.connection.ConnectionPool(self._create, 2)
+        with pool.connection() as c_1:
+            with pool.connection() as c_2:
+                self.assertIsNot(c_1, c_2)
+        self.assertEqual(pool.number_of_connections(), 2)
+
+    def test_connection_is_discarded_after_error(self):
+        pool = zyn.connection.ConnectionPool(self._create, 2)
+        with self.assertRaises(OSError):
+            with pool.connection():
+                raise OSError()
+        self.assertTrue(self.created[0].disconnected)
+        self.assertEqual(pool.number_of_connections(), 0)
+
+        with self.assertRaises(zyn.exception.ZynServerException):
+            with pool.connection():
+                raise zyn.exception.ZynServerException(1, 'error')
+        self.assertEqual(pool.number_of_connections(), 1)
+
+    def test_close(self):
+        pool = zyn.connection.ConnectionPool(self._create, 2)
+        with pool.connection():
+            pass
+        pool.close()
+        self.assertTrue(self.created[0].disconnected)
+        self.assertEqual(pool.number_of_connections(), 0)
+        with self.assertRaises(RuntimeError):
+            with pool.connection():
+                pass
+
+    def test_connections_in_use_are_closed_when_released(self):
+        pool = zyn.connection.ConnectionPool(self._create, 2)
+        with pool.connection():
+            pass
+        with pool.connection() as c:
+            with self.assertRaises(OSError):
+                with pool.connection() as c_failing:
+                    pool.close()
+                    self.assertFalse(c.disconnected)
+                    self.assertFalse(c_failing.disconnected)
+                    raise OSError()
+            self.assertTrue(c_failing.disconnected)
+            self.assertFalse(c.disconnected)
+        self.assertTrue(c.disconnected)
+        self.assertEqual(pool.number_of_connections(), 0)
+
+    def test_close_idle(self):
+        closed = []
+        pool = zyn.connection.ConnectionPool(self._create, 2, close_connection=closed.append)
+        with pool.connection():
+            with pool.connection():
+                pass
+        self.assertEqual(pool.close_idle(60), 0)
+        self.assertEqual(pool.number_of_idle_connections(), 2)
+        self.assertEqual(pool.close_idle(0), 2)
+        self.assertCountEqual(closed, self.created)
+        self.assertEqual(pool.number_of_connections(), 0)
+
+
+class TestRandomAccessBatchEdit(unittest.TestCase):
+    RSP_OK = 'V:1;RSP:T:U:1;;U:0;;E:;'
+    RSP_OPERATION = 'V:1;RSP-BATCH:T:U:1;;U:0;;U:{};U:{};E:;'
+
+    def test_stream_is_written_in_blocks(self):
+        socket = FakeSocket([self.RSP_OK] + [self.RSP_OPERATION.format(i, i + 2) for i in range(4)])
+        connection = zyn.connection.ZynConnection(socket)
+        batch = connection.ra_batch_edit(1, 1)
+        batch.write_stream(0, zyn.connection.DataStream(b'a' * 10 + b'b' * 10 + b'c' * 5), 25, 10)
+        batch.delete(25, 5)
+        self.assertEqual(batch.number_of_operations(), 4)
+
+        rsp = batch.commit().as_batch_edit_response()
+        self.assertEqual(rsp.operation_index, 3)
+        self.assertEqual(rsp.revision, 5)
+        self.assertEqual(
+            socket.sent[1:],
+            [
+                b'U:3;BL:U:0;U:10;;E:;', b'a' * 10,
+                b'U:3;BL:U:10;U:10;;E:;', b'b' * 10,
+                b'U:3;BL:U:20;U:5;;E:;', b'c' * 5,
+                b'U:1;BL:U:25;U:5;;E:;',
+            ],
+        )
+
+    def test_stream_shorter_than_size(self):
+        socket = FakeSocket([self.RSP_OK, self.RSP_OPERATION.format(0, 2)])
+        connection = zyn.connection.ZynConnection(socket)
+        batch = connection.ra_batch_edit(1, 1)
+        batch.write_stream(0, zyn.connection.DataStream(b'a' * 15), 20, 10)
+        with self.assertRaises(RuntimeError):
+            batch.commit()
+
+
+class TestBlockSizeTuner(unittest.TestCase):
+    MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+    def test_server_block_size_is_used_without_measurements(self):
+        tuner = zyn.connection.BlockSizeTuner()
+        self.assertEqual(tuner.block_size(self.MAX_BLOCK_SIZE), self.MAX_BLOCK_SIZE)
+
+    def test_block_size_follows_link_latency(self):
+        # 100 MB/s link with 0.2 ms round trip
+        lan = zyn.connection.BlockSizeTuner(round_trip=0.0002, throughput=100e6)
+        self.assertEqual(lan.block_size(self.MAX_BLOCK_SIZE), 256 * 1024)
+
+        # 10 MB/s link with 50 ms round trip
+        vpn = zyn.connection.BlockSizeTuner(round_trip=0.05, throughput=10e6)
+        self.assertEqual(vpn.block_size(self.MAX_BLOCK_SIZE), self.MAX_BLOCK_SIZE)
+
+    def test_block_size_divides_server_block_size(self):
+        tuner = zyn.connection.BlockSizeTuner(round_trip=0.000001, throughput=1e6)
+        self.assertEqual(tuner.block_size(3 * 1024 * 1024), 3 * 32 * 1024)
+        self.assertEqual(tuner.block_size(1000), 1000)
+
+    def test_measurements(self):
+        tuner = zyn.connection.BlockSizeTuner()
+        tuner.add_round_trip(0.1)
+        tuner.add_round_trip(0.2)
+        self.assertAlmostEqual(tuner.round_trip(), 0.12)
+        tuner.add_transfer(1000, 1.12)
+        self.assertAlmostEqual(tuner.throughput(), 1000)
+
+        copy = zyn.connection.BlockSizeTuner.from_dict(tuner.to_dict())
+        self.assertEqual(copy.round_trip(), tuner.round_trip())
+        self.assertEqual(copy.throughput(), tuner.throughput())
+
+    def test_read_is_measured(self):
+        socket = FakeSocket(['V:1;RSP:T:U:1;;U:0;;U:1;BL:U:0;U:4;;E:;', 'data'])
+        connection = zyn.connection.ZynConnection(socket)
+        tuner = zyn.connection.BlockSizeTuner()
+        connection.set_block_size_tuner(tuner)
+        rsp, data = connection.read_file(1, 0, 4)
+        self.assertEqual(data, b'data')
+        self.assertIsNotNone(tuner.throughput())
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_limit_is_increased_additively(self):
+        limiter = zyn.connection.ConcurrencyLimiter(3)
+        limiter.add_success()
+        self.assertEqual(limiter.limit(), 2)
+        limiter.add_success()
+        self.assertEqual(limiter.limit(), 2)
+        limiter.add_success()
+        self.assertEqual(limiter.limit(), 3)
+        for _ in range(10):
+            limiter.add_success()
+        self.assertEqual(limiter.limit(), 3)
+        self.assertEqual(limiter.metrics()['increases'], 2)
+
+    def test_limit_is_decreased_on_overload(self):
+        limiter = zyn.connection.ConcurrencyLimiter(8, initial_limit=8)
+        limiter.add_overload('error')
+        self.assertEqual(limiter.limit(), 4)
+
+        # Overload of operations started before decrease does not decrease further
+        limiter.add_overload('error')
+        self.assertEqual(limiter.limit(), 4)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        limiter.add_overload('error')
+        self.assertEqual(limiter.limit(), 2)
+
+        decisions = limiter.metrics()['decisions']
+        self.assertEqual([d[1:3] for d in decisions], [('decrease', 4), ('decrease', 2)])
+
+    def test_limit_is_decreased_on_rising_latency(self):
+        limiter = zyn.connection.ConcurrencyLimiter(8, initial_limit=8)
+        for _ in range(5):
+            limiter.add_latency(0.01)
+        self.assertEqual(limiter.limit(), 8)
+        for _ in range(5):
+            limiter.add_latency(0.1)
+        self.assertEqual(limiter.limit(), 4)
+
+    def test_pool_operations_are_limited(self):
+        limiter = zyn.connection.ConcurrencyLimiter(2, initial_limit=2)
+        pool = zyn.connection.ConnectionPool(FakePoolConnection, 2, limiter=limiter)
+        with pool.connection() as c:
+            self.assertIs(c.limiter, limiter)
+            self.assertEqual(limiter.in_flight(), 1)
+
+        with self.assertRaises(zyn.exception.ZynServerException):
+            with pool.connection():
+                raise zyn.exception.ZynServerException(zyn.errors.TooManyFilesOpenError, 'error')
+        self.assertEqual(limiter.limit(), 1)
+        self.assertEqual(limiter.in_flight(), 0)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate_is_limited(self):
+        bucket = zyn.connection.TokenBucket(rate=1000000, burst=10000)
+        started = time.monotonic()
+        for _ in range(6):
+            bucket.consume(10000, zyn.connection.PRIORITY_BULK)
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_interactive_is_served_before_bulk(self):
+        bucket = zyn.connection.TokenBucket(rate=100000, burst=1000)
+        bucket.consume(1000, zyn.connection.PRIORITY_BULK)
+        order = []
+
+        def consume(priority):
+            bucket.consume(1000, priority)
+            order.append(priority)
+
+        bulk = threading.Thread(target=consume, args=(zyn.connection.PRIORITY_BULK,))
+        bulk.start()
+        consume(zyn.connection.PRIORITY_INTERACTIVE)
+        bulk.join()
+        self.assertEqual(order, [zyn.connection.PRIORITY_INTERACTIVE, zyn.connection.PRIORITY_BULK])
+
+    def test_shaper_limits_bulk_separately(self):
+        shaper = zyn.connection.TrafficShaper(max_rate_bulk=1000)
+        self.assertTrue(shaper.is_limited())
+        shaper.consume(10 ** 6, zyn.connection.PRIORITY_INTERACTIVE)
+        self.assertFalse(zyn.connection.TrafficShaper().is_limited())
+
+
+class TestConnectionPoolPriority(unittest.TestCase):
+    def test_interactive_gets_next_free_connection(self):
+        pool = zyn.connection.ConnectionPool(FakePoolConnection, 1)
+        order = []
+
+        def use(priority):
+            with pool.connection(priority) as c:
+                order.append(priority)
+                self.assertEqual(c.priorities[-1], priority)
+
+        with pool.connection():
+            bulk = threading.Thread(target=use, args=(zyn.connection.PRIORITY_BULK,))
+            bulk.start()
+            while pool._number_in_use != 1:
+                time.sleep(0.001)
+            time.sleep(0.01)
+            interactive = threading.Thread(
+                target=use,
+                args=(zyn.connection.PRIORITY_INTERACTIVE,),
+            )
+            interactive.start()
+            while pool._number_of_interactive_waiting != 1:
+                time.sleep(0.001)
+        bulk.join()
+        interactive.join()
+        self.assertEqual(order, [zyn.connection.PRIORITY_INTERACTIVE, zyn.connection.PRIORITY_BULK])
@@ -0,0 +1,46 @@
+import socket
+import unittest
+
+import zyn.connection
+
+try:
+    import zyn.main as main
+except ImportError:
+    main = None
+
+
+@unittest.skipIf(main is None, 'Client dependencies are not installed')
+class TestShellSocket(unittest.TestCase):
+    ARGS = {
+        'max_upload_rate': None,
+        'max_upload_rate_bulk': None,
+        'max_download_rate': None,
+        'max_download_rate_bulk': None,
+    }
+
+    def setUp(self):
+        self._server = socket.socket()
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.addCleanup(self._server.close)
+
+    def _create_socket(self, args):
+        s = main._create_socket(
+            '127.0.0.1',
+            self._server.getsockname()[1],
+            no_tls=True,
+            shapers=main._create_shapers(args),
+        )
+        self.addCleanup(s.close)
+        return s
+
+    def test_unlimited_socket_is_not_shaped(self):
+        s = self._create_socket(self.ARGS)
+        self.assertIsNone(s._shaper_send)
+        self.assertIsNone(s._shaper_receive)
+
+    def test_rates_are_given_in_kib(self):
+        s = self._create_socket(dict(self.ARGS, max_upload_rate=1, max_download_rate_bulk=2))
+        self.assertIsInstance(s._shaper_send, zyn.connection.TrafficShaper)
+        self.assertEqual(s._shaper_send._total.rate(), 1024)
+        self.assertEqual(s._shaper_receive._bulk.rate(), 2 * 1024)
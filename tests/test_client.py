@@ -5,8 +5,10 @@ import os.path
 import random
 import sys
 
+import zyn.client.bulk
 import zyn.client.client
 import zyn.client.data
+import zyn.connection
 import zyn.client.shell
 import zyn.errors
 import zyn.util
@@ -23,21 +25,33 @@ class ClientData:
             path_data,
             connection,
             log,
+            connection_pool=None,
     ):
         self.client_id = client_id
         self.path_workdir = path_workdir
         self.path_data = path_data
         self.path_state_file = path_client_state
         self.log = log
+        self.connection_pool = connection_pool
 
         state = zyn.client.client.State.from_file(path_client_state, log)
-        self.client = zyn.client.client.ZynFilesystemClient(connection, state, log)
+        self.client = zyn.client.client.ZynFilesystemClient(
+            connection,
+            state,
+            log,
+            connection_pool=connection_pool,
+        )
         self.cli = zyn.client.shell.ZynShell(self.client, log)
 
     def restart_client(self, connection):
         self.client._state.to_file(self.path_state_file)
         state = zyn.client.client.State.from_file(self.path_state_file, self.log)
-        self.client = zyn.client.client.ZynFilesystemClient(connection, state, self.log)
+        self.client = zyn.client.client.ZynFilesystemClient(
+            connection,
+            state,
+            self.log,
+            connection_pool=self.connection_pool,
+        )
         self.cli = zyn.client.shell.ZynShell(self.client, self.log)
 
     def validate_local_data(self, expected_elements):
@@ -148,7 +162,7 @@ class TestClient(common.ZynNodeCommon):
         )
         client_state.client.set_connection(connection)
 
-    def _init_client(self, client_id, init_data=True):
+    def _init_client(self, client_id, init_data=True, number_of_pool_connections=None):
         path_clients_data = self._path_clients_data()
         if not os.path.exists(path_clients_data):
             os.mkdir(path_clients_data)
@@ -170,6 +184,12 @@ class TestClient(common.ZynNodeCommon):
             state.to_file(path_client_state)
 
         connection = self._connect_and_authenticate(state)
+        connection_pool = None
+        if number_of_pool_connections is not None:
+            connection_pool = zyn.connection.ConnectionPool(
+                lambda: self._connect_and_authenticate(state),
+                number_of_pool_connections,
+            )
         client_data = ClientData(
             client_id,
             path_client_workdir,
@@ -177,6 +197,7 @@ class TestClient(common.ZynNodeCommon):
             path_client_data,
             connection,
             self.log,
+            connection_pool,
         )
         return client_data
 
@@ -209,6 +230,11 @@ class TestClient(common.ZynNodeCommon):
         self._start_node(init=True, data_dir=self._server_workdir(self._server_workdir_id))
         return self._init_client(client_id)
 
+    def _start_server_and_client_with_pool(self, client_id=0):
+        self._server_workdir_id = 0
+        self._start_node(init=True, data_dir=self._server_workdir(self._server_workdir_id))
+        return self._init_client(client_id, number_of_pool_connections=3)
+
     def _params(self, params):
         params = [p for p in params if p]
         if len(params) > 1:
@@ -509,6 +535,92 @@ class TestClientCreateAndFetch(TestClient):
         self._fetch(state, '/')
 
 
+class TestClientBulkFetch(TestClient):
+    def test_client_bulk_fetch_directory_tree(self):
+        state = self._start_server_and_client_with_pool()
+        self._create_remote_directory(state, '/dir')
+        self._create_remote_directory(state, '/dir/nested')
+        for i in range(10):
+            self._create_remote_ra(state, '/dir/file-ra-{}'.format(i))
+            self._create_remote_blob(state, '/dir/nested/file-blob-{}'.format(i))
+        self._fetch(state, '/')
+        for i in range(10):
+            state.validate_file_state('/dir/file-ra-{}'.format(i), True, True)
+            state.validate_file_state('/dir/nested/file-blob-{}'.format(i), True, True)
+        self.assertTrue(state.connection_pool.number_of_connections() <= 3)
+
+    def test_client_bulk_fetch_large_file_in_ranges(self):
+        state_1 = self._start_server_and_client(client_id=0)
+        data = 'data-' * 100000
+        path = self._create_local_file_and_add_blob(state_1, '/file', data)
+
+        state_2 = self._init_client(client_id=1, number_of_pool_connections=3)
+        range_size = zyn.client.bulk.RANGE_SIZE
+        zyn.client.bulk.RANGE_SIZE = 64 * 1024
+        try:
+            self._fetch(state_2, '/')
+        finally:
+            zyn.client.bulk.RANGE_SIZE = range_size
+
+        state_2.validate_file_state(path, is_tracked=True, exists_locally=True)
+        with open(zyn.util.join_remote_paths([state_2.path_data, path]), 'r') as fp:
+            self.assertEqual(fp.read(), data)
+
+    def test_client_bulk_fetch_conflict_does_not_prevent_fetching_other_files(self):
+        state = self._start_server_and_client_with_pool()
+        path_1 = self._create_remote_ra(state, '/file-1')
+        path_2 = self._create_remote_ra(state, '/file-2')
+        state.create_local_file(path_1)
+        self._fetch(state, '/')
+        state.validate_file_state(path_1, is_tracked=False, exists_locally=True)
+        state.validate_file_state(path_2, is_tracked=True, exists_locally=True)
+
+
+class TestClientRecursiveAdd(TestClient):
+    def _create_local_tree(self, state):
+        state.create_local_directory('/dir/nested')
+        state.create_local_directory('/dir/empty')
+        state.create_local_file('/dir/file-1', 'data-1')
+        state.create_local_file('/dir/nested/file-2', 'data-2' * 1000)
+        state.create_local_file('/dir/nested/file-3')
+        return ['/dir', '/dir/nested', '/dir/empty']
+
+    def _validate_tree(self, state, directories):
+        for path in directories:
+            state.validate_dir_state(path, is_tracked=True, exists_locally=True)
+        for path in ['/dir/file-1', '/dir/nested/file-2', '/dir/nested/file-3']:
+            state.validate_file_state(path, is_tracked=True, exists_locally=True)
+
+        output = self._list(state, '-p /dir/nested')
+        self._validate_list_remote_element(output, 'file-2', element_type='file')
+        self._validate_list_remote_element(output, 'file-3', element_type='file')
+
+    def test_client_add_recursive(self):
+        state = self._start_server_and_client()
+        directories = self._create_local_tree(state)
+        state.cli.do_add('-r -b /dir')
+        self._validate_tree(state, directories)
+
+    def test_client_add_recursive_with_pool(self):
+        state = self._start_server_and_client_with_pool()
+        directories = self._create_local_tree(state)
+        state.cli.do_add('-r -ra /dir')
+        self._validate_tree(state, directories)
+
+    def test_client_add_recursive_adds_untracked_elements_to_tracked_directory(self):
+        state = self._start_server_and_client_with_pool()
+        self._create_local_directory_and_add(state, '/dir')
+        directories = self._create_local_tree(state)
+        state.cli.do_add('-r -b /dir')
+        self._validate_tree(state, directories)
+
+    def test_client_add_recursive_requires_file_type(self):
+        state = self._start_server_and_client()
+        self._create_local_tree(state)
+        with self.assertRaises(zyn.client.data.ZynClientException):
+            state.cli.do_add('-r /dir')
+
+
 class TestClientSync(TestClient):
     def _edit_and_sync_file_validate_revision_increased(
             self,